@@ -1,6 +1,7 @@
 import uuid  # 添加缺失的uuid导入
 import warnings
 
+import numpy as np
 from docx import Document
 from typing import List, Optional, Callable
 from langchain_ollama import OllamaEmbeddings
@@ -8,20 +9,123 @@ from langchain_community.vectorstores import FAISS
 from langchain.schema import Document as LangchainDocument
 import os
 
-from lianxi.load_text.file_parse.file_parse import parse_file_with_unstructured
+from lianxi.load_text.file_parse.file_parse import parse_file
+
+
+class NodeStore:
+    """
+    一棵树所有节点的集中存储
+
+    节点按插入顺序编号(node_id)，build_tree 按文档顺序插入节点，因此编号即先序遍历顺序。
+    所有节点的向量存放在同一个 float32 矩阵中，第 node_id 行即该节点的向量，
+    避免每个节点各自持有一个 Python list。
+    """
+    __slots__ = ('nodes', 'embeddings', 'has_embedding')
+
+    def __init__(self):
+        self.nodes: List['TreeNode'] = []
+        self.embeddings: Optional[np.ndarray] = None
+        self.has_embedding: Optional[np.ndarray] = None
+
+    def register(self, node: 'TreeNode') -> int:
+        self.nodes.append(node)
+        return len(self.nodes) - 1
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _ensure_capacity(self, dim: int, min_rows: int) -> None:
+        if self.embeddings is None:
+            rows = max(min_rows, len(self.nodes))
+            self.embeddings = np.zeros((rows, dim), dtype=np.float32)
+            self.has_embedding = np.zeros(rows, dtype=bool)
+        elif self.embeddings.shape[0] < min_rows:
+            # 容量按倍数扩展，摊还后每次插入为 O(1)
+            rows = max(min_rows, self.embeddings.shape[0] * 2, len(self.nodes))
+            embeddings = np.zeros((rows, self.embeddings.shape[1]), dtype=np.float32)
+            embeddings[:self.embeddings.shape[0]] = self.embeddings
+            has_embedding = np.zeros(rows, dtype=bool)
+            has_embedding[:self.has_embedding.shape[0]] = self.has_embedding
+            self.embeddings, self.has_embedding = embeddings, has_embedding
+
+    def set_embeddings(self, node_ids, vectors) -> None:
+        """批量写入向量，node_ids 与 vectors 一一对应"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        self._ensure_capacity(vectors.shape[1], int(node_ids.max()) + 1)
+        self.embeddings[node_ids] = vectors
+        self.has_embedding[node_ids] = True
+
+    def get_embedding(self, node_id: int) -> Optional[np.ndarray]:
+        if self.embeddings is None or node_id >= len(self.has_embedding) or not self.has_embedding[node_id]:
+            return None
+        return self.embeddings[node_id]
+
 
 # 新增向量化功能
 class TreeNode:
     """树节点类，表示投标文件的章节结构"""
-    def __init__(self, title: str, content: str = "", level: int = 0):
+    # 使用 __slots__ 去掉每个实例的 __dict__，超大文档中节点数量可达数万
+    __slots__ = ('title', 'level', 'children', 'parent', 'store', 'node_id',
+                 '_content_parts', '_content', '_title_path', '_doc_id')
+
+    def __init__(self, title: str, content: str = "", level: int = 0, store: NodeStore = None):
         self.title = title        # 节点标题（小标题）
-        self.title_path = ''      # 连接多层级标题
-        self.content = content    # 节点内容（段落文本）
-        self.embedding = None     # 节点向量表示
         self.level = level
         self.children: List['TreeNode'] = []  # 子节点列表
         self.parent: TreeNode | None = None # 父节点
-        self.doc_id = str(uuid.uuid4())  # 为FAISS向量库准备的文档ID
+        self.store = store if store is not None else NodeStore()
+        self.node_id = self.store.register(self)
+        # 节点内容（段落文本）以片段列表累积，读取时才拼接，避免反复 += 造成的平方复杂度
+        self._content_parts: List[str] = [content] if content else []
+        self._content: Optional[str] = None
+        self._title_path: Optional[str] = None  # 连接多层级标题，首次读取时计算
+        self._doc_id: Optional[str] = None
+
+    @property
+    def content(self) -> str:
+        if self._content is None:
+            self._content = "".join(self._content_parts)
+            self._content_parts = [self._content] if self._content else []
+        return self._content
+
+    @content.setter
+    def content(self, value: str) -> None:
+        self._content_parts = [value] if value else []
+        self._content = value
+
+    def append_content(self, text: str) -> None:
+        self._content_parts.append(text)
+        self._content = None
+
+    @property
+    def title_path(self) -> str:
+        """由父节点的 title_path 递推得到，每个节点只计算一次"""
+        if self._title_path is None:
+            if self.parent is None:
+                self._title_path = ''
+            else:
+                parent_path = self.parent.title_path
+                self._title_path = f"{parent_path}-{self.title}" if parent_path else self.title
+        return self._title_path
+
+    @property
+    def doc_id(self) -> str:
+        """为FAISS向量库准备的文档ID，首次使用时生成"""
+        if self._doc_id is None:
+            self._doc_id = str(uuid.uuid4())
+        return self._doc_id
+
+    @property
+    def embedding(self) -> Optional[np.ndarray]:
+        """节点向量表示，实际存放在 NodeStore 的向量矩阵中"""
+        return self.store.get_embedding(self.node_id)
+
+    @embedding.setter
+    def embedding(self, value) -> None:
+        self.store.set_embeddings([self.node_id], [value])
 
     def generate_embedding(self, embed_model: OllamaEmbeddings) -> None:
         """生成节点内容的向量表示"""
@@ -42,55 +146,22 @@ class TreeNode:
         return f"TreeNode(title='{self.title}', content='{self.content[:20]}...', children={len(self.children)})"
 
     def add_node(self, title: str, content: str = ""):
-        node = TreeNode(title, content, self.level + 1)
+        node = TreeNode(title, content, self.level + 1, store=self.store)
         self.children.append(node)
         node.parent = self
-
-        # 拼接全部层级的title
-        title_ls = []
-        temp_node = node
-        if temp_node.parent:
-            while temp_node.parent is not None:
-                title_ls.append(temp_node.title)
-                temp_node = temp_node.parent
-            title_ls.reverse()
-            title_path = '-'.join(title_ls)
-            node.title_path = title_path
         return node
 
 
 class TreeBuilder:
     """Word文件树结构构建器"""
-    def __init__(self, doc_path: str):
-        self.doc = parse_file_with_unstructured(doc_path)  # 加载Word文档
+    def __init__(self, doc_path: str, doc: dict = None):
+        self.doc_path = doc_path
+        # 已解析的结果(如从缓存加载)可直接传入，跳过解析
+        self.doc = doc if doc is not None else parse_file(doc_path)  # 加载Word文档
         self.root = TreeNode("根节点")  # 根节点
+        self.store = self.root.store  # 全部节点及向量矩阵
         self.current_nodes = {0: self.root}  # 当前层级节点映射表
-        # self.embed_model = OllamaEmbeddings(model="bge-m3:latest")  # 使用的嵌入模型
-        # self.vector_store = self._init_vector_store()  # 初始化向量库
         self.node_map = {}  # 用于存储节点与ID的映射
-        
-    def _init_vector_store(self) -> FAISS:
-        """初始化FAISS向量库"""
-        kb_path = os.path.join(os.path.dirname(doc_path), "faiss_index")
-        os.makedirs(kb_path, exist_ok=True)
-        
-        if os.path.exists(os.path.join(kb_path, "index.faiss")):
-            return FAISS.load_local(
-                kb_path, 
-                self.embed_model, 
-                distance_strategy="METRIC_INNER_PRODUCT",
-                allow_dangerous_deserialization=True
-            )
-        
-        # 创建初始向量库
-        init_doc = self.root.to_langchain_document()
-        vector_store = FAISS.from_documents(
-            [init_doc], 
-            self.embed_model,
-            distance_strategy="METRIC_INNER_PRODUCT"
-        )
-        vector_store.save_local(kb_path)
-        return vector_store
 
     def _detech_abstrect(self, element, current_level: int):
         """标题之前皆为摘要内容"""
@@ -110,7 +181,7 @@ class TreeBuilder:
                 continue
             if zhaiyao := self._detech_abstrect(ele, current_level):
                 # 第一个标题之前的内容，封面、目录、摘要等,均存放在root节点中
-                self.root.content += zhaiyao + "\n"
+                self.root.append_content(zhaiyao + "\n")
                 continue
             if ele.category == "Title":
                 # 标题
@@ -149,22 +220,19 @@ class TreeBuilder:
                 if ele.metadata.parent_id:
                     # 有可能当前文档的parent_id不是当前node，如果有这种问题，后续都会出现异常
                     node = self.node_map.get(ele.metadata.parent_id)
-                    node.content += ele.text + "\n"
                     if node is None:
                         warnings.warn(f"Parent ID {ele.metadata.parent_id} not found for element ID {ele.id}. content: {ele.text}. Skipping.")
                         continue
+                    node.append_content(ele.text + "\n")
                 else:
                     # 如果有文档没有parent_id，则自动更新到当前node中
-                    current_node.content += ele.text + "\n"
+                    current_node.append_content(ele.text + "\n")
         return self
 
-    def _process_node_for_vectorization(self, level: int):
-        """处理节点的向量化和存储"""
-        node = self.current_nodes[level]
-        if node.content:
-            node.generate_embedding(self.embed_model)
-            langchain_doc = node.to_langchain_document()
-            self.vector_store.add_documents([langchain_doc])
+    def build_index(self, embed_model: OllamaEmbeddings, batch_size: int = 32):
+        """构建分层检索索引，需先调用 build_tree"""
+        from lianxi.doc_tree.tree_index import DocTreeIndex
+        return DocTreeIndex(self, embed_model, batch_size=batch_size).build()
 
     def dfs_iterative(self, visit:Callable[[TreeNode], None]):
         stack = [self.root]
@@ -194,10 +262,9 @@ if __name__ == "__main__":
     print_tree(tree_root)
     tree.dfs_iterative(view)
     
-    # # 测试向量搜索
-    # query = "技术方案要求"
-    # query_vector = builder.embed_model.embed_query(query)
-    # results = builder.vector_store.similarity_search_by_vector(query_vector, k=3)
+    # 测试向量搜索
+    # index = tree.build_index(OllamaEmbeddings(model="bge-m3:latest"))
+    # results = index.search("技术方案要求", k=3)
     # print("\n相关段落搜索结果:")
     # for i, result in enumerate(results, 1):
-    #     print(f"{i}. {result.metadata['title']}: {result.page_content[:100]}...")
+    #     print(f"{i}. {result['title_path']}: {result['section_text'][:100]}...")
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List, Optional
+
+import numpy as np
+
+from lianxi.doc_tree.doc_tree import TreeBuilder, TreeNode
+from lianxi.load_text.file_parse.fast_parse import FAST_PARSER_VERSION, supports_fast_parse
+from lianxi.load_text.file_parse.file_parse import PARSER_VERSION
+
+try:
+    from unstructured.__version__ import __version__ as unstructured_version
+except ImportError:
+    unstructured_version = "unknown"
+
+CACHE_FORMAT_VERSION = 2
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent / "tree_cache"
+# 缓存目录总大小上限，超出时按最近使用时间淘汰；缓存按文件内容哈希命名，文件修改后旧条目不会再被命中，不淘汰会一直增长
+DEFAULT_MAX_CACHE_BYTES = 1 << 30
+
+
+class CachedElement:
+    """
+    从缓存恢复的解析元素，只保留 build_tree 用到的字段，
+    与 unstructured 的 Element 接口兼容(id/category/text/metadata.category_depth/metadata.parent_id)
+    """
+    __slots__ = ('id', 'category', 'text', 'metadata')
+
+    def __init__(self, id: str, category: str, text: str, category_depth: Optional[int], parent_id: Optional[str]):
+        self.id = id
+        self.category = category
+        self.text = text
+        self.metadata = SimpleNamespace(category_depth=category_depth, parent_id=parent_id)
+
+
+def file_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """按内容计算文件哈希，文件改名或移动后缓存仍然有效"""
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(digest: str, parser: str) -> str:
+    """
+    缓存键由文件内容哈希和实际使用的解析器版本组成，unstructured 的结果还要区分 unstructured 版本
+    """
+    if parser == PARSER_VERSION:
+        return f"{digest[:32]}-{parser}-{unstructured_version}"
+    return f"{digest[:32]}-{parser}"
+
+
+def _pack_strings(strings: List[Optional[str]]):
+    """字符串列表 -> (utf-8字节数组, 偏移数组)，None 以空串保存"""
+    encoded = [(s or "").encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def _unpack_strings(blob: np.ndarray, offsets: np.ndarray) -> List[str]:
+    data = blob.tobytes()
+    offsets = offsets.tolist()
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+def save_tree(builder: TreeBuilder, cache_path: str) -> None:
+    """
+    将构建好的树和解析元素保存为 npz，所有字段都是定长数组或字节数组，不依赖 pickle。
+    meta 中记录实际使用的解析器(builder.doc["parser_version"])
+    """
+    nodes = builder.store.nodes
+    elements = builder.doc.get("elements", [])
+    categories = sorted({ele.category for ele in elements})
+    category_codes = {c: i for i, c in enumerate(categories)}
+    # node_map 的反向映射：创建该节点的标题元素ID
+    node_elem_ids = [""] * len(nodes)
+    for elem_id, node in builder.node_map.items():
+        node_elem_ids[node.node_id] = elem_id
+
+    meta = {
+        "format": CACHE_FORMAT_VERSION,
+        "parser_version": builder.doc.get("parser_version"),
+        "fallback_from": builder.doc.get("fallback_from"),
+        "unstructured_version": unstructured_version,
+        "file_path": builder.doc.get("file_path", builder.doc_path),
+        "file_extension": builder.doc.get("file_extension", ""),
+        "element_types": builder.doc.get("element_types", {}),
+        "categories": categories,
+    }
+    arrays = {
+        "meta": np.frombuffer(json.dumps(meta, ensure_ascii=False).encode('utf-8'), dtype=np.uint8),
+        "node_parent": np.array([n.parent.node_id if n.parent is not None else -1 for n in nodes], dtype=np.int32),
+        "elem_category": np.array([category_codes[e.category] for e in elements], dtype=np.uint8),
+        "elem_depth": np.array([e.metadata.category_depth if e.metadata.category_depth is not None else -1
+                                for e in elements], dtype=np.int16),
+    }
+    for name, strings in (("node_title", [n.title for n in nodes]),
+                          ("node_content", [n.content for n in nodes]),
+                          ("node_elem_id", node_elem_ids),
+                          ("elem_id", [e.id for e in elements]),
+                          ("elem_text", [e.text for e in elements]),
+                          ("elem_parent", [e.metadata.parent_id for e in elements])):
+        arrays[f"{name}_blob"], arrays[f"{name}_offsets"] = _pack_strings(strings)
+
+    store = builder.store
+    if store.embeddings is not None:
+        arrays["embeddings"] = store.embeddings[:len(nodes)]
+        arrays["has_embedding"] = store.has_embedding[:len(nodes)]
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # 先写临时文件再替换，避免并发读取到写了一半的缓存
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, cache_path)
+
+
+def load_tree(cache_path: str, doc_path: str = None) -> TreeBuilder:
+    """从缓存恢复 TreeBuilder，恢复后的树与 build_tree 的结果一致"""
+    with np.load(cache_path, allow_pickle=False) as data:
+        meta = json.loads(data["meta"].tobytes().decode('utf-8'))
+        strings = {name: _unpack_strings(data[f"{name}_blob"], data[f"{name}_offsets"])
+                   for name in ("node_title", "node_content", "node_elem_id", "elem_id", "elem_text", "elem_parent")}
+        node_parent = data["node_parent"].tolist()
+        elem_category = data["elem_category"].tolist()
+        elem_depth = data["elem_depth"].tolist()
+        embeddings = data["embeddings"] if "embeddings" in data.files else None
+        has_embedding = data["has_embedding"] if "has_embedding" in data.files else None
+
+    categories = meta["categories"]
+    elements = [
+        CachedElement(id=strings["elem_id"][i],
+                      category=categories[elem_category[i]],
+                      text=strings["elem_text"][i],
+                      category_depth=elem_depth[i] if elem_depth[i] >= 0 else None,
+                      parent_id=strings["elem_parent"][i] or None)
+        for i in range(len(elem_category))
+    ]
+    doc = {
+        "parser_version": meta.get("parser_version"),
+        "fallback_from": meta.get("fallback_from"),
+        "file_path": meta["file_path"],
+        "file_extension": meta["file_extension"],
+        "total_elements": len(elements),
+        "element_types": meta["element_types"],
+        "elements": elements,
+    }
+    builder = TreeBuilder(doc_path or meta["file_path"], doc=doc)
+
+    # 节点按编号顺序(先序)恢复，子节点顺序与原树一致
+    nodes: List[TreeNode] = [builder.root]
+    builder.root.title = strings["node_title"][0]
+    builder.root.content = strings["node_content"][0]
+    for i in range(1, len(node_parent)):
+        node = nodes[node_parent[i]].add_node(strings["node_title"][i], strings["node_content"][i])
+        nodes.append(node)
+    for node, elem_id in zip(nodes, strings["node_elem_id"]):
+        if elem_id:
+            builder.node_map[elem_id] = node
+
+    if embeddings is not None:
+        ids = np.flatnonzero(has_embedding)
+        builder.store.set_embeddings(ids, embeddings[ids])
+    return builder
+
+
+def _cache_candidates(doc_path: str, digest: str, cache_dir) -> List[str]:
+    """按解析器优先顺序可能命中的缓存文件：能快速解析的文件先找快速解析的结果，再找回退到 unstructured 的结果"""
+    parsers = [FAST_PARSER_VERSION, PARSER_VERSION] if supports_fast_parse(doc_path) else [PARSER_VERSION]
+    return [os.path.join(cache_dir, f"{cache_key(digest, parser)}.npz") for parser in parsers]
+
+
+def _usable(builder: TreeBuilder, doc_path: str) -> bool:
+    """快速解析回退到 unstructured 的结果，只有快速解析器没有更新时才沿用，否则重新尝试快速解析"""
+    doc = builder.doc
+    if doc.get("parser_version") == PARSER_VERSION and supports_fast_parse(doc_path):
+        return doc.get("fallback_from") == FAST_PARSER_VERSION
+    return True
+
+
+def prune_cache(cache_dir, max_bytes: int = DEFAULT_MAX_CACHE_BYTES) -> None:
+    """缓存目录超过 max_bytes 时删除最久未使用的条目(加载时会更新文件的修改时间)"""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.npz'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def load_doc_tree(doc_path: str, cache_dir: str = None, use_cache: bool = True,
+                  max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES) -> TreeBuilder:
+    """
+    打开文档并返回已构建好的树。相同内容的文件只解析一次，之后从缓存加载
+
+    Args:
+        doc_path: 文件路径
+        cache_dir: 缓存目录，默认 lianxi/doc_tree/tree_cache
+        use_cache: 为 False 时强制重新解析并刷新缓存
+        max_cache_bytes: 缓存目录总大小上限，写入新条目后按最近使用时间淘汰
+    """
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    digest = file_hash(doc_path)
+    if use_cache:
+        for cache_path in _cache_candidates(doc_path, digest, cache_dir):
+            if not os.path.exists(cache_path):
+                continue
+            try:
+                builder = load_tree(cache_path, doc_path)
+            except Exception as e:
+                # 缓存损坏时退回重新解析
+                print(f"缓存加载失败: {cache_path}, {e}")
+                continue
+            if _usable(builder, doc_path):
+                try:
+                    os.utime(cache_path)
+                except OSError:
+                    pass
+                return builder
+
+    builder = TreeBuilder(doc_path)
+    if not builder.doc:
+        raise ValueError(f"文件解析失败: {doc_path}")
+    builder.build_tree()
+    save_tree(builder, os.path.join(cache_dir, f"{cache_key(digest, builder.doc['parser_version'])}.npz"))
+    prune_cache(cache_dir, max_cache_bytes)
+    return builder
+
+
+if __name__ == "__main__":
+    import time
+    doc_path = 'D:/doc/project/my_rag/lianxi/load_text/files/keyan.docx'
+    for _ in range(2):
+        start = time.perf_counter()
+        builder = load_doc_tree(doc_path)
+        print(f"节点数: {len(builder.store)}, 耗时: {(time.perf_counter() - start) * 1000:.1f}ms")
@@ -0,0 +1,153 @@
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_ollama import OllamaEmbeddings
+
+from lianxi.doc_tree.doc_tree import TreeBuilder
+
+_CJK_RE = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计token数：中日韩字符按1个token，其余字符按4个字符1个token
+    """
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def plan_batches(texts: Sequence[str],
+                 levels: Sequence[int] = None,
+                 max_batch_tokens: int = 8192,
+                 max_batch_size: int = 64) -> List[List[int]]:
+    """
+    按层级分组、组内按长度排序后装箱，返回每个批次包含的文本下标
+
+    长度相近的文本放在同一批，减少模型端的padding浪费；每批token总量不超过 max_batch_tokens。
+    浅层级(章节标题所在层)的批次排在前面，先完成向量化，粗排检索可以更早可用。
+    """
+    if levels is None:
+        levels = [0] * len(texts)
+    tokens = [estimate_tokens(t) for t in texts]
+    order = sorted(range(len(texts)), key=lambda i: (levels[i], tokens[i]))
+
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    batch_tokens = 0
+    batch_level = None
+    for i in order:
+        full = batch and (batch_tokens + tokens[i] > max_batch_tokens or len(batch) >= max_batch_size)
+        if full or (batch and levels[i] != batch_level):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens[i]
+        batch_level = levels[i]
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def embed_batches(embed_model: OllamaEmbeddings,
+                  texts: Sequence[str],
+                  batches: List[List[int]],
+                  max_workers: int = 4,
+                  before_submit: Callable[[], None] = None) -> Iterator[Tuple[List[int], np.ndarray]]:
+    """
+    并发向量化各批次，按完成顺序返回 (批次下标列表, 向量矩阵)
+
+    同时在途的批次不超过 max_workers 个，完成一个再提交下一个。before_submit 在每次提交前调用，
+    可以在其中阻塞让出(如 scheduler.checkpoint)，让出期间不会有新的批次发给嵌入模型
+    """
+    remaining = iter(batches)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+
+        def submit_next() -> None:
+            batch = next(remaining, None)
+            if batch is None:
+                return
+            if before_submit is not None:
+                before_submit()
+            futures[executor.submit(embed_model.embed_documents, [texts[i] for i in batch])] = batch
+
+        for _ in range(max_workers):
+            submit_next()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = futures.pop(future)
+                vectors = np.asarray(future.result(), dtype=np.float32)
+                # 先补上空出的位置再返回结果，调用方写入向量库时嵌入模型继续工作
+                submit_next()
+                yield batch, vectors
+
+
+def embed_texts(embed_model: OllamaEmbeddings,
+                texts: Sequence[str],
+                levels: Sequence[int] = None,
+                max_batch_tokens: int = 8192,
+                max_batch_size: int = 64,
+                max_workers: int = 4) -> np.ndarray:
+    """并发向量化一组文本，结果按输入顺序写入同一个矩阵"""
+    matrix: Optional[np.ndarray] = None
+    batches = plan_batches(texts, levels, max_batch_tokens, max_batch_size)
+    for batch, vectors in embed_batches(embed_model, texts, batches, max_workers):
+        if matrix is None:
+            matrix = np.zeros((len(texts), vectors.shape[1]), dtype=np.float32)
+        matrix[batch] = vectors
+    return matrix if matrix is not None else np.zeros((0, 0), dtype=np.float32)
+
+
+def vectorize_tree(builder: TreeBuilder,
+                   embed_model: OllamaEmbeddings,
+                   vector_store: FAISS = None,
+                   prefix_title_path: bool = True,
+                   max_batch_tokens: int = 8192,
+                   max_batch_size: int = 64,
+                   max_workers: int = 4) -> Dict:
+    """
+    对整棵树做一次批量向量化
+
+    Args:
+        builder: 已调用 build_tree 的构建器
+        embed_model: 嵌入模型
+        vector_store: 不为空时，每完成一个批次调用一次 add_embeddings 写入向量库
+        prefix_title_path: 是否在正文前拼接章节路径，使向量带上章节语义
+
+    Returns:
+        Dict: 向量化的节点数、批次数
+    """
+    nodes = [n for n in builder.store.nodes if n.content.strip()]
+    texts = [f"{n.title_path}\n{n.content}" if prefix_title_path and n.title_path else n.content for n in nodes]
+    batches = plan_batches(texts, [n.level for n in nodes], max_batch_tokens, max_batch_size)
+
+    for batch, vectors in embed_batches(embed_model, texts, batches, max_workers):
+        batch_nodes = [nodes[i] for i in batch]
+        # 写回树的共享向量矩阵，结果在主线程中处理，无需加锁
+        builder.store.set_embeddings([n.node_id for n in batch_nodes], vectors)
+        if vector_store is not None:
+            docs = [n.to_langchain_document() for n in batch_nodes]
+            for n, d in zip(batch_nodes, docs):
+                d.metadata.update({"node_id": n.node_id, "title_path": n.title_path})
+            vector_store.add_embeddings(
+                text_embeddings=zip([d.page_content for d in docs], vectors.tolist()),
+                metadatas=[d.metadata for d in docs],
+                ids=[d.metadata["doc_id"] for d in docs],
+            )
+    return {"nodes": len(nodes), "batches": len(batches)}
+
+
+if __name__ == "__main__":
+    import time
+    from lianxi.doc_tree.tree_cache import load_doc_tree
+
+    doc_path = 'D:/doc/project/my_rag/lianxi/load_text/files/keyan.docx'
+    builder = load_doc_tree(doc_path)
+    start = time.perf_counter()
+    stats = vectorize_tree(builder, OllamaEmbeddings(model="bge-m3:latest"))
+    print(stats, f"耗时: {time.perf_counter() - start:.2f}s")
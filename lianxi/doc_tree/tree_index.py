@@ -0,0 +1,182 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.schema import Document as LangchainDocument
+from langchain_community.vectorstores import FAISS
+from langchain_ollama import OllamaEmbeddings
+
+from lianxi.doc_tree.doc_tree import TreeBuilder, TreeNode
+from lianxi.doc_tree.tree_embedding import embed_texts, vectorize_tree
+
+
+def _normalize(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+class DocTreeIndex:
+    """
+    基于文档章节树的分层检索索引
+
+    节点编号(node_id)即先序遍历顺序，任意节点的子树在编号上是一段连续区间 [start, end)，
+    因此"只在命中章节内检索"就是对向量矩阵做切片，无需额外的过滤结构。
+
+    检索分两步：
+        1. 粗排：用查询向量匹配章节摘要(title_path + 开头若干字)，选出 top 章节
+        2. 精排：只在命中章节的子树范围内匹配节点正文
+    """
+    def __init__(self,
+                 builder: TreeBuilder,
+                 embed_model: OllamaEmbeddings,
+                 batch_size: int = 32,
+                 summary_chars: int = 200,
+                 max_workers: int = 4):
+        self.builder = builder
+        self.embed_model = embed_model
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.summary_chars = summary_chars
+
+        self.nodes: List[TreeNode] = []
+        self.parent_ids: List[int] = []
+        self.children_ids: List[List[int]] = []
+        self.subtree_end: List[int] = []
+        self.summary_vectors: Optional[np.ndarray] = None
+        # 没有正文的节点不参与精排
+        self.has_content: Optional[np.ndarray] = None
+
+    def _collect_nodes(self) -> None:
+        """读取节点父子编号并计算子树区间，节点编号即先序遍历顺序"""
+        self.nodes = self.builder.store.nodes
+        n = len(self.nodes)
+        self.parent_ids = [node.parent.node_id if node.parent is not None else -1 for node in self.nodes]
+        self.children_ids = [[c.node_id for c in node.children] for node in self.nodes]
+
+        # 逆序计算子树右边界：叶子节点为 i+1，否则为最后一个孩子的右边界
+        self.subtree_end = [0] * n
+        for i in range(n - 1, -1, -1):
+            children = self.children_ids[i]
+            self.subtree_end[i] = self.subtree_end[children[-1]] if children else i + 1
+
+    def _summary_text(self, node: TreeNode) -> str:
+        return f"{node.title_path or node.title}\n{node.content[:self.summary_chars]}"
+
+    @property
+    def content_vectors(self) -> np.ndarray:
+        """正文向量直接存放在树的 NodeStore 矩阵中，按 node_id 索引"""
+        return self.builder.store.embeddings
+
+    def build(self) -> "DocTreeIndex":
+        self._collect_nodes()
+        summaries = [self._summary_text(n) for n in self.nodes]
+        self.summary_vectors = _normalize(embed_texts(self.embed_model, summaries, [n.level for n in self.nodes],
+                                                      max_batch_size=self.batch_size, max_workers=self.max_workers))
+
+        self.has_content = np.array([bool(n.content.strip()) for n in self.nodes])
+        content_idx = np.flatnonzero(self.has_content)
+        if len(content_idx):
+            vectorize_tree(self.builder, self.embed_model, prefix_title_path=False,
+                           max_batch_size=self.batch_size, max_workers=self.max_workers)
+            store = self.builder.store
+            store.embeddings[content_idx] = _normalize(store.embeddings[content_idx])
+        return self
+
+    def subtree(self, node_id: int) -> range:
+        return range(node_id, self.subtree_end[node_id])
+
+    def section_text(self, node_id: int) -> str:
+        """返回整个章节(含所有子章节)的正文"""
+        parts = []
+        for i in self.subtree(node_id):
+            node = self.nodes[i]
+            if i != node_id:
+                parts.append(node.title)
+            if node.content:
+                parts.append(node.content.rstrip("\n"))
+        return "\n".join(parts)
+
+    def search_sections(self, query_vector: np.ndarray, k: int = 3) -> List[tuple]:
+        """粗排：返回 [(node_id, score), ...]，不包含根节点"""
+        scores = self.summary_vectors[1:] @ query_vector
+        top = np.argsort(-scores)[:k]
+        return [(int(i) + 1, float(scores[i])) for i in top]
+
+    def search(self, query: str, k: int = 3, n_sections: int = 3) -> List[Dict]:
+        """
+        由粗到细的检索
+
+        Returns:
+            List[Dict]: 每个结果包含命中节点、所在章节及章节完整内容
+        """
+        query_vector = np.asarray(self.embed_model.embed_query(query), dtype=np.float32)
+        query_vector /= (np.linalg.norm(query_vector) or 1.0)
+
+        sections = self.search_sections(query_vector, n_sections)
+        candidates = {}
+        for section_id, section_score in sections:
+            rng = self.subtree(section_id)
+            ids = np.arange(rng.start, rng.stop)
+            ids = ids[self.has_content[ids]]
+            if not len(ids):
+                continue
+            scores = self.content_vectors[ids] @ query_vector
+            for node_id, score in zip(ids.tolist(), scores.tolist()):
+                # 章节可能互相嵌套，同一节点只保留一次
+                if node_id not in candidates or candidates[node_id][0] < score:
+                    candidates[node_id] = (score, section_id)
+
+        ranked = sorted(candidates.items(), key=lambda x: -x[1][0])[:k]
+        results = []
+        for node_id, (score, section_id) in ranked:
+            node = self.nodes[node_id]
+            results.append({
+                "node_id": node_id,
+                "doc_id": node.doc_id,
+                "title_path": node.title_path,
+                "score": score,
+                "content": node.content,
+                "section_id": section_id,
+                "section_title": self.nodes[section_id].title_path,
+                "section_text": self.section_text(section_id),
+            })
+        return results
+
+    def to_langchain_documents(self) -> List[LangchainDocument]:
+        """转换为带父子关系的LangChain文档，便于写入通用向量库"""
+        docs = []
+        for i, node in enumerate(self.nodes):
+            if not self.has_content[i]:
+                continue
+            doc = node.to_langchain_document()
+            doc.metadata.update({
+                "node_id": i,
+                "title_path": node.title_path,
+                "parent_id": self.parent_ids[i],
+                "children_ids": self.children_ids[i],
+            })
+            docs.append(doc)
+        return docs
+
+    def to_vector_store(self) -> FAISS:
+        """复用已计算的正文向量构建FAISS向量库"""
+        docs = self.to_langchain_documents()
+        vectors = [self.content_vectors[d.metadata["node_id"]].tolist() for d in docs]
+        return FAISS.from_embeddings(
+            text_embeddings=list(zip([d.page_content for d in docs], vectors)),
+            embedding=self.embed_model,
+            metadatas=[d.metadata for d in docs],
+            ids=[d.metadata["doc_id"] for d in docs],
+            distance_strategy="METRIC_INNER_PRODUCT",
+        )
+
+
+if __name__ == "__main__":
+    doc_path = 'D:/doc/project/my_rag/lianxi/load_text/files/keyan.docx'
+    from lianxi.doc_tree.tree_cache import load_doc_tree
+    builder = load_doc_tree(doc_path)
+    index = DocTreeIndex(builder, OllamaEmbeddings(model="bge-m3:latest")).build()
+    for r in index.search("技术方案要求", k=3):
+        print(r["score"], r["title_path"])
+        print(r["section_text"][:200])
+        print('--------------------------------------------------')
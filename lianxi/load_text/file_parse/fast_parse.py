@@ -0,0 +1,310 @@
+import hashlib
+import re
+import xml.etree.ElementTree as ET
+import zipfile
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# 解析逻辑变化时需要更新，作为解析结果缓存键的一部分
+FAST_PARSER_VERSION = "fast-2"
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+W_BODY, W_P, W_T, W_TAB, W_BR, W_CR = f"{_W}body", f"{_W}p", f"{_W}t", f"{_W}tab", f"{_W}br", f"{_W}cr"
+W_TBL, W_TR, W_TC = f"{_W}tbl", f"{_W}tr", f"{_W}tc"
+W_PPR, W_PSTYLE, W_NUMPR, W_OUTLINE_LVL = f"{_W}pPr", f"{_W}pStyle", f"{_W}numPr", f"{_W}outlineLvl"
+W_STYLE, W_STYLE_ID, W_TYPE, W_NAME, W_BASED_ON, W_VAL = (f"{_W}style", f"{_W}styleId", f"{_W}type",
+                                                          f"{_W}name", f"{_W}basedOn", f"{_W}val")
+
+_HEADING_NAME_RE = re.compile(r"heading\s*(\d)")
+
+
+class ParsedElement:
+    """
+    与 unstructured Element 接口兼容的解析元素，只包含 TreeBuilder.build_tree 用到的字段
+    (id/category/text/metadata.category_depth/metadata.parent_id)
+    """
+    __slots__ = ('id', 'category', 'text', 'metadata')
+
+    def __init__(self, id: str, category: str, text: str, category_depth: Optional[int], parent_id: Optional[str]):
+        self.id = id
+        self.category = category
+        self.text = text
+        self.metadata = SimpleNamespace(category_depth=category_depth, parent_id=parent_id)
+
+    def __repr__(self):
+        return f"<{self.category} depth={self.metadata.category_depth}: {self.text[:30]!r}>"
+
+
+def build_elements(blocks: Iterator[Tuple[str, str, Optional[int]]]) -> List[ParsedElement]:
+    """
+    (category, text, 标题层级) -> ParsedElement 列表，按 unstructured 的约定补齐 parent_id：
+    标题的父元素是前面最近一个层级更浅的标题，正文的父元素是前面最近的标题。
+    标题的 depth 取它在标题栈中的深度：第一个标题为 0，每一级最多比父标题深 1，
+    文档先出现 ## 再出现 # 或跳级(# 后直接 ###)时 build_tree 也能正确挂到父节点下
+    """
+    elements: List[ParsedElement] = []
+    # (原始标题层级, 元素)
+    stack: List[Tuple[int, ParsedElement]] = []
+    for idx, (category, text, depth) in enumerate(blocks):
+        elem_id = hashlib.sha1(f"{idx}:{category}:{text}".encode('utf-8')).hexdigest()[:32]
+        if category == "Title":
+            while stack and stack[-1][0] >= depth:
+                stack.pop()
+            element = ParsedElement(elem_id, category, text, len(stack), stack[-1][1].id if stack else None)
+            stack.append((depth, element))
+        else:
+            element = ParsedElement(elem_id, category, text, None, stack[-1][1].id if stack else None)
+        elements.append(element)
+    return elements
+
+
+def _load_heading_levels(zf: zipfile.ZipFile) -> Dict[str, int]:
+    """
+    styles.xml: 段落样式ID -> 标题层级(0 起)。按样式名 heading N / Title 或大纲级别判断，沿 basedOn 继承；
+    中文版 Word 的样式ID多为数字，不能只看样式ID
+    """
+    try:
+        root = ET.fromstring(zf.read('word/styles.xml'))
+    except KeyError:
+        return {}
+    styles = {}
+    for style in root.iter(W_STYLE):
+        if style.get(W_TYPE) != 'paragraph':
+            continue
+        name = style.find(W_NAME)
+        outline = style.find(f"{W_PPR}/{W_OUTLINE_LVL}")
+        based_on = style.find(W_BASED_ON)
+        styles[style.get(W_STYLE_ID)] = (
+            name.get(W_VAL, '').lower() if name is not None else '',
+            int(outline.get(W_VAL)) if outline is not None else None,
+            based_on.get(W_VAL) if based_on is not None else None,
+        )
+
+    def level(style_id: str, seen: set) -> Optional[int]:
+        name, outline, based_on = styles[style_id]
+        if m := _HEADING_NAME_RE.fullmatch(name):
+            return int(m.group(1)) - 1
+        if name == 'title':
+            return 0
+        if outline is not None:
+            # 大纲级别 9 为正文
+            return outline if outline < 9 else None
+        if based_on in styles and based_on not in seen:
+            return level(based_on, seen | {style_id})
+        return None
+
+    levels = {}
+    for style_id in styles:
+        lvl = level(style_id, {style_id})
+        if lvl is not None:
+            levels[style_id] = lvl
+    return levels
+
+
+def _paragraph_text(p: ET.Element) -> str:
+    parts = []
+    for node in p.iter():
+        if node.tag == W_T:
+            parts.append(node.text or '')
+        elif node.tag == W_TAB:
+            parts.append('\t')
+        elif node.tag in (W_BR, W_CR):
+            parts.append('\n')
+    return ''.join(parts).strip()
+
+
+def _table_text(tbl: ET.Element) -> str:
+    """每行一行文本，单元格以空格分隔"""
+    rows = []
+    for tr in tbl.iter(W_TR):
+        cells = [' '.join(filter(None, (_paragraph_text(p) for p in tc.iter(W_P)))) for tc in tr.findall(W_TC)]
+        row = ' '.join(c for c in cells if c)
+        if row:
+            rows.append(row)
+    return '\n'.join(rows)
+
+
+def iter_docx_blocks(file_path: str) -> Iterator[Tuple[str, str, Optional[int]]]:
+    """
+    iterparse 流式读取 word/document.xml，按文档顺序产出 (category, text, 标题层级)：
+    标题样式或带大纲级别的段落为 Title，带编号的段落为 ListItem，表格为 Table，其余为 NarrativeText。
+    顶层段落和表格处理完后即从树中移除，不在内存中保留整个文档
+    """
+    with zipfile.ZipFile(file_path) as zf:
+        heading_levels = _load_heading_levels(zf)
+        with zf.open('word/document.xml') as f:
+            body = None
+            depth = 0
+            p_depth = 0
+            tbl_depth = 0
+            for event, elem in ET.iterparse(f, events=('start', 'end')):
+                tag = elem.tag
+                if event == 'start':
+                    depth += 1
+                    if tag == W_BODY:
+                        body = elem
+                    elif tag == W_P:
+                        p_depth += 1
+                    elif tag == W_TBL:
+                        tbl_depth += 1
+                    continue
+
+                if tag == W_P:
+                    p_depth -= 1
+                    # 文本框等嵌套段落的文本由外层段落一并取出
+                    if p_depth == 0 and tbl_depth == 0:
+                        text = _paragraph_text(elem)
+                        if text:
+                            yield _classify_paragraph(elem, text, heading_levels)
+                elif tag == W_TBL:
+                    tbl_depth -= 1
+                    if tbl_depth == 0:
+                        text = _table_text(elem)
+                        if text:
+                            yield "Table", text, None
+
+                depth -= 1
+                # document(1) > body(2) > 段落/表格(3)
+                if depth == 2 and body is not None:
+                    elem.clear()
+                    body.remove(elem)
+
+
+def _classify_paragraph(p: ET.Element, text: str, heading_levels: Dict[str, int]) -> Tuple[str, str, Optional[int]]:
+    ppr = p.find(W_PPR)
+    if ppr is not None:
+        outline = ppr.find(W_OUTLINE_LVL)
+        if outline is not None and int(outline.get(W_VAL)) < 9:
+            return "Title", text, int(outline.get(W_VAL))
+        style = ppr.find(W_PSTYLE)
+        if style is not None and style.get(W_VAL) in heading_levels:
+            return "Title", text, heading_levels[style.get(W_VAL)]
+        if ppr.find(W_NUMPR) is not None:
+            return "ListItem", text, None
+    return "NarrativeText", text, None
+
+
+_ATX_RE = re.compile(r"^ {0,3}(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$")
+_SETEXT_RE = re.compile(r"^ {0,3}(=+|-+)[ \t]*$")
+_FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+_LIST_RE = re.compile(r"^[ \t]*(?:[-*+]|\d+[.)])[ \t]+")
+_TABLE_SEP_RE = re.compile(r"^[ \t]*\|?[ \t]*:?-+:?[ \t]*(\|[ \t]*:?-+:?[ \t]*)*\|?[ \t]*$")
+_INLINE_RES = [
+    (re.compile(r"!\[([^\]]*)\]\([^)]*\)"), r"\1"),
+    (re.compile(r"\[([^\]]*)\]\([^)]*\)"), r"\1"),
+    (re.compile(r"(\*\*|__|`)"), ""),
+]
+
+
+def _strip_inline(text: str) -> str:
+    """去掉图片、链接地址、加粗和行内代码标记，与 unstructured 转 HTML 后取文本的结果接近"""
+    for pattern, repl in _INLINE_RES:
+        text = pattern.sub(repl, text)
+    return text.strip()
+
+
+def iter_markdown_blocks(file_path: str) -> Iterator[Tuple[str, str, Optional[int]]]:
+    """
+    逐行扫描 Markdown，产出 (category, text, 标题层级)：
+    ATX(# 标题) 与 Setext(下划线 === / ---) 标题为 Title，列表项为 ListItem，| 开头的连续行为 Table，
+    其余以空行分隔的段落为 NarrativeText；代码块内的 # 不作为标题
+    """
+    lines: List[str] = []
+    kind = None
+    fence = None
+
+    def flush():
+        nonlocal lines, kind
+        if lines:
+            text = '\n'.join(lines) if kind in ("Table", "CodeBlock") else _strip_inline(' '.join(lines))
+            if text:
+                yield "NarrativeText" if kind == "CodeBlock" else kind, text, None
+        lines, kind = [], None
+
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n').rstrip('\r')
+            if fence is not None:
+                if line.strip().startswith(fence):
+                    fence = None
+                    yield from flush()
+                else:
+                    lines.append(line)
+                continue
+            if m := _FENCE_RE.match(line):
+                yield from flush()
+                fence, kind = m.group(1)[:3], "CodeBlock"
+                continue
+            if not line.strip():
+                yield from flush()
+                continue
+            if m := _ATX_RE.match(line):
+                yield from flush()
+                title = _strip_inline(m.group(2) or '')
+                if title:
+                    yield "Title", title, len(m.group(1)) - 1
+                continue
+            if (m := _SETEXT_RE.match(line)) and kind == "NarrativeText" and len(lines) == 1:
+                title = _strip_inline(lines[0])
+                lines, kind = [], None
+                yield "Title", title, 0 if m.group(1)[0] == '=' else 1
+                continue
+            if _SETEXT_RE.match(line):
+                # 分隔线
+                yield from flush()
+                continue
+            if line.lstrip().startswith('|'):
+                if kind != "Table":
+                    yield from flush()
+                    kind = "Table"
+                if not _TABLE_SEP_RE.match(line):
+                    lines.append(' '.join(c.strip() for c in line.strip().strip('|').split('|') if c.strip()))
+                continue
+            if _LIST_RE.match(line):
+                yield from flush()
+                kind = "ListItem"
+                lines.append(_LIST_RE.sub('', line, count=1))
+                continue
+            if kind not in ("NarrativeText", "ListItem"):
+                yield from flush()
+                kind = "NarrativeText"
+            lines.append(line.strip())
+        yield from flush()
+
+
+FAST_PARSERS = {
+    '.docx': iter_docx_blocks,
+    '.md': iter_markdown_blocks,
+}
+
+
+def supports_fast_parse(file_path: str) -> bool:
+    return Path(file_path).suffix.lower() in FAST_PARSERS
+
+
+def parse_file_fast(file_path: str) -> Dict:
+    """
+    不依赖 unstructured 解析 docx / Markdown，返回结构与 parse_file_with_unstructured 相同的字典
+
+    Raises:
+        ValueError: 不支持的文件类型
+    """
+    suffix = Path(file_path).suffix.lower()
+    if suffix not in FAST_PARSERS:
+        raise ValueError(f"快速解析不支持的文件类型: {suffix}")
+    elements = build_elements(FAST_PARSERS[suffix](file_path))
+
+    element_types = {}
+    for element in elements:
+        element_types[element.category] = element_types.get(element.category, 0) + 1
+    text_content = "\n\n".join(e.text for e in elements)
+    return {
+        "file_path": file_path,
+        "file_extension": suffix,
+        "total_elements": len(elements),
+        "element_types": element_types,
+        "elements": elements,
+        "text_content": text_content,
+        "statistics": {"total_characters": len(text_content)},
+    }
@@ -1,7 +1,43 @@
 from typing import List, Dict, Any, Optional, Sequence
 from pathlib import Path
-from unstructured.documents.elements import Element
-from unstructured.partition.auto import partition
+
+from lianxi.load_text.file_parse.fast_parse import FAST_PARSER_VERSION, parse_file_fast, supports_fast_parse
+
+# 解析逻辑或 unstructured 版本变化时需要更新，作为解析结果缓存键的一部分
+PARSER_VERSION = "unstructured-auto-1"
+
+
+def parser_version(file_path: str, fast: bool = True) -> str:
+    """文件首选的解析器版本，实际使用的解析器以 parse_file 返回的 parser_version 为准"""
+    return FAST_PARSER_VERSION if fast and supports_fast_parse(file_path) else PARSER_VERSION
+
+
+def parse_file(file_path: str, fast: bool = True) -> Dict:
+    """
+    解析文件：docx / Markdown 优先走快速解析(直接读取XML / 逐行扫描标题)，
+    其他格式或快速解析失败时使用 unstructured。
+
+    返回的字典中 parser_version 为实际使用的解析器版本；快速解析未采用而改用 unstructured 时，
+    fallback_from 记录未采用的快速解析器版本，解析结果缓存据此判断快速解析更新后是否需要重新尝试
+    """
+    fallback_from = None
+    if fast and supports_fast_parse(file_path):
+        try:
+            analysis = parse_file_fast(file_path)
+            # docx 没有使用标题样式时，只能靠 unstructured 按文本特征识别标题
+            if analysis["element_types"].get("Title") or (analysis["elements"] and analysis["file_extension"] != '.docx'):
+                analysis["parser_version"] = FAST_PARSER_VERSION
+                return analysis
+            print(f"快速解析未识别到章节结构，改用 unstructured: {file_path}")
+        except Exception as e:
+            print(f"快速解析失败，改用 unstructured: {file_path}, {e}")
+        fallback_from = FAST_PARSER_VERSION
+    analysis = parse_file_with_unstructured(file_path)
+    if analysis:
+        analysis["parser_version"] = PARSER_VERSION
+        analysis["fallback_from"] = fallback_from
+    return analysis
+
 
 # 自定义解析函数，支持任意类型的文件格式
 def parse_file_with_unstructured(file_path: str):
@@ -17,6 +53,10 @@ def parse_file_with_unstructured(file_path: str):
     print(f"\n 解析文件: {file_path}")
 
     try:
+        # unstructured 导入较慢，只在需要时导入
+        from unstructured.documents.elements import Element
+        from unstructured.partition.auto import partition
+
         # 使用partition函数自动检测文件类型并解析,默认strategy策略是auto，还会有fast策略，速度比image-to-text models的快100倍
         elements: List[Element] = partition(filename=file_path, strategy="auto")
 
@@ -1,12 +1,13 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from matplotlib.pyplot import hist
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import asyncio
 import json
+from json.encoder import encode_basestring
 import os
 from datetime import datetime
 import logging
@@ -15,6 +16,14 @@ from regex import T
 from routers.user_repository import register_user, login_user
 from routers.message_repository import add_message_to_db, filter_message, get_message_by_id, update_message
 from repository.conversation import create_new_conversation, get_user_conversations, get_conversation_messages
+from routers.knowledge_base import get_doc_tree, lookup_table_rows_api, search_docs_api, search_multi_kb_api, upload_doc_api
+from routers.batch import cancel_batch_job, create_batch_job, get_batch_job, get_batch_job_results, list_batch_jobs, resume_batch_job
+from routers.metrics import get_metrics
+from server.auth import verify_token
+from server.chat.admission import AdmissionRejected, admission_controller, retry_after_header
+from server.chat.broadcaster import GenerationStream, chat_broadcaster, stream_cfg
+from server.chat.model_router import model_router
+from server.metrics import metrics
 from langchain_core.runnables.history import RunnableWithMessageHistory
 
 from sse_starlette.sse import EventSourceResponse
@@ -46,6 +55,8 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     conversation_id: Optional[str] = None
+    # 断线重连时携带，配合请求头 Last-Event-ID 从断点续传
+    message_id: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
@@ -55,13 +66,9 @@ class ChatResponse(BaseModel):
 
 from fastapi.responses import HTMLResponse
 
-from langchain_deepseek import ChatDeepSeek
-from langchain.callbacks import AsyncIteratorCallbackHandler
 from langchain.prompts import ChatPromptTemplate, PromptTemplate
 import asyncio
 from langchain.chains.llm import LLMChain
-from typing import Awaitable
-from langchain.callbacks.base import BaseCallbackHandler
 from langchain_core.chat_history import BaseChatMessageHistory
 
 from operator import itemgetter
@@ -99,112 +106,188 @@ def get_by_session_id(session_id: str) -> BaseChatMessageHistory:
         store[session_id] = InMemoryHistory()
     return store[session_id]
 
-async def wrap_done(fn: Awaitable, event: asyncio.Event):
-    """Wrap an awaitable with a event to signal when it's done or an exception is raised."""
+@app.get("/", response_class=HTMLResponse)
+async def read_root():
+    """根路径，返回HTML页面"""
+    with open("static/index.html", "r", encoding="utf-8") as f:
+        return f.read()
 
-    log_verbose = False
 
+async def generate_answer(query: ChatRequest, stream: GenerationStream):
+    """上游生成：调用LLM并把token发布到 stream，订阅同一个 stream 的连接共享这一次生成"""
+    # 构造一个新的Message_ID记录
+    message_id = await add_message_to_db(query=query.message,
+                                     conversation_id=query.conversation_id,
+                                     prompt_name='New Chat',
+                                     message_id=stream.message_id
+                                     )
+    prompt = PromptTemplate.from_template(
+        """
+    你可以根据用户之前的对话和提出的当前问题，提供专业和详细的技术答案。\n\n
+    角色：AI技术顾问\n
+    目标：能够结合历史聊天记录，提供专业、准确、详细的AI技术术语解释，增强回答的相关性和个性化。\n
+    输出格式：详细的文本解释，包括技术定义、原理和应用案例。\n
+    工作流程：\n
+      2. 分析用户当前问题：提取关键信息。\n
+      3. 如果存在历史聊天记录，请结合历史聊天记录和当前问题提供个性化的技术回答。\n
+      4. 如果问题与AI技术无关，以正常方式回应。\n\n
+    历史聊天记录:\n
+    {history}\n
+    当前问题：\n
+    {input}\n
+        """
+    )
+    messages = await filter_message(conversation_id=query.conversation_id, limit=10, chat_type="New Chat")
+
+    history = []
+    for m in messages:
+        history.append(f"user:{m.query} \n AI:{m.response}")
+
+    prompt_value = await prompt.ainvoke({"input": query.message, "history": history})
+    # 按 chat_type、提示词长度和后端实时延迟选择模型，首选后端超时或失败时对冲/回退到其他后端
+    route = {}
+    parts = []
+    save_chars = stream_cfg.get('partial_save_chars', 2000)
     try:
-        await fn
+        async for token in model_router.astream(prompt_value, chat_type="New Chat", meta=route):
+            parts.append(token)
+            stream.publish(token)
+            # 定期保存部分回答，已保存的token才能移出 stream 的环形缓冲
+            if save_chars and stream.length - stream.persisted >= save_chars:
+                await update_message(message_id, response="".join(parts))
+                stream.mark_persisted(stream.length)
+    except asyncio.CancelledError:
+        # 所有连接都已断开：取消LLM调用，保存已生成的部分
+        await save_cancelled_message(message_id, "".join(parts))
+        raise
+    await update_message(message_id, response="".join(parts),
+                         metadata={"llm_backend": route.get("backend"), "llm_attempted": route.get("attempted"),
+                                   "llm_hedged": route.get("hedged")})
+    stream.mark_persisted(stream.length)
+
+
+async def save_cancelled_message(message_id: str, partial_response: str):
+    try:
+        await update_message(message_id, response=partial_response,
+                             metadata={"cancelled": True, "cancel_reason": "client_disconnected",
+                                       "response_chars": len(partial_response)})
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        msg = f"Caught exception: {e}"
-        print(f'{e.__class__.__name__}: {msg}',)
-    finally:
-        # Signal the aiter to stop.
-        event.set()
+        logger.warning(f"保存被取消的回答失败: message_id={message_id}, {e}")
 
-class ConversationCallbackHandler(BaseCallbackHandler):
-    """Callback handler for streaming LLM responses."""
 
-    def __init__(self, message_id=None):
-        self.message_id = message_id
+# 与 json.dumps({"text": text}, ensure_ascii=False) 的输出相同，只转义文本本身，省去每帧构造和序列化字典
+TEXT_EVENT_TEMPLATE = '{"text": %s}'
 
-    def on_llm_new_token(self, token: str, **kwargs) -> None:
-        print(token, end='', flush=True)
 
-    async def on_llm_end(self, response, **kwargs) -> None:
-        print(type(response))
-        res = response.generations[0][0].text
-        await update_message(self.message_id, res)
+def text_event(event_id: int, text: str) -> Dict:
+    # 包装成SSE格式的JSON数据，事件id为文本结束处的字符偏移
+    return {"id": str(event_id), "data": TEXT_EVENT_TEMPLATE % encode_basestring(text)}
+
+
+def error_event() -> Dict:
+    error_chunk = {
+        "type": "error",
+        "text": "抱歉，处理您的请求时出现了错误。"
+    }
+    return {"data": json.dumps(error_chunk, ensure_ascii=False)}
 
-@app.get("/", response_class=HTMLResponse)
-async def read_root():
-    """根路径，返回HTML页面"""
-    with open("static/index.html", "r", encoding="utf-8") as f:
-        return f.read()
+
+async def resume_from_db(message_id: str, after: int):
+    """生成已结束且不在内存中时，从数据库中的完整回答续传"""
+    message = await get_message_by_id(message_id)
+    if message is None or not message.response:
+        yield error_event()
+        return
+    if after < len(message.response):
+        yield text_event(len(message.response), message.response[after:])
+
+
+async def load_persisted_response(message_id: str) -> Optional[str]:
+    """进行中的生成已保存到数据库的部分回答，用于补齐已移出环形缓冲的部分"""
+    message = await get_message_by_id(message_id)
+    return message.response if message is not None else None
+
+
+def parse_last_event_id(request: Request) -> int:
+    try:
+        return max(int(request.headers.get("last-event-id", 0)), 0)
+    except ValueError:
+        return 0
+
+
+def request_user(request: Request) -> str:
+    """限流按用户区分：前端以 Bearer 携带登录时签发的令牌，校验通过才按用户ID区分，否则按客户端地址"""
+    auth = request.headers.get("authorization", "")
+    if auth.startswith("Bearer "):
+        user_id = verify_token(auth[7:].strip())
+        if user_id is not None:
+            return f"user:{user_id}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def admission_rejected_response(e: AdmissionRejected) -> JSONResponse:
+    return JSONResponse(status_code=429,
+                        headers=retry_after_header(e.retry_after),
+                        content={"status": 429, "msg": "请求过于频繁，请稍后再试", "reason": e.reason})
 
 
 @app.post("/api/chat")
-async def chat_stream(query: ChatRequest):
-    """流式聊天接口"""
-    
+async def chat_stream(query: ChatRequest, request: Request):
+    """
+    流式聊天接口，同一会话的相同问题(多标签页、前端重试)共享一次生成。
+    首个事件(event: meta)返回消息ID；断线后带上 message_id 和请求头 Last-Event-ID 重新请求，从断点续传。
+    新的生成需经过准入控制：按用户限流、全局并发排队，未被接纳时返回 429 和 Retry-After
+    """
+
     print('====' * 50)
     print(query, query.message)
+    after = parse_last_event_id(request)
+    if query.message_id and after:
+        # 断点续传不消耗限流令牌和并发名额
+        stream = chat_broadcaster.get_by_message(query.message_id)
+        if stream is None:
+            return EventSourceResponse(resume_from_db(query.message_id, after))
+        metrics.inc("chat_stream_resumes")
+    else:
+        user = request_user(request)
+        acquired = None
+        # 复用进行中的生成不经过准入；新生成先限流再排队
+        if admission_controller is not None and chat_broadcaster.get(query.conversation_id, query.message) is None:
+            try:
+                acquired = await admission_controller.admit(user)
+            except AdmissionRejected as e:
+                return admission_rejected_response(e)
+
+        # get_or_start 是同步调用，判断是否已有生成和登记新生成之间不会插入其他请求
+        stream, created = chat_broadcaster.get_or_start(query.conversation_id, query.message,
+                                                        lambda s: generate_answer(query, s))
+        if acquired is not None:
+            if created:
+                # 并发名额随生成任务结束释放，与连接无关
+                stream.task.add_done_callback(lambda _: admission_controller.release_slot(acquired))
+            else:
+                # 排队期间相同请求已经开始生成
+                await admission_controller.withdraw(user, acquired)
+        if created:
+            after = 0
+        else:
+            logger.info(f"复用进行中的生成: conversation_id={query.conversation_id}, 已生成 {stream.token_count} 个token")
+
     async def generate_stream():
         try:
-            
-            # 构造一个新的Message_ID记录
-            message_id = await add_message_to_db(query=query.message,
-                                             conversation_id=query.conversation_id,
-                                             prompt_name='New Chat'
-                                             )
-            callback = AsyncIteratorCallbackHandler()
-            model = ChatDeepSeek(model="deepseek-chat", callbacks=[callback, ConversationCallbackHandler(message_id=message_id)], streaming=True)
-
-            prompt = PromptTemplate.from_template(
-                """
-            你可以根据用户之前的对话和提出的当前问题，提供专业和详细的技术答案。\n\n
-            角色：AI技术顾问\n
-            目标：能够结合历史聊天记录，提供专业、准确、详细的AI技术术语解释，增强回答的相关性和个性化。\n
-            输出格式：详细的文本解释，包括技术定义、原理和应用案例。\n
-            工作流程：\n
-              2. 分析用户当前问题：提取关键信息。\n
-              3. 如果存在历史聊天记录，请结合历史聊天记录和当前问题提供个性化的技术回答。\n
-              4. 如果问题与AI技术无关，以正常方式回应。\n\n
-            历史聊天记录:\n
-            {history}\n
-            当前问题：\n
-            {input}\n
-                """
-            )
-            messages = await filter_message(conversation_id=query.conversation_id, limit=10, chat_type="New Chat")
-            print(messages)
-
-            history = []
-            for m in messages:
-                history.append(f"user:{m.query} \n AI:{m.response}")
-            
-            chain = prompt | model
-            # chat_with_history = RunnableWithMessageHistory(
-            #     chain,
-            #     get_session_history = get_by_session_id,
-            #     history_messages_key="history",
-            #     input_messages_key='input',
-            # )
-
-            task = asyncio.create_task(wrap_done(
-                chain.ainvoke({"input": query.message, "history": history}), 
-                callback.done))
-            async for token in callback.aiter():
-                # print(token)
-                # print("--------------------------------")
-                # 包装成SSE格式的JSON数据
-                yield json.dumps(
-                    {"text": token,}, ensure_ascii=False)
-            
-            await task
-
+            yield {"event": "meta", "data": json.dumps({"message_id": stream.message_id})}
+            async for event_id, text in stream.follow(after,
+                                                      lambda: load_persisted_response(stream.message_id),
+                                                      flush_interval=stream_cfg.get('flush_interval_ms', 30) / 1000,
+                                                      max_chars=stream_cfg.get('flush_max_chars', 256)):
+                yield text_event(event_id, text)
+            if stream.error is not None:
+                raise stream.error
 
         except Exception as e:
             logger.error(f"Error in chat stream: {e}")
-            error_chunk = {
-                "type": "error",
-                "text": "抱歉，处理您的请求时出现了错误。"
-            }
-            yield f"data: {json.dumps(error_chunk, ensure_ascii=False)}\n\n"
-    
+            yield error_event()
+
     return EventSourceResponse(generate_stream())
 
 
@@ -214,22 +297,6 @@ async def get_conversation_messages_api(conversation_id: str):
     messages = await get_conversation_messages(conversation_id)
     return messages
 
-@app.post("/api/upload")
-async def upload_document(file: UploadFile = File(...)):
-    """上传文档到知识库"""
-    try:
-        # 这里可以添加文档处理逻辑
-        # 目前只是简单的文件接收
-        content = await file.read()
-        
-        return {
-            "message": f"文档 {file.filename} 上传成功",
-            "filename": file.filename,
-            "size": len(content)
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
 @app.get("/api/health")
 async def health_check():
     """健康检查"""
@@ -257,6 +324,66 @@ app.get("/api/conversations/messages",
         summary="获取用户问答记录",
         )(get_conversation_messages)
 
+app.get("/api/knowledge_base/doc_tree",
+        tags=["Knowledge Base"],
+        summary="获取文档章节目录",
+        )(get_doc_tree)
+
+app.post("/api/upload",
+        tags=["Knowledge Base"],
+        summary="上传文件到知识库并入库",
+        )(upload_doc_api)
+
+app.post("/api/knowledge_base/search_docs",
+        tags=["Knowledge Base"],
+        summary="知识库检索",
+        )(search_docs_api)
+
+app.post("/api/knowledge_base/search_multi",
+        tags=["Knowledge Base"],
+        summary="多知识库并发检索",
+        )(search_multi_kb_api)
+
+app.post("/api/knowledge_base/table_rows",
+        tags=["Knowledge Base"],
+        summary="按列查询表格行",
+        )(lookup_table_rows_api)
+
+app.post("/api/batch/jobs",
+        tags=["Batch"],
+        summary="创建批量LLM任务",
+        )(create_batch_job)
+
+app.get("/api/batch/jobs",
+        tags=["Batch"],
+        summary="批量任务列表",
+        )(list_batch_jobs)
+
+app.get("/api/batch/jobs/{job_id}",
+        tags=["Batch"],
+        summary="批量任务进度",
+        )(get_batch_job)
+
+app.get("/api/batch/jobs/{job_id}/results",
+        tags=["Batch"],
+        summary="批量任务结果",
+        )(get_batch_job_results)
+
+app.post("/api/batch/jobs/{job_id}/cancel",
+        tags=["Batch"],
+        summary="取消批量任务",
+        )(cancel_batch_job)
+
+app.post("/api/batch/jobs/{job_id}/resume",
+        tags=["Batch"],
+        summary="续跑批量任务",
+        )(resume_batch_job)
+
+app.get("/api/metrics",
+        tags=["Metrics"],
+        summary="服务运行指标",
+        )(get_metrics)
+
 # 用户注册
 app.post("/api/users/register",
              tags=["Users"],
@@ -0,0 +1,21 @@
+from typing import List
+
+from sqlalchemy.future import select
+
+from server.db.models.knowledge_base_model import KnowledgeBaseModel
+from server.db.session import with_async_session
+
+
+@with_async_session
+async def list_kbs_from_db(session, user_id: str, kb_names: List[str] = None):
+    """
+    列出用户的知识库
+    返回形式：[{"kb_name": str, "vs_type": str, "embed_model": str}, ...]
+    """
+    query = select(KnowledgeBaseModel).filter_by(user_id=user_id)
+    if kb_names:
+        query = query.filter(KnowledgeBaseModel.kb_name.in_(kb_names))
+    result = await session.execute(query)
+    kbs = result.scalars().all()
+    return [{"kb_name": kb.kb_name, "vs_type": kb.vs_type, "embed_model": kb.embed_model} for kb in kbs]
+
@@ -0,0 +1,120 @@
+from typing import Dict, List
+
+from sqlalchemy import delete
+from sqlalchemy.future import select
+
+from server.db.models.knowledge_file_model import KnowledgeFileModel, FileDocModel
+from server.db.session import with_async_session
+
+
+@with_async_session
+async def add_docs_to_db(session, kb_name: str, file_name: str, doc_infos: List[Dict]):
+    """
+    将某知识库某文件对应的所有向量库文档信息添加到数据库
+    doc_infos形式：[{"id": str, "metadata": dict}, ...]
+    """
+    _add_docs(session, kb_name, file_name, doc_infos)
+    await session.commit()
+    return True
+
+
+def _add_docs(session, kb_name: str, file_name: str, doc_infos: List[Dict]):
+    for d in doc_infos:
+        obj = FileDocModel(
+            kb_name=kb_name,
+            file_name=file_name,
+            doc_id=d["id"],
+            meta_data=d["metadata"],
+        )
+        session.add(obj)
+
+
+@with_async_session
+async def list_docs_from_db(session, kb_name: str, file_name: str = None, metadata: Dict = {}):
+    """
+    列出某知识库某文件对应的所有Document
+    返回形式：[{"id": str, "metadata": dict}, ...]
+    """
+    query = select(FileDocModel).filter_by(kb_name=kb_name)
+    if file_name:
+        query = query.filter_by(file_name=file_name)
+    result = await session.execute(query)
+    docs = result.scalars().all()
+    # JSON字段的过滤放在内存中完成，避免依赖数据库方言
+    return [{"id": x.doc_id, "metadata": x.meta_data} for x in docs
+            if all((x.meta_data or {}).get(k) == v for k, v in metadata.items())]
+
+
+@with_async_session
+async def add_file_to_db(session,
+                         kb_name: str,
+                         file_name: str,
+                         file_ext: str,
+                         docs_count: int = 0,
+                         document_loader_name: str = "",
+                         text_splitter_name: str = "",
+                         file_mtime: float = 0.0,
+                         file_size: int = 0,
+                         ):
+    """
+    新增或更新知识文件记录，已存在时版本号加一
+    """
+    await _upsert_file(session, kb_name, file_name, file_ext, docs_count, document_loader_name,
+                       text_splitter_name, file_mtime, file_size)
+    await session.commit()
+    return True
+
+
+async def _upsert_file(session,
+                       kb_name: str,
+                       file_name: str,
+                       file_ext: str,
+                       docs_count: int = 0,
+                       document_loader_name: str = "",
+                       text_splitter_name: str = "",
+                       file_mtime: float = 0.0,
+                       file_size: int = 0,
+                       ):
+    result = await session.execute(select(KnowledgeFileModel).filter_by(kb_name=kb_name, file_name=file_name))
+    existing_file = result.scalars().first()
+    if existing_file:
+        existing_file.file_mtime = file_mtime
+        existing_file.file_size = file_size
+        existing_file.docs_count = docs_count
+        existing_file.document_loader_name = document_loader_name
+        existing_file.text_splitter_name = text_splitter_name
+        existing_file.file_version += 1
+    else:
+        new_file = KnowledgeFileModel(
+            file_name=file_name,
+            file_ext=file_ext,
+            kb_name=kb_name,
+            document_loader_name=document_loader_name,
+            text_splitter_name=text_splitter_name,
+            file_mtime=file_mtime,
+            file_size=file_size,
+            docs_count=docs_count,
+        )
+        session.add(new_file)
+
+
+@with_async_session
+async def replace_file_in_db(session,
+                             kb_name: str,
+                             file_name: str,
+                             file_ext: str,
+                             doc_infos: List[Dict],
+                             document_loader_name: str = "",
+                             text_splitter_name: str = "",
+                             file_mtime: float = 0.0,
+                             file_size: int = 0,
+                             ):
+    """
+    文件(重新)入库后在同一个事务中更新数据库：删除该文件原有的文档记录，写入新的文档记录，新增或更新文件记录
+    """
+    await session.execute(delete(FileDocModel).filter_by(kb_name=kb_name, file_name=file_name))
+    _add_docs(session, kb_name, file_name, doc_infos)
+    await _upsert_file(session, kb_name, file_name, file_ext, len(doc_infos), document_loader_name,
+                       text_splitter_name, file_mtime, file_size)
+    await session.commit()
+    return True
@@ -0,0 +1,102 @@
+from typing import Dict, List, Optional, Union
+
+from fastapi import Body, HTTPException, Query
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field
+
+from server.batch.builders import conversation_title_items, kb_document_items, prompt_items
+from server.batch.jobs import RUNNING, batch_manager, iter_jsonl
+
+JOB_KINDS = ("prompts", "kb_summary", "faq", "conversation_titles")
+
+
+class CreateBatchJobRequest(BaseModel):
+    kind: str = Field(default="prompts", description="任务类型: prompts / kb_summary / faq / conversation_titles")
+    prompts: Optional[List[Union[str, Dict]]] = Field(
+        default=None, description="prompts 任务的条目：字符串，或 {\"id\", \"prompt\"} / {\"id\", \"variables\"}")
+    template: Optional[str] = Field(default=None, description="prompts 任务的提示词模板，用条目的 variables 填充，只支持 {变量名} 形式的占位符")
+    kb_name: Optional[str] = Field(default=None, description="kb_summary / faq 任务的知识库名称")
+    user_id: Optional[str] = Field(default=None, description="conversation_titles 任务只处理该用户的会话，为空时处理全部")
+    chat_type: Optional[str] = Field(default=None, description="模型路由使用的 chat_type，默认按配置")
+    concurrency: Optional[int] = Field(default=None, description="并发数，默认按配置，不超过全局上限")
+    max_retries: Optional[int] = Field(default=None, description="单条失败重试次数，默认按配置")
+
+
+def _get_job_or_404(job_id: str):
+    job = batch_manager.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return job
+
+
+async def create_batch_job(request: CreateBatchJobRequest = Body(...)):
+    """
+    创建批量LLM任务并立即开始执行，返回任务ID
+    """
+    if request.kind == "prompts":
+        if not request.prompts:
+            raise HTTPException(status_code=400, detail="prompts 不能为空")
+        items = prompt_items(request.prompts, request.template)
+    elif request.kind in ("kb_summary", "faq"):
+        if not request.kb_name:
+            raise HTTPException(status_code=400, detail="kb_name 不能为空")
+        items = kb_document_items(request.kb_name, request.kind)
+    elif request.kind == "conversation_titles":
+        items = conversation_title_items(request.user_id)
+    else:
+        raise HTTPException(status_code=400, detail=f"不支持的任务类型: {request.kind}，可选 {JOB_KINDS}")
+
+    options = {k: v for k, v in request.dict(include={"kb_name", "user_id", "chat_type", "concurrency",
+                                                       "max_retries"}).items() if v is not None}
+    try:
+        job = await batch_manager.create_job(request.kind, items, **options)
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"条目无效: {e}")
+    return {"status": 200, "msg": "success", "data": job.status_dict()}
+
+
+async def list_batch_jobs():
+    """
+    批量任务列表，按创建时间倒序
+    """
+    return {"status": 200, "msg": "success", "data": [job.status_dict() for job in batch_manager.list_jobs()]}
+
+
+async def get_batch_job(job_id: str):
+    """
+    批量任务进度：成功/失败/待处理条数、处理速度和预计剩余时间
+    """
+    return {"status": 200, "msg": "success", "data": _get_job_or_404(job_id).status_dict()}
+
+
+async def cancel_batch_job(job_id: str):
+    """
+    取消批量任务，已完成的结果保留，可以续跑
+    """
+    job = _get_job_or_404(job_id)
+    batch_manager.cancel(job)
+    return {"status": 200, "msg": "success", "data": job.status_dict()}
+
+
+async def resume_batch_job(job_id: str):
+    """
+    续跑中断、取消或有失败条目的任务：跳过已成功的条目，重新处理其余条目
+    """
+    job = _get_job_or_404(job_id)
+    if job.status != RUNNING:
+        batch_manager.start(job)
+    return {"status": 200, "msg": "success", "data": job.status_dict()}
+
+
+async def get_batch_job_results(job_id: str,
+                                download: bool = Query(False, description="为 true 时下载完整的 results.jsonl")):
+    """
+    批量任务结果：默认返回每个条目的最新结果(续跑后以最后一次为准)，download 为 true 时返回原始 JSONL 文件
+    """
+    job = _get_job_or_404(job_id)
+    if not job.results_path.exists():
+        return {"status": 200, "msg": "success", "data": []}
+    if download:
+        return FileResponse(job.results_path, media_type="application/x-ndjson", filename=f"{job_id}.jsonl")
+    latest = {record["id"]: record for record in iter_jsonl(job.results_path)}
+    return {"status": 200, "msg": "success", "data": list(latest.values())}
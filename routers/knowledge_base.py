@@ -0,0 +1,168 @@
+import os
+from typing import Dict, List, Optional
+
+from fastapi import Body, File, Form, HTTPException, Query, UploadFile
+from pydantic import BaseModel, Field
+
+from repository.knowledge_base_repository import list_kbs_from_db
+from server.knowledge_base.docx_tables import lookup_table_rows
+from server.knowledge_base.ingest import ingest_file
+from server.knowledge_base.kb_search import search_docs, search_multi_kb
+from server.knowledge_base.utils import (
+    DEFAULT_EMBED_MODEL,
+    DEFAULT_VS_TYPE,
+    VectorStoreNotFound,
+    get_doc_path,
+    kb_cfg,
+    resolve_doc_file,
+    validate_kb_name,
+)
+from server.scheduler import Priority, scheduler
+
+
+class SearchDocsRequest(BaseModel):
+    query: str = Field(..., description="用户问题")
+    kb_name: str = Field(..., description="知识库名称")
+    top_k: int = Field(default=3, description="返回的切片数量")
+    score_threshold: Optional[float] = Field(default=None, description="相似度阈值")
+    embed_model: str = Field(default=DEFAULT_EMBED_MODEL, description="嵌入模型名称")
+    vs_type: str = Field(default=DEFAULT_VS_TYPE, description="向量库类型: faiss / faiss_sq8 / faiss_pq")
+    rerank: Optional[bool] = Field(default=None, description="是否重排序，默认按配置")
+    metadata_filter: Optional[Dict] = Field(default=None, description="元数据过滤条件，如 {\"file_name\": \"企业报销制度.docx\"}")
+
+
+class SearchMultiKbRequest(BaseModel):
+    query: str = Field(..., description="用户问题")
+    user_id: str = Field(..., description="用户ID")
+    kb_names: Optional[List[str]] = Field(default=None, description="要检索的知识库，为空时检索用户全部知识库")
+    top_k: int = Field(default=3, description="合并后返回的切片数量")
+    score_threshold: Optional[float] = Field(default=None, description="相似度阈值")
+    per_kb_timeout_ms: int = Field(default=2000, description="单个知识库检索超时时间(毫秒)")
+    metadata_filter: Optional[Dict] = Field(default=None, description="元数据过滤条件")
+
+
+class TableRowsRequest(BaseModel):
+    kb_name: str = Field(..., description="知识库名称")
+    filters: Dict = Field(default_factory=dict, description="列名 -> 取值，取值为列表时匹配任意一个，如 {\"部门\": \"财务部\"}")
+    file_name: Optional[str] = Field(default=None, description="文件名称，为空时查询知识库全部表格")
+    table_index: Optional[int] = Field(default=None, description="文件中的第几个表格(从0开始)")
+    contains: bool = Field(default=False, description="按子串匹配单元格")
+    limit: int = Field(default=100, description="返回的行数上限")
+
+
+async def get_doc_tree(
+        kb_name: str = Query(..., description="知识库名称"),
+        file_name: str = Query(..., description="文件名称"),
+        preview_chars: int = Query(100, description="每个章节正文预览长度"),
+):
+    """
+    获取文档的章节目录，解析结果走文档树缓存
+    """
+    from lianxi.doc_tree.tree_cache import load_doc_tree
+
+    try:
+        doc_path = resolve_doc_file(kb_name, file_name)
+    except (ValueError, FileNotFoundError):
+        raise HTTPException(status_code=404, detail=f"文件不存在: {kb_name}/{file_name}")
+
+    builder = await scheduler.run(Priority.NORMAL, load_doc_tree, str(doc_path))
+    data = [{
+        "node_id": node.node_id,
+        "parent_id": node.parent.node_id if node.parent is not None else -1,
+        "level": node.level,
+        "title": node.title,
+        "title_path": node.title_path,
+        "preview": node.content[:preview_chars],
+    } for node in builder.store.nodes]
+    return {"status": 200, "msg": "success", "data": data}
+
+
+async def search_docs_api(request: SearchDocsRequest = Body(...)):
+    """
+    知识库检索
+    """
+    try:
+        result = await scheduler.run(Priority.INTERACTIVE,
+                                     search_docs,
+                                     query=request.query,
+                                     kb_name=request.kb_name,
+                                     top_k=request.top_k,
+                                     score_threshold=request.score_threshold,
+                                     embed_model=request.embed_model,
+                                     vs_type=request.vs_type,
+                                     rerank=request.rerank,
+                                     metadata_filter=request.metadata_filter)
+    except VectorStoreNotFound:
+        raise HTTPException(status_code=404, detail=f"知识库不存在或尚未入库文件: {request.kb_name}")
+    return {"status": 200, "msg": "success", "data": result["sources"]}
+
+
+async def search_multi_kb_api(request: SearchMultiKbRequest = Body(...)):
+    """
+    多知识库并发检索
+    """
+    kbs = await list_kbs_from_db(user_id=request.user_id, kb_names=request.kb_names)
+    if not kbs:
+        return {"status": 200, "msg": "success", "data": [], "kbs": {}}
+    result = await search_multi_kb(query=request.query,
+                                   kbs=kbs,
+                                   top_k=request.top_k,
+                                   score_threshold=request.score_threshold,
+                                   per_kb_timeout=request.per_kb_timeout_ms / 1000,
+                                   metadata_filter=request.metadata_filter)
+    return {"status": 200, "msg": "success", "data": result["sources"], "kbs": result["kbs"]}
+
+
+async def lookup_table_rows_api(request: TableRowsRequest = Body(...)):
+    """
+    按列取值查询docx表格行(DocxTable 方式入库的文件)
+    """
+    try:
+        rows = await scheduler.run(Priority.NORMAL,
+                                   lookup_table_rows,
+                                   kb_name=request.kb_name,
+                                   filters=request.filters,
+                                   file_name=request.file_name,
+                                   table_index=request.table_index,
+                                   contains=request.contains,
+                                   limit=request.limit)
+    except ValueError:
+        raise HTTPException(status_code=404, detail=f"文件不存在: {request.kb_name}/{request.file_name or ''}")
+    return {"status": 200, "msg": "success", "data": rows}
+
+
+def _save_upload(path, content: bytes) -> None:
+    """先写临时文件再替换，重新上传同名文件时正在读取原文件的请求不会读到半个文件"""
+    tmp_path = f"{path}.uploading"
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+async def upload_doc_api(
+        file: UploadFile = File(..., description="上传的文件"),
+        kb_name: str = Form(kb_cfg.get('default_kb_name', 'company_zhidu'), description="知识库名称"),
+        text_splitter_name: str = Form("RecursiveCharacterTextSplitter",
+                                       description="切分方式: RecursiveCharacterTextSplitter / DocTree / SemanticChunker / DocxTable"),
+        vs_type: str = Form(DEFAULT_VS_TYPE, description="向量库类型: faiss / faiss_sharded"),
+):
+    """
+    上传文件到知识库并入库，同名文件重新上传时替换原有切片
+    """
+    file_name = os.path.basename(file.filename or "")
+    try:
+        doc_root = get_doc_path(validate_kb_name(kb_name))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if file_name in ("", ".", ".."):
+        raise HTTPException(status_code=400, detail=f"文件名不合法: {file.filename!r}")
+
+    content = await file.read()
+    os.makedirs(doc_root, exist_ok=True)
+    doc_path = doc_root / file_name
+    await scheduler.run(Priority.NORMAL, _save_upload, doc_path, content)
+    try:
+        result = await ingest_file(kb_name, str(doc_path), text_splitter_name=text_splitter_name, vs_type=vs_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": 200, "msg": "success", "data": result}
@@ -96,6 +96,59 @@ async def update_message(session, message_id, response: str = None, metadata: Di
         raise HTTPException(status_code=404, detail="Message not no found")
 
 
+# 新建会话的默认名称
+DEFAULT_CONVERSATION_NAMES = ("新对话", "New Chat")
+# conversation.name 的字段长度，首个问题更长时写入的是截断后的前缀
+CONVERSATION_NAME_LENGTH = ConversationModel.name.type.length
+
+
+def is_auto_named(name: str, first_query: str) -> bool:
+    """会话名称仍为默认名称，或是 add_message_to_db 自动填入的首个问题(可能被字段长度截断)"""
+    if name in DEFAULT_CONVERSATION_NAMES:
+        return True
+    return bool(name) and name in (first_query, first_query[:CONVERSATION_NAME_LENGTH])
+
+
+@with_async_session
+async def list_untitled_conversations(session, user_id: str = None, page_size: int = 500) -> List[Dict]:
+    """
+    返回还没有正式标题的会话：名称仍为默认名称，或为 add_message_to_db 临时填入的首个问题。
+    每个会话附带首条问答，按页查询，避免逐个会话查消息
+    """
+    stmt = select(ConversationModel.id, ConversationModel.name).order_by(ConversationModel.create_time)
+    if user_id:
+        stmt = stmt.filter_by(user_id=user_id)
+    conversations = (await session.execute(stmt)).all()
+
+    result = []
+    for start in range(0, len(conversations), page_size):
+        page = {c.id: c.name for c in conversations[start:start + page_size]}
+        messages = await session.execute(
+            select(MessageModel.conversation_id, MessageModel.query, MessageModel.response)
+            .filter(MessageModel.conversation_id.in_(list(page)))
+            .order_by(MessageModel.conversation_id, MessageModel.create_time)
+        )
+        first = {}
+        for m in messages:
+            first.setdefault(m.conversation_id, m)
+        for conversation_id, m in first.items():
+            name = page[conversation_id] or ""
+            if is_auto_named(name, m.query or ""):
+                result.append({"conversation_id": conversation_id, "name": name,
+                               "query": m.query or "", "response": m.response or ""})
+    return result
+
+
+@with_async_session
+async def update_conversation_name(session, conversation_id: str, name: str):
+    conversation = await session.get(ConversationModel, conversation_id)
+    if conversation is None:
+        return None
+    conversation.name = name
+    await session.commit()
+    return conversation.id
+
+
 # 主测试函数
 async def main():
     # 测试是否可以查询
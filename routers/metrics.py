@@ -0,0 +1,8 @@
+from server.metrics import metrics
+
+
+async def get_metrics():
+    """
+    服务运行指标：计数器、耗时分位数和各组件的缓存命中率等
+    """
+    return {"status": 200, "msg": "success", "data": metrics.snapshot()}
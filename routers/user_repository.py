@@ -14,6 +14,7 @@ from fastapi.responses import JSONResponse
 from typing import List
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
+from server.auth import issue_token
 from server.db.session import with_async_session
 from fastapi import HTTPException
 from server.db.models.user_model import UserModel
@@ -75,6 +76,8 @@ async def login_user(
                 "status": 200,
                 "id": user.id,
                 "username": user.username,
+                # 需要按用户区分的接口(如聊天限流)校验该令牌，不能直接信任前端传来的用户名或ID
+                "token": issue_token(user.id),
                 "message": "Login successful"
             }
         )
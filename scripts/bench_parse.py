@@ -0,0 +1,85 @@
+import sys
+sys.path.append("./")  # 添加项目根目录到路径中
+import argparse
+import os
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+from lianxi.doc_tree.doc_tree import TreeBuilder
+from lianxi.load_text.file_parse.fast_parse import parse_file_fast
+
+
+def make_synthetic_docx(path: str, sections: int, paragraphs: int) -> str:
+    """生成带多级标题和表格的 docx，用于没有大文件时测试吞吐量"""
+    import docx
+
+    doc = docx.Document()
+    for i in range(sections):
+        doc.add_heading(f"第{i + 1}章 测试章节", level=1)
+        for j in range(3):
+            doc.add_heading(f"{i + 1}.{j + 1} 小节", level=2)
+            for k in range(paragraphs):
+                doc.add_paragraph(f"{i + 1}.{j + 1}.{k + 1} 报销申请必须通过飞书提交，超过规定期限的申请不予受理。" * 3)
+        table = doc.add_table(rows=5, cols=4)
+        for r in range(5):
+            for c in range(4):
+                table.cell(r, c).text = f"单元格{r}-{c}"
+    doc.save(path)
+    return path
+
+
+def bench(name: str, parse: Callable[[str], Dict], file_path: str, repeat: int) -> Dict:
+    best = float('inf')
+    analysis = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        analysis = parse(file_path)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    parse(file_path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    builder = TreeBuilder(file_path, doc=analysis).build_tree()
+    size_mb = os.path.getsize(file_path) / 1e6
+    return {
+        "parser": name,
+        "seconds": round(best, 4),
+        "mb_per_s": round(size_mb / best, 3) if best else None,
+        "elements": analysis["total_elements"],
+        "titles": analysis["element_types"].get("Title", 0),
+        "nodes": len(builder.store),
+        "peak_mem_kb": round(peak / 1024, 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='对比快速解析与 unstructured 解析 docx / Markdown 的吞吐量')
+    parser.add_argument('--files', nargs='*', default=[], help='待解析的文档(.docx/.md)')
+    parser.add_argument('--synthetic_sections', type=int, default=0, help='生成含指定章节数的 docx 一并测试')
+    parser.add_argument('--synthetic_paragraphs', type=int, default=20, help='生成的 docx 每个小节的段落数')
+    parser.add_argument('--skip_unstructured', action='store_true', help='只测试快速解析')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    files = list(args.files)
+    if args.synthetic_sections:
+        files.append(make_synthetic_docx('synthetic_bench.docx', args.synthetic_sections, args.synthetic_paragraphs))
+    if not files:
+        parser.error("请通过 --files 或 --synthetic_sections 指定文档")
+
+    parsers = [("fast", parse_file_fast)]
+    if not args.skip_unstructured:
+        from lianxi.load_text.file_parse.file_parse import parse_file_with_unstructured
+        parsers.append(("unstructured", parse_file_with_unstructured))
+
+    print(f"{'file':<30}{'parser':<14}{'seconds':>10}{'MB/s':>10}{'elements':>10}{'titles':>8}{'nodes':>8}{'peak KB':>12}")
+    for file_path in files:
+        results = [bench(name, parse, file_path, args.repeat) for name, parse in parsers]
+        for r in results:
+            print(f"{os.path.basename(file_path)[:28]:<30}{r['parser']:<14}{r['seconds']:>10.4f}{r['mb_per_s']:>10.3f}"
+                  f"{r['elements']:>10}{r['titles']:>8}{r['nodes']:>8}{r['peak_mem_kb']:>12.1f}")
+        if len(results) > 1:
+            print(f"{'':<30}speedup: {results[1]['seconds'] / results[0]['seconds']:.1f}x")
@@ -0,0 +1,81 @@
+import sys
+sys.path.append("./")  # 添加项目根目录到路径中
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Callable, List
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from server.knowledge_base.text_splitter import StreamingTextSplitter
+from server.knowledge_base.utils import CHUNK_OVERLAP, CHUNK_SIZE, TEXT_SEPARATORS, load_file_docs
+
+
+def load_texts(args) -> List[str]:
+    texts = []
+    if args.corpus_path:
+        with open(args.corpus_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    texts.append(item.get("contents") or item.get("text", ""))
+    for file_path in args.files:
+        texts.extend(doc.page_content for doc in load_file_docs(file_path))
+    if args.concat:
+        # 拼接成一个长文档，测试大文件场景
+        texts = ["\n\n".join(texts)]
+    return texts
+
+
+def bench(name: str, split: Callable[[str], List[str]], texts: List[str], repeat: int):
+    total_chars = sum(len(t) for t in texts)
+    best = float('inf')
+    chunks = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = [split(t) for t in texts]
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    for t in texts:
+        split(t)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "splitter": name,
+        "seconds": round(best, 4),
+        "mchars_per_s": round(total_chars / best / 1e6, 3) if best else None,
+        "chunks": sum(len(c) for c in chunks),
+        "peak_mem_kb": round(peak / 1024, 1),
+    }, chunks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='对比流式切分器与 LangChain RecursiveCharacterTextSplitter 的吞吐量')
+    parser.add_argument('--corpus_path', type=str, default=None, help='clean_corpus.jsonl 格式的语料')
+    parser.add_argument('--files', nargs='*', default=[], help='待切分的文档(.docx/.md/.txt)')
+    parser.add_argument('--concat', action='store_true', help='拼接为一个长文档后切分')
+    parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--chunk_overlap', type=int, default=CHUNK_OVERLAP)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    texts = load_texts(args)
+    if not texts:
+        parser.error("请通过 --corpus_path 或 --files 指定语料")
+    print(f"文档 {len(texts)} 个, 共 {sum(len(t) for t in texts)} 字符")
+
+    langchain_splitter = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                                                        separators=TEXT_SEPARATORS)
+    streaming_splitter = StreamingTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                                               separators=TEXT_SEPARATORS)
+
+    ref_result, ref_chunks = bench("langchain", langchain_splitter.split_text, texts, args.repeat)
+    new_result, new_chunks = bench("streaming", streaming_splitter.split_text, texts, args.repeat)
+    identical = ref_chunks == new_chunks
+
+    print(f"{'splitter':<12}{'seconds':>10}{'Mchar/s':>10}{'chunks':>10}{'peak KB':>12}")
+    for r in (ref_result, new_result):
+        print(f"{r['splitter']:<12}{r['seconds']:>10.4f}{r['mchars_per_s']:>10.3f}{r['chunks']:>10}{r['peak_mem_kb']:>12.1f}")
+    print(f"speedup: {ref_result['seconds'] / new_result['seconds']:.2f}x, 切分结果一致: {identical}")
@@ -0,0 +1,285 @@
+import sys
+sys.path.append("./")  # 添加项目根目录到路径中
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import faiss
+import numpy as np
+
+
+class HashEmbedder:
+    """
+    确定性的本地哈希嵌入：字符 n-gram 特征哈希到固定维度(带符号)，再做L2归一化。
+    不依赖模型服务，可离线运行，同一输入在任何机器上得到相同向量，适合对比切分/索引/重排序的改动
+    """
+    def __init__(self, dim: int = 512, ngram_range=(1, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def _features(self, text: str) -> List[str]:
+        text = re.sub(r"\s+", " ", text.lower()).strip()
+        feats = []
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            feats.extend(text[i:i + n] for i in range(len(text) - n + 1))
+        return feats
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feat in self._features(text):
+            h = int.from_bytes(hashlib.blake2b(feat.encode('utf-8'), digest_size=8).digest(), 'little')
+            vector[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed(t).tolist() for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed(text).tolist()
+
+
+def load_corpus(corpus_path: str) -> List[Dict]:
+    """clean_corpus.jsonl 格式：{"id", "title", "contents"}"""
+    corpus = []
+    with open(corpus_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                corpus.append({"id": str(item["id"]), "title": item.get("title", ""),
+                               "contents": item.get("contents") or item.get("text", "")})
+    return corpus
+
+
+def load_eval_set(eval_path: str) -> List[Dict]:
+    """评测集格式：{"question": str, "relevant_ids": [语料 id, ...]}"""
+    items = []
+    with open(eval_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                relevant = item.get("relevant_ids") or item.get("golden_ids") or []
+                items.append({"question": item.get("question") or item.get("query"),
+                              "relevant_ids": [str(i) for i in relevant]})
+    return items
+
+
+def chunk_corpus(corpus: List[Dict], chunk_size: int, chunk_overlap: int, text_splitter: str = "recursive",
+                 dim: int = 512):
+    """
+    按知识库入库时的切分方式切分语料，返回 (切片文本, 切片所属语料id)。
+    chunk_size 为 0 时每条语料作为一个切片；text_splitter 为 semantic 时用哈希嵌入做语义切分
+    """
+    if not chunk_size:
+        return [f"{d['title']}\n{d['contents']}" for d in corpus], [d["id"] for d in corpus]
+
+    if text_splitter == "semantic":
+        from langchain.schema import Document
+        from server.knowledge_base.text_splitter import SemanticTextSplitter
+
+        splitter = SemanticTextSplitter(HashEmbedder(dim=dim), max_chunk_size=chunk_size)
+        docs = splitter.split_documents(
+            Document(page_content=d["contents"], metadata={"id": d["id"], "title": d["title"]}) for d in corpus)
+        return [f"{d.metadata['title']}\n{d.page_content}" for d in docs], [d.metadata["id"] for d in docs]
+
+    from server.knowledge_base.text_splitter import make_text_splitter
+
+    splitter = make_text_splitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    texts, parents = [], []
+    for d in corpus:
+        for chunk in splitter.iter_chunks(d["contents"]):
+            texts.append(f"{d['title']}\n{chunk.text}")
+            parents.append(d["id"])
+    return texts, parents
+
+
+def build_index(vectors: np.ndarray, index_type: str) -> faiss.Index:
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(vectors.shape[1])
+        index.add(vectors)
+        return index
+    from server.knowledge_base.quantization import build_quantized_index
+    return build_quantized_index(vectors, index_type, metric_type=faiss.METRIC_INNER_PRODUCT)
+
+
+# ---------------- 工作进程 ----------------
+
+_worker = {}
+
+
+def _init_worker(index_path: str, vectors_path: str, texts: List[str], parents: List[str], args: Dict):
+    # 多进程并行时每个进程只用一个 faiss 线程，避免线程数超过核数
+    faiss.omp_set_num_threads(1)
+    _worker["index"] = faiss.read_index(index_path)
+    _worker["vectors"] = np.load(vectors_path, mmap_mode='r')
+    _worker["texts"] = texts
+    _worker["parents"] = parents
+    _worker["args"] = args
+    _worker["embedder"] = HashEmbedder(dim=args["dim"])
+    _worker["reranker"] = None
+    if args["rerank"]:
+        from server.knowledge_base.reranker import get_reranker
+        _worker["reranker"] = get_reranker()
+        # 离线评测等待模型加载完成，不设耗时预算
+        _worker["reranker"].warmup(background=False)
+
+
+def _run_query(question: str):
+    args = _worker["args"]
+    timings = {}
+
+    start = time.perf_counter()
+    query = np.asarray([_worker["embedder"].embed(question)], dtype=np.float32)
+    timings["embed_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    fetch_k = args["fetch_k"]
+    if args["index_type"] == "flat":
+        scores, positions = _worker["index"].search(query, fetch_k)
+    else:
+        from server.knowledge_base.quantization import search_with_rescoring
+        scores, positions = search_with_rescoring(_worker["index"], _worker["vectors"], query, fetch_k,
+                                                  args["rescore_factor"])
+    candidates = [(p, s) for p, s in zip(positions[0].tolist(), scores[0].tolist()) if p >= 0]
+    timings["search_ms"] = (time.perf_counter() - start) * 1000
+
+    if _worker["reranker"] is not None and candidates:
+        start = time.perf_counter()
+        rerank_scores, _ = _worker["reranker"].score(question, [_worker["texts"][p] for p, _ in candidates],
+                                                     deadline=float('inf'))
+        if rerank_scores is not None:
+            candidates = sorted(zip([p for p, _ in candidates], rerank_scores), key=lambda x: -x[1])
+        timings["rerank_ms"] = (time.perf_counter() - start) * 1000
+
+    # 切片映射回语料id，同一语料只保留排名最高的切片
+    ranked, seen = [], set()
+    for p, _ in candidates:
+        doc_id = _worker["parents"][p]
+        if doc_id not in seen:
+            seen.add(doc_id)
+            ranked.append(doc_id)
+    timings["total_ms"] = sum(timings.values())
+    return ranked, timings
+
+
+def _run_batch(questions: List[str]):
+    return [_run_query(q) for q in questions]
+
+
+# ---------------- 指标 ----------------
+
+def recall_at_k(ranked: List[str], relevant: set, k: int) -> float:
+    return len(set(ranked[:k]) & relevant) / len(relevant) if relevant else 0.0
+
+
+def mrr(ranked: List[str], relevant: set) -> float:
+    for rank, doc_id in enumerate(ranked, 1):
+        if doc_id in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked: List[str], relevant: set, k: int) -> float:
+    """二值相关性的 nDCG"""
+    dcg = sum(1.0 / np.log2(rank + 1) for rank, doc_id in enumerate(ranked[:k], 1) if doc_id in relevant)
+    ideal = sum(1.0 / np.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal if ideal else 0.0
+
+
+def latency_summary(samples: List[float]) -> Dict:
+    samples = np.asarray(samples, dtype=np.float64)
+    p50, p90, p95, p99 = np.percentile(samples, [50, 90, 95, 99]).tolist()
+    return {"mean": round(float(samples.mean()), 4), "p50": round(p50, 4), "p90": round(p90, 4),
+            "p95": round(p95, 4), "p99": round(p99, 4), "max": round(float(samples.max()), 4)}
+
+
+def evaluate(eval_set: List[Dict], results, ks: List[int]) -> Dict:
+    metrics = {f"recall@{k}": [] for k in ks}
+    metrics.update({f"ndcg@{k}": [] for k in ks})
+    metrics["mrr"] = []
+    stages: Dict[str, List[float]] = {}
+    for item, (ranked, timings) in zip(eval_set, results):
+        relevant = set(item["relevant_ids"])
+        for k in ks:
+            metrics[f"recall@{k}"].append(recall_at_k(ranked, relevant, k))
+            metrics[f"ndcg@{k}"].append(ndcg_at_k(ranked, relevant, k))
+        metrics["mrr"].append(mrr(ranked, relevant))
+        for stage, ms in timings.items():
+            stages.setdefault(stage, []).append(ms)
+    return {
+        "quality": {name: round(float(np.mean(values)), 4) for name, values in metrics.items()},
+        "latency_ms": {stage: latency_summary(values) for stage, values in stages.items()},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='离线评测检索质量(recall@k / MRR / nDCG)与各阶段耗时')
+    parser.add_argument('--corpus_path', type=str, default='clean_corpus.jsonl')
+    parser.add_argument('--eval_file', type=str, required=True, help='JSONL评测集，每行 {"question", "relevant_ids"}')
+    parser.add_argument('--ks', type=int, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--chunk_size', type=int, default=0, help='按入库方式切分语料，0 表示不切分')
+    parser.add_argument('--chunk_overlap', type=int, default=0)
+    parser.add_argument('--text_splitter', type=str, default='recursive', choices=['recursive', 'semantic'])
+    parser.add_argument('--index_type', type=str, default='flat', choices=['flat', 'sq8', 'pq'])
+    parser.add_argument('--rescore_factor', type=int, default=4)
+    parser.add_argument('--rerank', action='store_true', help='使用 cross-encoder 重排序')
+    parser.add_argument('--fetch_k', type=int, default=None, help='向量检索候选数，默认取 max(ks) 的3倍')
+    parser.add_argument('--dim', type=int, default=512, help='哈希嵌入维度')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--save_path', type=str, default=None, help='结果保存为JSON，用于对比不同运行')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus_path)
+    eval_set = [item for item in load_eval_set(args.eval_file) if item["question"]]
+    fetch_k = args.fetch_k or max(args.ks) * 3
+
+    start = time.perf_counter()
+    texts, parents = chunk_corpus(corpus, args.chunk_size, args.chunk_overlap, args.text_splitter, args.dim)
+    embedder = HashEmbedder(dim=args.dim)
+    vectors = np.stack([embedder.embed(t) for t in texts]).astype(np.float32)
+    index = build_index(vectors, args.index_type)
+    build_s = time.perf_counter() - start
+    print(f"语料 {len(corpus)} 条, 切片 {len(texts)} 个, 索引 {args.index_type}, 构建耗时 {build_s:.2f}s")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index_path = os.path.join(tmp_dir, 'index.faiss')
+        vectors_path = os.path.join(tmp_dir, 'vectors.npy')
+        faiss.write_index(index, index_path)
+        np.save(vectors_path, vectors)
+
+        worker_args = {"dim": args.dim, "fetch_k": fetch_k, "index_type": args.index_type,
+                       "rescore_factor": args.rescore_factor, "rerank": args.rerank}
+        questions = [item["question"] for item in eval_set]
+        batches = [questions[i:i + args.batch_size] for i in range(0, len(questions), args.batch_size)]
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.num_workers, initializer=_init_worker,
+                                 initargs=(index_path, vectors_path, texts, parents, worker_args)) as executor:
+            results = [r for batch in executor.map(_run_batch, batches) for r in batch]
+        wall_s = time.perf_counter() - start
+
+    report = {
+        "config": vars(args),
+        "corpus_size": len(corpus),
+        "chunks": len(texts),
+        "queries": len(eval_set),
+        "build_seconds": round(build_s, 3),
+        "wall_seconds": round(wall_s, 3),
+        "qps": round(len(eval_set) / wall_s, 2) if wall_s else None,
+        **evaluate(eval_set, results, args.ks),
+    }
+
+    for name, value in report["quality"].items():
+        print(f"{name:<12}{value:.4f}")
+    for stage, summary in report["latency_ms"].items():
+        print(f"{stage:<12}p50={summary['p50']:.3f}ms p95={summary['p95']:.3f}ms p99={summary['p99']:.3f}ms")
+
+    if args.save_path:
+        with open(args.save_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -242,6 +242,8 @@ if __name__ == '__main__':
     parser.add_argument('--stride', default=None, type=int)
     parser.add_argument('--num_workers', default=12, type=int)
     parser.add_argument('--save_path', type=str, default='clean_corpus.jsonl')
+    parser.add_argument('--dedup_threshold', default=None, type=float,
+                        help='切片近似去重阈值(MinHash估计的Jaccard相似度)，不设置则不去重')
     args = parser.parse_args()
 
     # 设置临时目录用于存储WikiExtractor的输出
@@ -339,6 +341,19 @@ if __name__ == '__main__':
     # 删除临时目录及其内容
     shutil.rmtree(temp_dir)
 
+    if args.dedup_threshold is not None:
+        import sys
+        sys.path.append("./")
+        from server.knowledge_base.dedup import ChunkDeduplicator
+
+        print("Start deduplicating...")
+        deduplicator = ChunkDeduplicator(threshold=args.dedup_threshold)
+        duplicates = deduplicator.find_duplicates([item['text'] for item in clean_corpus])
+        dropped = {idx for idx, _, _ in duplicates}
+        print(f"dedup: total={len(clean_corpus)}, dropped={len(dropped)}, "
+              f"ratio={len(dropped) / max(len(clean_corpus), 1):.4f}")
+        clean_corpus = [item for idx, item in enumerate(clean_corpus) if idx not in dropped]
+
     print("Start saving corpus...")
     # 检查保存路径的目录是否存在，如果不存在则创建
     os.makedirs(os.path.dirname(args.save_path), exist_ok=True)
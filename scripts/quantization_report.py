@@ -0,0 +1,114 @@
+import sys
+sys.path.append("./")  # 添加项目根目录到路径中
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from server.knowledge_base.quantization import (
+    build_quantized_index,
+    extract_vectors,
+    index_memory_bytes,
+    search_with_rescoring,
+)
+from server.knowledge_base.utils import DEFAULT_EMBED_MODEL, get_embeddings, load_vector_store
+
+
+def load_queries(args, vectors: np.ndarray) -> np.ndarray:
+    """
+    评测查询：优先使用评测集中的问题做向量化，否则从库中随机抽取向量作为查询
+    """
+    if args.eval_file:
+        questions = []
+        with open(args.eval_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                item = json.loads(line)
+                questions.append(item.get('question') or item.get('query'))
+        return np.asarray(get_embeddings(args.embed_model).embed_documents(questions), dtype=np.float32)
+    rng = np.random.default_rng(args.seed)
+    idx = rng.choice(len(vectors), size=min(args.sample, len(vectors)), replace=False)
+    return vectors[idx]
+
+
+def recall_at_k(truth: np.ndarray, found: np.ndarray) -> float:
+    """以原始float索引的精确 top k 为标准答案"""
+    hits = 0
+    total = 0
+    for t, f in zip(truth, found):
+        t = set(t[t >= 0].tolist())
+        hits += len(t & set(f[f >= 0].tolist()))
+        total += len(t)
+    return hits / total if total else 0.0
+
+
+def evaluate(method: str, vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, metric_type: int, args):
+    start = time.perf_counter()
+    index = build_quantized_index(vectors, method, metric_type=metric_type)
+    build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, raw = index.search(queries, args.k)
+    raw_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    start = time.perf_counter()
+    _, rescored = search_with_rescoring(index, vectors, queries, args.k, args.rescore_factor)
+    rescored_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    return {
+        "method": method,
+        "index_bytes": index_memory_bytes(index),
+        "build_seconds": round(build_s, 3),
+        f"recall@{args.k}": round(recall_at_k(truth, raw), 4),
+        f"recall@{args.k}_rescored": round(recall_at_k(truth, rescored), 4),
+        "query_ms": round(raw_ms, 3),
+        "query_ms_rescored": round(rescored_ms, 3),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='统计知识库向量量化节省的内存与召回率损失')
+    parser.add_argument('--kb_name', type=str, required=True)
+    parser.add_argument('--embed_model', type=str, default=DEFAULT_EMBED_MODEL)
+    parser.add_argument('--eval_file', type=str, default=None, help='JSONL评测集，每行包含 question 字段')
+    parser.add_argument('--sample', type=int, default=200, help='未提供评测集时抽样的查询数量')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--rescore_factor', type=int, default=4)
+    parser.add_argument('--methods', nargs='+', default=['sq8', 'pq'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save_path', type=str, default=None, help='结果保存为JSON')
+    args = parser.parse_args()
+
+    vector_store = load_vector_store(args.kb_name, args.embed_model)
+    flat_index = vector_store.index
+    vectors = extract_vectors(flat_index)
+    print(f"知识库 {args.kb_name}: {len(vectors)} 个向量, 维度 {flat_index.d}")
+
+    queries = load_queries(args, vectors)
+    if vector_store._normalize_L2:
+        faiss.normalize_L2(queries)
+    _, truth = flat_index.search(queries, args.k)
+
+    report = {
+        "kb_name": args.kb_name,
+        "vectors": len(vectors),
+        "dim": flat_index.d,
+        "queries": len(queries),
+        "flat_index_bytes": index_memory_bytes(flat_index),
+        "results": [],
+    }
+    for method in args.methods:
+        result = evaluate(method, vectors, queries, truth, flat_index.metric_type, args)
+        result["memory_saved"] = round(1 - result["index_bytes"] / report["flat_index_bytes"], 4)
+        report["results"].append(result)
+
+    print(f"{'method':<8}{'bytes':>14}{'saved':>8}{'recall':>10}{'rescored':>10}{'ms':>8}{'ms(rs)':>8}")
+    for r in report["results"]:
+        print(f"{r['method']:<8}{r['index_bytes']:>14}{r['memory_saved']:>8.2%}"
+              f"{r[f'recall@{args.k}']:>10.4f}{r[f'recall@{args.k}_rescored']:>10.4f}"
+              f"{r['query_ms']:>8.3f}{r['query_ms_rescored']:>8.3f}")
+
+    if args.save_path:
+        with open(args.save_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
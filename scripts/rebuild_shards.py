@@ -0,0 +1,24 @@
+import sys
+sys.path.append("./")  # 添加项目根目录到路径中
+import argparse
+
+from server.knowledge_base.utils import DEFAULT_EMBED_MODEL
+from server.knowledge_base.vs_writer import rebuild_shards
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重建分片向量库的指定分片，重建完成的分片逐个发布并切换")
+    parser.add_argument("kb_name", help="知识库名称")
+    parser.add_argument("--shards", type=int, nargs="*", help="分片编号，默认重建全部分片")
+    parser.add_argument("--embed-model", default=DEFAULT_EMBED_MODEL)
+    args = parser.parse_args()
+
+    versions = rebuild_shards(args.kb_name, args.shards, args.embed_model)
+    for shard_id, version in versions.items():
+        print(f"分片 {shard_id}: {version}")
+    if not versions:
+        print("没有需要重建的分片")
+
+
+if __name__ == "__main__":
+    main()
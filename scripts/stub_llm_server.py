@@ -0,0 +1,106 @@
+"""
+模拟LLM后端，用于在本地测试模型路由的对冲与回退：同时提供 OpenAI 兼容接口(DeepSeek)和 Ollama 接口。
+
+    python scripts/stub_llm_server.py --port 9001 --name fast
+    python scripts/stub_llm_server.py --port 9002 --name slow --first_token_delay 5 --fail_rate 0.3
+
+然后在 configs/db.yaml 的 chat.llm.backends 中把 base_url 指向 http://127.0.0.1:9001/v1 (deepseek)
+或 http://127.0.0.1:9002 (ollama)，DeepSeek 后端需要设置任意的 DEEPSEEK_API_KEY 环境变量
+"""
+
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(args):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *a):
+            pass
+
+        def _answer_tokens(self):
+            return [f"[{args.name}]"] + [f" token{i}" for i in range(args.tokens)]
+
+        def _fail(self) -> bool:
+            if random.random() < args.fail_rate:
+                body = json.dumps({"error": {"message": f"{args.name} injected failure"}}).encode()
+                self.send_response(500)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return True
+            return False
+
+        def _write_chunk(self, data: bytes):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def _stream(self, content_type: str, lines):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            time.sleep(args.first_token_delay)
+            try:
+                for i, line in enumerate(lines):
+                    if i:
+                        time.sleep(args.token_delay)
+                    self._write_chunk(line)
+                self._write_chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                # 路由取消了对冲中落败的请求
+                pass
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if self._fail():
+                return
+            model = request.get("model", args.name)
+            tokens = self._answer_tokens()
+            if self.path.endswith("/chat/completions"):
+                def lines():
+                    for token in tokens:
+                        chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                                 "model": model,
+                                 "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                        yield f"data: {json.dumps(chunk)}\n\n".encode()
+                    yield b"data: [DONE]\n\n"
+                self._stream("text/event-stream", lines())
+            elif self.path == "/api/chat":
+                def lines():
+                    for token in tokens:
+                        yield (json.dumps({"model": model, "created_at": "2024-01-01T00:00:00Z",
+                                           "message": {"role": "assistant", "content": token},
+                                           "done": False}) + "\n").encode()
+                    yield (json.dumps({"model": model, "created_at": "2024-01-01T00:00:00Z",
+                                       "message": {"role": "assistant", "content": ""},
+                                       "done": True, "done_reason": "stop"}) + "\n").encode()
+                self._stream("application/x-ndjson", lines())
+            else:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+    return StubHandler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='模拟LLM后端(OpenAI兼容接口 + Ollama接口)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9001)
+    parser.add_argument('--name', default='stub', help='回答以 [name] 开头，便于区分实际响应的后端')
+    parser.add_argument('--first_token_delay', type=float, default=0.2, help='首个token前的等待秒数')
+    parser.add_argument('--token_delay', type=float, default=0.02)
+    parser.add_argument('--tokens', type=int, default=20)
+    parser.add_argument('--fail_rate', type=float, default=0.0, help='直接返回500的请求比例')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args))
+    print(f"stub LLM '{args.name}' listening on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,47 @@
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import time
+from typing import Optional
+
+from configs.config import cfg
+
+logger = logging.getLogger(__name__)
+
+auth_cfg = cfg.get('auth', {})
+
+
+def _load_secret() -> bytes:
+    secret = os.environ.get("AUTH_SECRET") or auth_cfg.get('secret')
+    if not secret:
+        # 每个进程随机生成，多 worker 或重启后之前签发的令牌失效，只适合单进程开发环境
+        logger.warning("未配置 auth.secret(或环境变量 AUTH_SECRET)，使用随机密钥签发登录令牌")
+        secret = secrets.token_hex(32)
+    return secret.encode('utf-8')
+
+
+_SECRET = _load_secret()
+
+
+def _sign(payload: str) -> str:
+    return hmac.new(_SECRET, payload.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def issue_token(user_id: str, ttl: float = auth_cfg.get('token_ttl', 7 * 24 * 3600)) -> str:
+    """登录成功后签发的令牌：用户ID.过期时间.签名，前端以 Bearer 携带"""
+    payload = f"{user_id}.{int(time.time() + ttl)}"
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify_token(token: str) -> Optional[str]:
+    """校验令牌签名和有效期，返回用户ID；伪造、篡改或过期的令牌返回 None"""
+    try:
+        user_id, expires, signature = token.rsplit(".", 2)
+        expired = int(expires) < time.time()
+    except ValueError:
+        return None
+    if expired or not user_id or not hmac.compare_digest(signature, _sign(f"{user_id}.{expires}")):
+        return None
+    return user_id
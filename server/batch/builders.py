@@ -0,0 +1,130 @@
+import re
+import string
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from server.batch.jobs import batch_cfg, batch_manager
+from server.scheduler import Priority, scheduler
+
+# 知识库摘要/FAQ 每段送入模型的最大字符数
+MAX_INPUT_CHARS = batch_cfg.get('max_input_chars', 6000)
+# 会话标题最大长度，与 conversation.name 字段长度一致
+MAX_TITLE_CHARS = 50
+
+PROMPT_TEMPLATES = {
+    "kb_summary": "请为下面的文档写一段300字以内的摘要，概括文档的主题、关键规定和适用范围。\n\n"
+                  "文档名称：{file_name}\n文档内容：\n{text}\n",
+    "faq": "请根据下面的文档片段生成3到5组常见问答，只输出JSON数组，"
+           "格式为 [{{\"question\": \"...\", \"answer\": \"...\"}}]，答案必须来自文档内容。\n\n"
+           "文档名称：{file_name}\n文档片段：\n{text}\n",
+    "conversation_title": "请根据用户的第一个问题和回答，为这次对话起一个不超过15个字的标题，只输出标题本身。\n\n"
+                          "问题：{query}\n回答：{response}\n",
+}
+
+
+def parse_template(template: str) -> List[Tuple[str, Optional[str]]]:
+    """
+    解析提示词模板为 [(字面文本, 变量名), ...]。只允许 {name} 形式的占位符：
+    str.format 支持的属性访问({x.__class__})、下标({x[0]})、转换({x!r})和格式说明({x:>10})一律拒绝，
+    模板由调用方提供，不能借此读取变量对象的属性
+    """
+    try:
+        parts = list(string.Formatter().parse(template))
+    except ValueError as e:
+        raise ValueError(f"模板格式错误: {e}")
+    for _, field, format_spec, conversion in parts:
+        if field is None:
+            continue
+        if not field.isidentifier() or format_spec or conversion:
+            raise ValueError(f"模板占位符只能是 {{变量名}} 形式: {field!r}")
+    return [(literal, field) for literal, field, _, _ in parts]
+
+
+def render_template(parts: List[Tuple[str, Optional[str]]], variables: Dict) -> str:
+    """用 variables 填充 parse_template 的结果，缺少变量时抛出 ValueError"""
+    missing = sorted({field for _, field in parts if field is not None and field not in variables})
+    if missing:
+        raise ValueError(f"缺少模板变量: {', '.join(missing)}")
+    return "".join(literal + (str(variables[field]) if field is not None else "") for literal, field in parts)
+
+
+async def prompt_items(prompts: List, template: str = None) -> AsyncIterator[Dict]:
+    """
+    通用任务：prompts 中每项为字符串，或 {"id", "prompt"}/{"id", "variables"}；
+    给定 template 时用 variables 填充模板，模板或变量不合法时抛出 ValueError 并指明条目
+    """
+    parts = parse_template(template) if template is not None else None
+    for i, p in enumerate(prompts):
+        if isinstance(p, str):
+            p = {"prompt": p}
+        item = {"id": p.get("id", i), "meta": p.get("meta", {})}
+        if parts is not None and "variables" in p:
+            if not isinstance(p["variables"], dict):
+                raise ValueError(f"条目 {item['id']}: variables 必须是对象")
+            try:
+                item["prompt"] = render_template(parts, p["variables"])
+            except ValueError as e:
+                raise ValueError(f"条目 {item['id']}: {e}")
+        else:
+            item["prompt"] = p["prompt"]
+        yield item
+
+
+def _load_text(file_path: str) -> str:
+    from server.knowledge_base.utils import load_file_docs
+
+    return "\n".join(doc.page_content for doc in load_file_docs(file_path))
+
+
+async def kb_document_items(kb_name: str, kind: str, max_input_chars: int = MAX_INPUT_CHARS) -> AsyncIterator[Dict]:
+    """
+    知识库中的每个文档：摘要任务截取文档开头，FAQ任务按 max_input_chars 分段，每段一个条目
+    """
+    from server.knowledge_base.utils import get_doc_path, validate_kb_name
+
+    doc_path = get_doc_path(validate_kb_name(kb_name))
+    if not doc_path.exists():
+        raise ValueError(f"知识库不存在: {kb_name}")
+    template = PROMPT_TEMPLATES[kind]
+    for file_path in sorted(p for p in doc_path.iterdir() if p.is_file()):
+        # 文档解析是阻塞的CPU任务，放到批量优先级线程池，不影响在线检索
+        text = await scheduler.run(Priority.BULK, _load_text, str(file_path))
+        if not text.strip():
+            continue
+        meta = {"kb_name": kb_name, "file_name": file_path.name}
+        if kind == "kb_summary":
+            yield {"id": file_path.name, "meta": meta,
+                   "prompt": template.format(file_name=file_path.name, text=text[:max_input_chars])}
+            continue
+        for i, start in enumerate(range(0, len(text), max_input_chars)):
+            yield {"id": f"{file_path.name}#{i}", "meta": {**meta, "part": i},
+                   "prompt": template.format(file_name=file_path.name, text=text[start:start + max_input_chars])}
+
+
+async def conversation_title_items(user_id: str = None) -> AsyncIterator[Dict]:
+    """名称仍为默认名称或首个问题的会话，按首条问答生成标题"""
+    from routers.message_repository import list_untitled_conversations
+
+    template = PROMPT_TEMPLATES["conversation_title"]
+    for c in await list_untitled_conversations(user_id=user_id):
+        yield {"id": c["conversation_id"], "meta": {"conversation_id": c["conversation_id"], "old_name": c["name"]},
+               "prompt": template.format(query=c["query"][:1000], response=c["response"][:500])}
+
+
+def clean_title(output: str) -> str:
+    lines = [line.strip() for line in output.strip().splitlines() if line.strip()]
+    title = lines[0] if lines else ""
+    title = re.sub(r"^(标题[:：]\s*)", "", title).strip(" \"'“”‘’《》#*")
+    return title[:MAX_TITLE_CHARS]
+
+
+async def apply_conversation_title(item: Dict, output: str) -> None:
+    """生成的标题写回会话名称"""
+    from routers.message_repository import update_conversation_name
+
+    title = clean_title(output)
+    if not title:
+        raise ValueError("模型没有返回标题")
+    await update_conversation_name(item["meta"]["conversation_id"], title)
+
+
+batch_manager.register_handler("conversation_titles", apply_conversation_title)
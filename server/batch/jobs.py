@@ -0,0 +1,328 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Set
+
+from langchain_core.prompt_values import StringPromptValue
+
+from configs.config import cfg
+from server.chat.model_router import model_router
+from server.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+batch_cfg = cfg.get('batch', {})
+
+BASE_PATH = Path(__file__).resolve().parents[2]
+BATCH_ROOT_PATH = BASE_PATH / batch_cfg.get('root_path', 'batch_jobs')
+
+PENDING, RUNNING, COMPLETED, CANCELLED, FAILED, INTERRUPTED = \
+    "pending", "running", "completed", "cancelled", "failed", "interrupted"
+
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# 单条结果处理完成后的回调(如把生成的标题写回数据库)，抛出异常时该条记为失败，续跑时重试
+ResultHandler = Callable[[Dict, str], Awaitable[None]]
+
+
+class BatchJob:
+    """
+    一个批量任务，目录结构：
+        <root>/<job_id>/job.json       任务参数和状态
+        <root>/<job_id>/input.jsonl    待处理条目，每行 {"id", "prompt", "meta"}
+        <root>/<job_id>/results.jsonl  处理结果，每条完成后立即追加一行
+
+    续跑时跳过 results.jsonl 中已成功的条目，失败的条目重新处理(同一条目以最后一行为准)
+    """
+    def __init__(self, job_id: str, spec: Dict):
+        self.job_id = job_id
+        self.spec = spec
+        self.path = BATCH_ROOT_PATH / job_id
+        self.status = spec.get("status", PENDING)
+        self.total = spec.get("total", 0)
+        self.succeeded: Set[str] = set()
+        self.failed: Set[str] = set()
+        self.in_flight = 0
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        # 本次运行的起始时间和起始完成数，用于计算处理速度
+        self._run_started: Optional[float] = None
+        self._run_done_from = 0
+
+    @property
+    def input_path(self) -> Path:
+        return self.path / "input.jsonl"
+
+    @property
+    def results_path(self) -> Path:
+        return self.path / "results.jsonl"
+
+    def save(self) -> None:
+        self.spec.update(status=self.status, total=self.total, error=self.error,
+                         succeeded=len(self.succeeded), failed=len(self.failed))
+        tmp_path = self.path / "job.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.spec, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path / "job.json")
+
+    @classmethod
+    def load(cls, job_id: str) -> Optional["BatchJob"]:
+        spec_path = BATCH_ROOT_PATH / job_id / "job.json"
+        if not JOB_ID_PATTERN.match(job_id) or not spec_path.exists():
+            return None
+        with open(spec_path, "r", encoding="utf-8") as f:
+            job = cls(job_id, json.load(f))
+        job.error = job.spec.get("error")
+        job.load_results()
+        if job.status in (PENDING, RUNNING):
+            # 进程重启前未完成的任务
+            job.status = INTERRUPTED
+        return job
+
+    def load_results(self) -> None:
+        self.succeeded, self.failed = set(), set()
+        if not self.results_path.exists():
+            return
+        for record in iter_jsonl(self.results_path):
+            if record.get("status") == "ok":
+                self.succeeded.add(record["id"])
+                self.failed.discard(record["id"])
+            elif record["id"] not in self.succeeded:
+                self.failed.add(record["id"])
+
+    def iter_pending(self) -> Iterator[Dict]:
+        for item in iter_jsonl(self.input_path):
+            if item["id"] not in self.succeeded:
+                yield item
+
+    def status_dict(self) -> Dict:
+        done = len(self.succeeded) + len(self.failed)
+        rate = eta = None
+        if self.status == RUNNING and self._run_started is not None:
+            elapsed = time.monotonic() - self._run_started
+            finished = len(self.succeeded) - self._run_done_from
+            if elapsed > 0 and finished > 0:
+                rate = finished / elapsed
+                eta = (self.total - len(self.succeeded)) / rate
+        return {
+            "job_id": self.job_id,
+            "kind": self.spec.get("kind"),
+            "status": self.status,
+            "total": self.total,
+            "succeeded": len(self.succeeded),
+            "failed": len(self.failed),
+            "pending": max(self.total - done, 0),
+            "in_flight": self.in_flight,
+            "items_per_sec": round(rate, 3) if rate else None,
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "created_at": self.spec.get("created_at"),
+            "started_at": self.spec.get("started_at"),
+            "finished_at": self.spec.get("finished_at"),
+            "error": self.error,
+            "results_path": str(self.results_path),
+        }
+
+
+def iter_jsonl(path: Path) -> Iterator[Dict]:
+    """逐行读取 JSONL，跳过进程中断时写了一半的行"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"跳过无法解析的行: {path}")
+
+
+class BatchJobManager:
+    """
+    批量LLM任务：条目逐行写入磁盘，按有界并发调用模型，失败按指数退避重试，结果逐条追加到 JSONL。
+    所有任务共享 max_concurrent 个并发名额，避免批量任务挤占在线聊天的模型后端
+    """
+    def __init__(self,
+                 max_concurrent: int = 8,
+                 concurrency: int = 4,
+                 max_retries: int = 3,
+                 backoff_base: float = 1.0,
+                 backoff_max: float = 30,
+                 item_timeout: float = 120,
+                 chat_type: str = "batch"):
+        self.max_concurrent = max_concurrent
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.item_timeout = item_timeout
+        self.chat_type = chat_type
+        self._jobs: Dict[str, BatchJob] = {}
+        self._handlers: Dict[str, ResultHandler] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def register_handler(self, kind: str, handler: ResultHandler) -> None:
+        self._handlers[kind] = handler
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # 在事件循环中首次使用时创建
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    async def create_job(self, kind: str, items: AsyncIterator[Dict], **options) -> BatchJob:
+        """写入全部条目后启动任务。条目缺少 id 时按序号编号"""
+        job_id = uuid.uuid4().hex
+        job = BatchJob(job_id, {"kind": kind, "created_at": time.time(), **options})
+        job.path.mkdir(parents=True, exist_ok=True)
+        seen = set()
+        try:
+            with open(job.input_path, "w", encoding="utf-8") as f:
+                async for item in items:
+                    item_id = str(item.get("id", job.total))
+                    if item_id in seen:
+                        raise ValueError(f"条目ID重复: {item_id}")
+                    seen.add(item_id)
+                    f.write(json.dumps({"id": item_id, "prompt": item["prompt"], "meta": item.get("meta", {})},
+                                       ensure_ascii=False) + "\n")
+                    job.total += 1
+        except BaseException:
+            shutil.rmtree(job.path, ignore_errors=True)
+            raise
+        job.save()
+        self._jobs[job_id] = job
+        self.start(job)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[BatchJob]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            job = BatchJob.load(job_id)
+            if job is not None:
+                self._jobs[job_id] = job
+        return job
+
+    def list_jobs(self) -> List[BatchJob]:
+        if BATCH_ROOT_PATH.exists():
+            for path in BATCH_ROOT_PATH.iterdir():
+                if path.name not in self._jobs:
+                    self.get_job(path.name)
+        return sorted(self._jobs.values(), key=lambda j: j.spec.get("created_at", 0), reverse=True)
+
+    def start(self, job: BatchJob) -> None:
+        """启动或续跑任务，已在运行时不做处理"""
+        if job.task is not None and not job.task.done():
+            return
+        job.status, job.error = RUNNING, None
+        job.spec["started_at"] = time.time()
+        job.spec["finished_at"] = None
+        job.save()
+        job.task = asyncio.create_task(self._run(job))
+
+    def cancel(self, job: BatchJob) -> None:
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+
+    async def _run(self, job: BatchJob) -> None:
+        job.load_results()
+        job._run_started, job._run_done_from = time.monotonic(), len(job.succeeded)
+        items = job.iter_pending()
+        concurrency = max(1, min(job.spec.get("concurrency") or self.concurrency, self.max_concurrent))
+        try:
+            with open(job.results_path, "a+", encoding="utf-8") as out:
+                # 上次中断时最后一行可能没写完，先补一个换行
+                if out.tell() > 0:
+                    out.seek(out.tell() - 1)
+                    if out.read(1) != "\n":
+                        out.write("\n")
+                # 多个worker共用同一个条目迭代器，磁盘上的条目按需读取，不一次性载入内存
+                await asyncio.gather(*[self._worker(job, items, out) for _ in range(concurrency)])
+            job.status = COMPLETED
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+        except Exception as e:
+            logger.exception(f"批量任务失败: {job.job_id}")
+            job.status, job.error = FAILED, repr(e)
+        finally:
+            job.spec["finished_at"] = time.time()
+            job.save()
+            logger.info(f"批量任务结束: {job.job_id} {job.status}, 成功 {len(job.succeeded)}, 失败 {len(job.failed)}")
+
+    async def _worker(self, job: BatchJob, items: Iterator[Dict], out) -> None:
+        handler = self._handlers.get(job.spec.get("kind"))
+        for item in items:
+            record = await self._process(job, item, handler)
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if record["status"] == "ok":
+                job.succeeded.add(item["id"])
+                job.failed.discard(item["id"])
+                metrics.inc("batch_items_succeeded")
+            else:
+                job.failed.add(item["id"])
+                metrics.inc("batch_items_failed")
+
+    async def _process(self, job: BatchJob, item: Dict, handler: Optional[ResultHandler]) -> Dict:
+        max_retries = job.spec.get("max_retries", self.max_retries)
+        start = time.monotonic()
+        error = None
+        for attempt in range(max_retries + 1):
+            if attempt:
+                # 指数退避加随机抖动，避免后端恢复时所有条目同时重试
+                delay = min(self.backoff_base * 2 ** (attempt - 1), self.backoff_max) * random.uniform(0.5, 1.5)
+                metrics.inc("batch_retries")
+                await asyncio.sleep(delay)
+            meta = {}
+            try:
+                async with self.semaphore:
+                    job.in_flight += 1
+                    try:
+                        output = await asyncio.wait_for(self._generate(job, item["prompt"], meta), self.item_timeout)
+                    finally:
+                        job.in_flight -= 1
+                if handler is not None:
+                    await handler(item, output)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = repr(e)
+                logger.warning(f"批量任务条目失败(第{attempt + 1}次): {job.job_id}/{item['id']}: {error}")
+                continue
+            metrics.observe("batch_item_ms", (time.monotonic() - start) * 1000)
+            return {"id": item["id"], "status": "ok", "output": output, "meta": item.get("meta", {}),
+                    "backend": meta.get("backend"), "attempts": attempt + 1}
+        return {"id": item["id"], "status": "error", "error": error, "meta": item.get("meta", {}),
+                "attempts": max_retries + 1}
+
+    async def _generate(self, job: BatchJob, prompt: str, meta: Dict) -> str:
+        chat_type = job.spec.get("chat_type") or self.chat_type
+        parts = []
+        async for token in model_router.astream(StringPromptValue(text=prompt), chat_type=chat_type,
+                                                meta=meta, hedge=False):
+            parts.append(token)
+        return "".join(parts)
+
+    def stats(self) -> Dict:
+        running = [j for j in self._jobs.values() if j.status == RUNNING]
+        return {
+            "running_jobs": len(running),
+            "in_flight": sum(j.in_flight for j in running),
+            "max_concurrent": self.max_concurrent,
+        }
+
+
+batch_manager = BatchJobManager(max_concurrent=batch_cfg.get('max_concurrent', 8),
+                                concurrency=batch_cfg.get('concurrency', 4),
+                                max_retries=batch_cfg.get('max_retries', 3),
+                                backoff_base=batch_cfg.get('backoff_base', 1.0),
+                                backoff_max=batch_cfg.get('backoff_max', 30),
+                                item_timeout=batch_cfg.get('item_timeout', 120),
+                                chat_type=batch_cfg.get('chat_type', 'batch'))
+metrics.register_collector("batch_jobs", batch_manager.stats)
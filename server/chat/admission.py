@@ -0,0 +1,298 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional
+
+from server.chat.broadcaster import chat_cfg
+from server.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+admission_cfg = chat_cfg.get('admission', {})
+
+# 进程内令牌桶最多保留的用户数，超出后淘汰最久未请求的用户(其令牌桶已回满，淘汰不影响限流结果)
+MAX_TRACKED_USERS = 100000
+
+# 令牌桶的 Redis 实现，补充令牌与扣减在同一个脚本中原子完成；返回需要等待的秒数(字符串，避免被截断为整数)
+_REDIS_TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or burst
+local ts = tonumber(data[2]) or now
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+# 退回一个令牌(不超过 burst)，令牌桶已过期时无需退回
+_REDIS_REFUND = """
+local burst = tonumber(ARGV[1])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('HSET', KEYS[1], 'tokens', math.min(burst, tokens + 1))
+end
+return 1
+"""
+
+
+class AdmissionRejected(Exception):
+    """请求未被接纳，retry_after 为建议的重试等待秒数"""
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def acquire(self, now: float) -> float:
+        """取一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class MemoryRateLimiter:
+    """进程内的按用户令牌桶"""
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    async def acquire(self, user: str) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            bucket = self._buckets[user] = TokenBucket(self.rate, self.burst, now)
+            if len(self._buckets) > MAX_TRACKED_USERS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user)
+        return bucket.acquire(now)
+
+    async def refund(self, user: str) -> None:
+        bucket = self._buckets.get(user)
+        if bucket is not None:
+            bucket.tokens = min(bucket.burst, bucket.tokens + 1)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RedisRateLimiter:
+    """
+    多个worker共享的按用户令牌桶，依赖可选的 redis 包。Redis 不可用时放行请求，不因限流组件故障拒绝服务
+    """
+    def __init__(self, rate: float, burst: float, redis_url: str, key_prefix: str = "chat:ratelimit:"):
+        import redis.asyncio as redis
+
+        self.rate = rate
+        self.burst = burst
+        self.key_prefix = key_prefix
+        self._client = redis.from_url(redis_url)
+        self._script = self._client.register_script(_REDIS_TOKEN_BUCKET)
+        self._refund_script = self._client.register_script(_REDIS_REFUND)
+
+    async def acquire(self, user: str) -> float:
+        try:
+            wait = await self._script(keys=[self.key_prefix + user], args=[self.rate, self.burst, time.time()])
+        except Exception as e:
+            logger.warning(f"Redis 限流失败，放行请求: {e}")
+            metrics.inc("chat_admission_backend_errors")
+            return 0.0
+        return float(wait)
+
+    async def refund(self, user: str) -> None:
+        try:
+            await self._refund_script(keys=[self.key_prefix + user], args=[self.burst])
+        except Exception as e:
+            logger.warning(f"Redis 退回限流令牌失败: {e}")
+            metrics.inc("chat_admission_backend_errors")
+
+    def __len__(self):
+        return 0
+
+
+class FairSemaphore:
+    """
+    全局并发上限 + 按用户轮转的公平排队：有空位时按用户轮流放行，
+    同一个用户排了很多请求也不会挡住其他用户。队列已满或排队超时返回 AdmissionRejected
+    """
+    def __init__(self, limit: int, max_queue: int, max_wait: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.queued = 0
+        self._queues: Dict[str, Deque[asyncio.Future]] = {}
+        # 有请求在排队的用户，按轮转顺序
+        self._order: Deque[str] = deque()
+        # 每个名额平均占用时长的指数滑动平均，用于估计 Retry-After
+        self._avg_hold = 10.0
+
+    def _retry_after(self) -> float:
+        return max(1.0, self._avg_hold * (self.queued + 1) / self.limit)
+
+    async def acquire(self, user: str) -> None:
+        if self.active < self.limit and not self.queued:
+            self.active += 1
+            return
+        if self.queued >= self.max_queue:
+            raise AdmissionRejected("queue_full", self._retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(user)
+        if queue is None:
+            queue = self._queues[user] = deque()
+            self._order.append(user)
+        queue.append(future)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # 超时的同时已被放行，把名额交还
+                self.release()
+            else:
+                future.cancel()
+                self._remove(user, future)
+            if isinstance(e, asyncio.TimeoutError):
+                raise AdmissionRejected("queue_timeout", self._retry_after())
+            raise
+
+    def _remove(self, user: str, future: asyncio.Future) -> None:
+        queue = self._queues.get(user)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.queued -= 1
+            if not queue:
+                del self._queues[user]
+                self._order.remove(user)
+
+    def release(self, hold_seconds: float = None) -> None:
+        if hold_seconds is not None:
+            self._avg_hold = 0.9 * self._avg_hold + 0.1 * hold_seconds
+        self.active -= 1
+        while self._order and self.active < self.limit:
+            user = self._order.popleft()
+            queue = self._queues[user]
+            future = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self._order.append(user)
+            else:
+                del self._queues[user]
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+
+class AdmissionController:
+    """
+    /api/chat 的准入控制：先按用户令牌桶限流，再在全局并发上限下公平排队。
+    只有新启动的生成消耗令牌、占用并发名额：复用进行中生成的请求不经过准入，
+    排队被拒或排队期间相同请求已开始生成时退回令牌；名额在生成结束(完成、失败或取消)时释放
+    """
+    def __init__(self,
+                 rate: float = 0.5,
+                 burst: float = 5,
+                 max_concurrent: int = 16,
+                 max_queue: int = 64,
+                 max_queue_wait: float = 10,
+                 backend: str = "memory",
+                 redis_url: str = None):
+        if backend == "redis":
+            self.limiter = RedisRateLimiter(rate, burst, redis_url)
+        elif backend == "memory":
+            self.limiter = MemoryRateLimiter(rate, burst)
+        else:
+            raise ValueError(f"不支持的限流存储: {backend}")
+        self.semaphore = FairSemaphore(max_concurrent, max_queue, max_queue_wait)
+
+    async def check_rate(self, user: str) -> None:
+        wait = await self.limiter.acquire(user)
+        if wait > 0:
+            metrics.inc("chat_admission_rejected_rate")
+            raise AdmissionRejected("rate_limited", wait)
+
+    async def acquire_slot(self, user: str) -> float:
+        """等待并发名额，返回获得名额的时间点，释放时传回 release_slot"""
+        start = time.monotonic()
+        try:
+            await self.semaphore.acquire(user)
+        except AdmissionRejected as e:
+            metrics.inc(f"chat_admission_rejected_{e.reason}")
+            raise
+        acquired = time.monotonic()
+        metrics.observe("chat_admission_queue_ms", (acquired - start) * 1000)
+        return acquired
+
+    def release_slot(self, acquired: float) -> None:
+        self.semaphore.release(time.monotonic() - acquired)
+
+    async def admit(self, user: str) -> float:
+        """新生成的准入：扣一个令牌并等待并发名额，返回获得名额的时间点；排队被拒时退回令牌"""
+        await self.check_rate(user)
+        try:
+            return await self.acquire_slot(user)
+        except BaseException:
+            await self.limiter.refund(user)
+            raise
+
+    async def withdraw(self, user: str, acquired: float) -> None:
+        """已准入但没有启动新生成(排队期间相同请求已开始生成)：释放名额并退回令牌"""
+        self.release_slot(acquired)
+        await self.limiter.refund(user)
+
+    def stats(self) -> Dict:
+        return {
+            "active": self.semaphore.active,
+            "queued": self.semaphore.queued,
+            "limit": self.semaphore.limit,
+            "tracked_users": len(self.limiter),
+        }
+
+
+def _create_admission_controller() -> Optional[AdmissionController]:
+    if not admission_cfg.get('enable', True):
+        return None
+    backend = admission_cfg.get('backend', 'memory')
+    kwargs = dict(rate=admission_cfg.get('rate', 0.5),
+                  burst=admission_cfg.get('burst', 5),
+                  max_concurrent=admission_cfg.get('max_concurrent', 16),
+                  max_queue=admission_cfg.get('max_queue', 64),
+                  max_queue_wait=admission_cfg.get('max_queue_wait', 10))
+    try:
+        return AdmissionController(backend=backend, redis_url=admission_cfg.get('redis_url'), **kwargs)
+    except ImportError:
+        logger.warning("未安装 redis，限流改用进程内令牌桶")
+        return AdmissionController(backend="memory", **kwargs)
+
+
+admission_controller = _create_admission_controller()
+if admission_controller is not None:
+    metrics.register_collector("chat_admission", admission_controller.stats)
+
+
+def retry_after_header(retry_after: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(retry_after)))}
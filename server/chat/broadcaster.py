@@ -0,0 +1,297 @@
+import asyncio
+import hashlib
+import logging
+import uuid
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from configs.config import cfg
+from server.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+chat_cfg = cfg.get('chat', {})
+stream_cfg = chat_cfg.get('stream', {})
+
+StreamKey = Tuple[str, str]
+
+
+class StreamGap(Exception):
+    """要读取的位置已移出环形缓冲，需要先从数据库中保存的部分回答补齐"""
+    def __init__(self, offset: int):
+        super().__init__(offset)
+        self.offset = offset
+
+
+class GenerationStream:
+    """
+    一次上游生成的token流：生成任务发布token，任意多个订阅者各自从断点回放后继续跟随。
+    订阅者断开只影响自己，不影响生成任务和其他订阅者。
+
+    每段文本以其结束处在回答中的字符偏移作为SSE事件id，断线重连时客户端带上 Last-Event-ID 即可从断点续传；
+    按字符偏移而不是token序号编号，移出缓冲或生成结束后也能直接按偏移从数据库中的回答续传。
+
+    内存中只保留最近 ring_size 个token的环形缓冲，生成任务定期把部分回答保存到数据库并调用 mark_persisted，
+    只有已保存的token才会移出缓冲，更早的位置由 follow 从数据库补齐
+    """
+    def __init__(self, key: StreamKey, ring_size: int = 1024):
+        self.key = key
+        # 提前分配消息ID，订阅者不必等待消息写入数据库即可拿到，用于断线重连
+        self.message_id = str(uuid.uuid4())
+        self.ring_size = ring_size
+        # (token结束处的字符偏移, token)，偏移单调递增
+        self.ring: Deque[Tuple[int, str]] = deque()
+        # 已移出缓冲的token数，订阅者用 evicted + 缓冲内下标 作为token序号
+        self.evicted = 0
+        self.length = 0
+        # 已保存到数据库的字符数
+        self.persisted = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.cancelled = False
+        # 最后一个订阅者断开时已生成的token数，之后生成的token没有人接收
+        self.idle_from: Optional[int] = None
+        # 订阅者全部断开时回调，由 ChatBroadcaster 设置
+        self.on_idle: Optional[Callable[["GenerationStream"], None]] = None
+        self._event = asyncio.Event()
+
+    def _wake(self) -> None:
+        # 唤醒所有等待者后换一个新的 Event，下次等待不会立即返回
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    def _trim(self) -> None:
+        while len(self.ring) > self.ring_size and self.ring[0][0] <= self.persisted:
+            self.ring.popleft()
+            self.evicted += 1
+
+    @property
+    def token_count(self) -> int:
+        return self.evicted + len(self.ring)
+
+    @property
+    def ring_start(self) -> int:
+        """缓冲中最早的字符偏移，之前的部分只能从数据库读取"""
+        if not self.ring:
+            return self.length
+        end, token = self.ring[0]
+        return end - len(token)
+
+    def publish(self, token: str) -> None:
+        self.length += len(token)
+        self.ring.append((self.length, token))
+        self._trim()
+        self._wake()
+
+    def mark_persisted(self, offset: int) -> None:
+        """前 offset 个字符已保存到数据库，缓冲超出 ring_size 的部分可以移出"""
+        self.persisted = max(self.persisted, offset)
+        self._trim()
+
+    def finish(self, error: BaseException = None) -> None:
+        self.done = True
+        self.error = error
+        self._wake()
+
+    async def subscribe(self,
+                        after: int = 0,
+                        flush_interval: float = 0.0,
+                        max_chars: int = 0) -> AsyncIterator[Tuple[int, str]]:
+        """
+        产出 (事件id, 文本)，after 为客户端已收到的字符偏移(Last-Event-ID)，从该位置之后开始回放。
+
+        相邻token合并为一帧发出，减少SSE帧数和写socket次数：第一帧立即发出(不影响首字延迟)，
+        之后缓冲的文本达到 max_chars 个字符，或最早缓冲的token已等待 flush_interval 秒时发出；
+        flush_interval 为 0 时有新token就发出
+
+        Raises:
+            StreamGap: after 早于缓冲，或订阅者读取过慢、未读的token已移出缓冲(先发出已合并的文本)
+        """
+        if after < self.ring_start:
+            raise StreamGap(after)
+        self.subscribers += 1
+        self.idle_from = None
+        loop = asyncio.get_running_loop()
+        try:
+            seq = self.evicted + next((i for i, (end, _) in enumerate(self.ring) if end > after), len(self.ring))
+            parts: List[str] = []
+            size, end, tokens = 0, after, 0
+            first = True
+            deadline = None
+            while True:
+                event = self._event
+                if seq < self.evicted:
+                    if parts:
+                        yield end, "".join(parts)
+                    raise StreamGap(end)
+                while seq < self.token_count:
+                    end, token = self.ring[seq - self.evicted]
+                    seq += 1
+                    start = end - len(token)
+                    # 断点落在token中间时只补发剩余部分
+                    if start < after:
+                        token = token[after - start:]
+                    parts.append(token)
+                    size += len(token)
+                    tokens += 1
+
+                if parts:
+                    now = loop.time()
+                    if deadline is None:
+                        deadline = now + flush_interval
+                    if first or self.done or now >= deadline or (max_chars and size >= max_chars):
+                        metrics.inc("chat_sse_frames")
+                        metrics.inc("chat_sse_tokens", tokens)
+                        yield end, "".join(parts)
+                        parts, size, tokens = [], 0, 0
+                        first, deadline = False, None
+                        continue
+                    try:
+                        await asyncio.wait_for(event.wait(), deadline - now)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                if self.done:
+                    return
+                await event.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self.idle_from = self.token_count
+                if self.on_idle is not None:
+                    self.on_idle(self)
+
+    async def follow(self,
+                     after: int,
+                     load_persisted: Callable[[], Awaitable[Optional[str]]],
+                     flush_interval: float = 0.0,
+                     max_chars: int = 0) -> AsyncIterator[Tuple[int, str]]:
+        """
+        同 subscribe，读取位置已移出缓冲时调用 load_persisted 读取数据库中保存的部分回答补齐，再继续跟随
+        """
+        while True:
+            try:
+                async for event_id, text in self.subscribe(after, flush_interval, max_chars):
+                    after = event_id
+                    yield event_id, text
+                return
+            except StreamGap as gap:
+                after = gap.offset
+                persisted = await load_persisted() or ""
+                # 只有已保存的token才会移出缓冲，数据库中的回答一定覆盖到缓冲开头
+                if len(persisted) <= after:
+                    raise
+                metrics.inc("chat_stream_gap_refills")
+                yield len(persisted), persisted[after:]
+                after = len(persisted)
+
+    @property
+    def wasted_tokens(self) -> int:
+        """没有订阅者期间生成的token数"""
+        return self.token_count - self.idle_from if self.idle_from is not None else 0
+
+
+class ChatBroadcaster:
+    """
+    进行中生成的去重：按 (会话ID, 问题哈希) 登记生成任务，相同请求订阅已有的token流而不是再调用一次LLM。
+    生成结束后保留 linger 秒，期间的重复请求(如前端重试)直接回放完整回答。
+
+    所有订阅者都断开且 cancel_grace 秒内没有重连(断点续传)时取消生成任务，不再为没人接收的回答消耗LLM
+    """
+    def __init__(self,
+                 linger: float = 30,
+                 cancel_on_disconnect: bool = True,
+                 cancel_grace: float = 5,
+                 ring_size: int = 1024):
+        self.linger = linger
+        self.ring_size = ring_size
+        self.cancel_on_disconnect = cancel_on_disconnect
+        self.cancel_grace = cancel_grace
+        self._streams: Dict[StreamKey, GenerationStream] = {}
+        self._by_message: Dict[str, GenerationStream] = {}
+
+    @staticmethod
+    def make_key(conversation_id: Optional[str], message: str) -> StreamKey:
+        return conversation_id or "", hashlib.sha1(message.strip().encode('utf-8')).hexdigest()
+
+    def get(self, conversation_id: Optional[str], message: str) -> Optional[GenerationStream]:
+        return self._streams.get(self.make_key(conversation_id, message))
+
+    def get_or_start(self,
+                     conversation_id: Optional[str],
+                     message: str,
+                     producer: Callable[[GenerationStream], Awaitable[None]]) -> Tuple[GenerationStream, bool]:
+        """
+        返回 (token流, 是否新启动了生成)。producer 负责调用LLM并把token发布到流中，
+        在独立的任务中运行，不随某个连接的断开而取消
+        """
+        key = self.make_key(conversation_id, message)
+        stream = self._streams.get(key)
+        if stream is not None:
+            metrics.inc("chat_stream_dedup_hits")
+            return stream, False
+
+        stream = GenerationStream(key, ring_size=self.ring_size)
+        if self.cancel_on_disconnect:
+            stream.on_idle = self._schedule_cancel
+        self._streams[key] = stream
+        self._by_message[stream.message_id] = stream
+        stream.task = asyncio.create_task(self._run(stream, producer))
+        metrics.inc("chat_generations_started")
+        return stream, True
+
+    async def _run(self, stream: GenerationStream, producer: Callable[[GenerationStream], Awaitable[None]]) -> None:
+        try:
+            await producer(stream)
+        except asyncio.CancelledError:
+            stream.cancelled = True
+            stream.finish()
+            metrics.inc("chat_generations_cancelled")
+            metrics.inc("chat_cancelled_tokens", stream.token_count)
+            logger.info(f"连接全部断开，已取消生成: message_id={stream.message_id}, 已生成 {stream.token_count} 个token")
+        except Exception as e:
+            logger.exception(f"生成失败: {stream.key}")
+            stream.finish(e)
+        else:
+            stream.finish()
+        finally:
+            metrics.inc("chat_wasted_tokens", stream.wasted_tokens)
+            # 生成失败或被取消的流立即移除，重试时重新生成
+            if self.linger > 0 and stream.error is None and not stream.cancelled:
+                asyncio.get_running_loop().call_later(self.linger, self._release, stream)
+            else:
+                self._release(stream)
+
+    def _schedule_cancel(self, stream: GenerationStream) -> None:
+        asyncio.get_running_loop().call_later(self.cancel_grace, self._cancel_if_idle, stream)
+
+    def _cancel_if_idle(self, stream: GenerationStream) -> None:
+        if stream.subscribers == 0 and not stream.done and stream.task is not None:
+            stream.task.cancel()
+
+    def get_by_message(self, message_id: str) -> Optional[GenerationStream]:
+        """断线重连时按消息ID找回进行中(或刚结束)的生成"""
+        return self._by_message.get(message_id)
+
+    def _release(self, stream: GenerationStream) -> None:
+        if self._streams.get(stream.key) is stream:
+            del self._streams[stream.key]
+        self._by_message.pop(stream.message_id, None)
+
+    def stats(self) -> Dict:
+        streams = list(self._streams.values())
+        return {
+            "in_flight": sum(1 for s in streams if not s.done),
+            "lingering": sum(1 for s in streams if s.done),
+            "subscribers": sum(s.subscribers for s in streams),
+        }
+
+
+chat_broadcaster = ChatBroadcaster(linger=stream_cfg.get('dedup_linger', 30),
+                                   cancel_on_disconnect=stream_cfg.get('cancel_on_disconnect', True),
+                                   cancel_grace=stream_cfg.get('cancel_grace', 5),
+                                   ring_size=stream_cfg.get('ring_tokens', 1024))
+metrics.register_collector("chat_streams", chat_broadcaster.stats)
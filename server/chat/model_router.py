@@ -0,0 +1,316 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.prompt_values import PromptValue
+
+from server.chat.broadcaster import chat_cfg
+from server.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+llm_cfg = chat_cfg.get('llm', {})
+
+DEFAULT_BACKENDS = {
+    "deepseek": {"provider": "deepseek", "model": "deepseek-chat"},
+}
+
+
+class LLMUnavailable(Exception):
+    """所有候选后端都失败或超时"""
+
+
+def create_chat_model(provider: str, model: str, base_url: str = None, **kwargs) -> BaseChatModel:
+    if provider == "deepseek":
+        from langchain_deepseek import ChatDeepSeek
+
+        if base_url:
+            kwargs["api_base"] = base_url
+        return ChatDeepSeek(model=model, streaming=True, **kwargs)
+    if provider == "ollama":
+        from langchain_ollama import ChatOllama
+
+        if base_url:
+            kwargs["base_url"] = base_url
+        return ChatOllama(model=model, **kwargs)
+    raise ValueError(f"不支持的模型后端: {provider}")
+
+
+class Backend:
+    """
+    一个模型后端及其实时状态：首字延迟的指数滑动平均、连续失败次数。
+    连续失败 max_failures 次后熔断 cooldown 秒，期间不参与路由(所有后端都熔断时仍会尝试)
+    """
+    def __init__(self,
+                 name: str,
+                 provider: str,
+                 model: str,
+                 base_url: str = None,
+                 max_prompt_chars: int = 0,
+                 max_failures: int = 3,
+                 cooldown: float = 30,
+                 **model_kwargs):
+        self.name = name
+        self.provider = provider
+        self.model_name = model
+        self.base_url = base_url
+        # 提示词超过该字符数不路由到此后端(本地小模型上下文有限)，0 为不限
+        self.max_prompt_chars = max_prompt_chars
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.model_kwargs = model_kwargs
+        self._model: Optional[BaseChatModel] = None
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.down_until = 0.0
+        self.in_flight = 0
+
+    @property
+    def model(self) -> BaseChatModel:
+        # 首次使用时创建，缺少某个后端的API Key不影响服务启动和其他后端
+        if self._model is None:
+            self._model = create_chat_model(self.provider, self.model_name, self.base_url, **self.model_kwargs)
+        return self._model
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def fits(self, prompt_chars: int) -> bool:
+        return not self.max_prompt_chars or prompt_chars <= self.max_prompt_chars
+
+    def record_first_token(self, seconds: float) -> None:
+        self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+        self.failures = 0
+        metrics.observe(f"llm_first_token_ms.{self.name}", seconds * 1000)
+
+    def record_error(self, reason: str) -> None:
+        self.failures += 1
+        metrics.inc(f"llm_errors.{self.name}")
+        metrics.inc(f"llm_errors_{reason}.{self.name}")
+        if self.failures >= self.max_failures:
+            self.down_until = time.monotonic() + self.cooldown
+            logger.warning(f"模型后端 {self.name} 连续失败 {self.failures} 次，熔断 {self.cooldown} 秒")
+
+    def stats(self) -> Dict:
+        return {
+            "model": self.model_name,
+            "healthy": self.healthy,
+            "first_token_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "consecutive_failures": self.failures,
+            "in_flight": self.in_flight,
+        }
+
+
+class _Attempt:
+    """对一个后端的一次流式调用，task 等待第一个非空token"""
+    def __init__(self, backend: Backend, prompt: PromptValue):
+        self.backend = backend
+        self.started = time.monotonic()
+        self.iterator = backend.model.astream(prompt)
+        self.task = asyncio.ensure_future(self._first_token())
+        backend.in_flight += 1
+        metrics.inc(f"llm_requests.{backend.name}")
+
+    async def _first_token(self) -> Optional[str]:
+        async for chunk in self.iterator:
+            if chunk.content:
+                return chunk.content
+        return None
+
+    async def close(self) -> None:
+        if not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except (asyncio.CancelledError, Exception):
+                pass
+        try:
+            await self.iterator.aclose()
+        except Exception:
+            pass
+
+    def release(self) -> None:
+        self.backend.in_flight -= 1
+
+
+class ModelRouter:
+    """
+    按请求选择模型后端：先按 chat_type 取候选顺序，去掉放不下提示词的和已熔断的后端，
+    首选后端的首字延迟超过次选 latency_switch_ratio 倍时交换顺序。
+
+    首选后端 hedge_after 秒内没有返回首个token时，同时向下一个后端发起请求(对冲)，取先出字的一方并取消另一方；
+    hedge 为 false 时改为等满 first_token_timeout 秒再切换(回退)。后端在出字前报错立即切换到下一个；
+    已经开始输出后出错不再切换，避免回答内容重复
+    """
+    def __init__(self,
+                 backends: Dict[str, Backend],
+                 routes: Dict[str, List[str]] = None,
+                 default_route: List[str] = None,
+                 hedge: bool = True,
+                 hedge_after: float = 2.0,
+                 first_token_timeout: float = 15,
+                 latency_switch_ratio: float = 2.0):
+        self.backends = backends
+        self.routes = routes or {}
+        self.default_route = default_route or list(backends)
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.first_token_timeout = first_token_timeout
+        self.latency_switch_ratio = latency_switch_ratio
+
+    def choose(self, chat_type: str = None, prompt_chars: int = 0) -> List[Backend]:
+        """返回按优先顺序排列的候选后端"""
+        names = self.routes.get(chat_type) or self.default_route
+        candidates = [self.backends[n] for n in names if n in self.backends]
+        fitting = [b for b in candidates if b.fits(prompt_chars)]
+        candidates = fitting or candidates
+        # 熔断中的后端排到最后，全部熔断时仍按原顺序尝试
+        candidates.sort(key=lambda b: not b.healthy)
+        if len(candidates) > 1:
+            first, second = candidates[0], candidates[1]
+            if (second.healthy and first.latency is not None and second.latency is not None
+                    and first.latency > second.latency * self.latency_switch_ratio):
+                candidates[0], candidates[1] = second, first
+                metrics.inc("llm_latency_reroutes")
+        return candidates
+
+    async def astream(self,
+                      prompt: PromptValue,
+                      chat_type: str = None,
+                      meta: Dict = None,
+                      hedge: bool = None) -> AsyncIterator[str]:
+        """
+        流式产出回答文本。meta 不为空时写入实际使用的后端(backend)、尝试过的后端(attempted)和是否对冲(hedged)；
+        hedge 为空时按配置，批量任务传 False 只回退不对冲，避免成倍占用后端
+        """
+        hedge = self.hedge if hedge is None else hedge
+        prompt_chars = len(prompt.to_string())
+        candidates = self.choose(chat_type, prompt_chars)
+        if not candidates:
+            raise LLMUnavailable("没有可用的模型后端")
+        meta = meta if meta is not None else {}
+        meta.update(backend=None, attempted=[], hedged=False)
+
+        pending: Dict[asyncio.Future, _Attempt] = {}
+        winner: Optional[_Attempt] = None
+        first_token = None
+        next_index = 0
+        switch_at = 0.0
+        try:
+            while winner is None:
+                now = time.monotonic()
+                # 没有进行中的请求，或到了对冲/回退时间，向下一个后端发起请求
+                if next_index < len(candidates) and (not pending or now >= switch_at):
+                    if pending:
+                        if hedge:
+                            meta["hedged"] = True
+                            metrics.inc("llm_hedges")
+                        else:
+                            for attempt in list(pending.values()):
+                                attempt.backend.record_error("timeout")
+                                await self._drop(pending, attempt)
+                            metrics.inc("llm_fallbacks")
+                    elif next_index:
+                        metrics.inc("llm_fallbacks")
+                    backend = candidates[next_index]
+                    meta["attempted"].append(backend.name)
+                    next_index += 1
+                    try:
+                        attempt = _Attempt(backend, prompt)
+                    except Exception as e:
+                        # 客户端创建失败(如缺少API Key)，与请求报错一样立即切换到下一个后端
+                        logger.warning(f"模型后端 {backend.name} 创建失败: {e!r}")
+                        backend.record_error("error")
+                        switch_at = now
+                        continue
+                    pending[attempt.task] = attempt
+                    switch_at = now + (self.hedge_after if hedge else self.first_token_timeout)
+                    continue
+                if not pending:
+                    raise LLMUnavailable(f"模型后端均不可用: {meta['attempted']}")
+
+                # 等到最早的超时点：对冲/回退时间，或进行中请求的首字超时
+                deadline = min(a.started + self.first_token_timeout for a in pending.values())
+                if next_index < len(candidates):
+                    deadline = min(deadline, switch_at)
+                done, _ = await asyncio.wait(list(pending), timeout=max(deadline - now, 0),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    attempt = pending[task]
+                    if task.exception() is not None:
+                        logger.warning(f"模型后端 {attempt.backend.name} 调用失败: {task.exception()!r}")
+                        attempt.backend.record_error("error")
+                        await self._drop(pending, attempt)
+                    elif winner is None:
+                        winner, first_token = attempt, task.result()
+                        del pending[task]
+                if winner is None:
+                    now = time.monotonic()
+                    for attempt in [a for a in pending.values() if now - a.started >= self.first_token_timeout]:
+                        logger.warning(f"模型后端 {attempt.backend.name} 首字超时")
+                        attempt.backend.record_error("timeout")
+                        await self._drop(pending, attempt)
+                    # 当前请求都已失败，不必等到切换时间
+                    if not pending:
+                        switch_at = now
+
+            # 其余进行中的请求直接取消，不计为失败
+            for attempt in list(pending.values()):
+                metrics.inc(f"llm_hedge_losses.{attempt.backend.name}")
+                await self._drop(pending, attempt)
+
+            backend = winner.backend
+            meta["backend"] = backend.name
+            backend.record_first_token(time.monotonic() - winner.started)
+            if first_token is None:
+                # 后端正常结束但没有输出任何内容
+                return
+            yield first_token
+            try:
+                async for chunk in winner.iterator:
+                    if chunk.content:
+                        yield chunk.content
+            except Exception:
+                backend.record_error("stream")
+                raise
+            metrics.observe(f"llm_total_ms.{backend.name}", (time.monotonic() - winner.started) * 1000)
+        finally:
+            for attempt in list(pending.values()):
+                await self._drop(pending, attempt)
+            if winner is not None:
+                await winner.close()
+                winner.release()
+
+    @staticmethod
+    async def _drop(pending: Dict[asyncio.Future, _Attempt], attempt: _Attempt) -> None:
+        pending.pop(attempt.task, None)
+        await attempt.close()
+        attempt.release()
+
+    def stats(self) -> Dict:
+        return {name: backend.stats() for name, backend in self.backends.items()}
+
+
+def _create_model_router() -> ModelRouter:
+    max_failures = llm_cfg.get('max_failures', 3)
+    cooldown = llm_cfg.get('cooldown', 30)
+    backends = {}
+    for name, conf in (llm_cfg.get('backends') or DEFAULT_BACKENDS).items():
+        conf = dict(conf)
+        conf.setdefault('max_failures', max_failures)
+        conf.setdefault('cooldown', cooldown)
+        backends[name] = Backend(name, **conf)
+    return ModelRouter(backends,
+                       routes=llm_cfg.get('routes'),
+                       default_route=llm_cfg.get('default_route'),
+                       hedge=llm_cfg.get('hedge', True),
+                       hedge_after=llm_cfg.get('hedge_after', 2.0),
+                       first_token_timeout=llm_cfg.get('first_token_timeout', 15),
+                       latency_switch_ratio=llm_cfg.get('latency_switch_ratio', 2.0))
+
+
+model_router = _create_model_router()
+metrics.register_collector("llm_backends", model_router.stats)
@@ -0,0 +1,162 @@
+import re
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+# MinHash 使用的梅森素数及哈希上界，与 datasketch 的实现一致
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+_WS_RE = re.compile(r'\s+')
+
+
+def shingles(text: str, k: int = 5) -> set:
+    """
+    字符级 k-shingle。中文没有天然的词边界，按字符切片即可
+    """
+    text = _WS_RE.sub(' ', text).strip()
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+class MinHasher:
+    """
+    MinHash 签名生成器，num_perm 个随机线性哈希 (a*x+b) mod p 模拟置换
+    """
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        gen = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = gen.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = gen.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, tokens: set) -> np.ndarray:
+        if not tokens:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        hv = np.fromiter((zlib.crc32(t.encode('utf-8')) for t in tokens), dtype=np.uint64, count=len(tokens))
+        # [len(tokens), num_perm] 一次性计算所有置换
+        phv = (np.outer(hv, self.a) + self.b) % _MERSENNE_PRIME & _MAX_HASH
+        return phv.min(axis=0)
+
+
+class MinHashLSH:
+    """
+    LSH 分桶：签名切成 bands 段，每段哈希到一个桶，同桶即为候选近似重复
+    """
+    def __init__(self, num_perm: int = 128, bands: int = 32):
+        if num_perm % bands != 0:
+            raise ValueError(f"num_perm({num_perm}) 必须能被 bands({bands}) 整除")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+
+    def _band_keys(self, sig: np.ndarray):
+        for i in range(self.bands):
+            yield i, sig[i * self.rows:(i + 1) * self.rows].tobytes()
+
+    def query(self, sig: np.ndarray) -> set:
+        candidates = set()
+        for i, key in self._band_keys(sig):
+            candidates.update(self.buckets[i].get(key, ()))
+        return candidates
+
+    def insert(self, key: int, sig: np.ndarray) -> None:
+        for i, band_key in self._band_keys(sig):
+            self.buckets[i].setdefault(band_key, []).append(key)
+
+
+@dataclass
+class DedupStats:
+    total: int = 0
+    kept: int = 0
+    dropped: int = 0
+
+    @property
+    def ratio(self) -> float:
+        """去重率: 被丢弃切片占全部切片的比例"""
+        return self.dropped / self.total if self.total else 0.0
+
+    def to_dict(self) -> dict:
+        return {"total": self.total, "kept": self.kept, "dropped": self.dropped, "ratio": round(self.ratio, 4)}
+
+
+@dataclass
+class DedupResult:
+    docs: List[Document]
+    stats: DedupStats
+    # 保留切片下标 -> 被它替代的切片来源信息
+    provenance: Dict[int, List[dict]] = field(default_factory=dict)
+
+
+class ChunkDeduplicator:
+    """
+    切片级近似去重，在向量化之前执行，减少嵌入调用次数和索引体积。
+
+    被丢弃的切片不会丢失来源信息，会挂在与其重复的保留切片的 metadata["duplicates"] 中，
+    入库时随 FileDocModel.meta_data 一起保存。
+    """
+    def __init__(self,
+                 num_perm: int = 128,
+                 bands: int = 32,
+                 shingle_size: int = 5,
+                 threshold: float = 0.85,
+                 seed: int = 1):
+        self.hasher = MinHasher(num_perm=num_perm, seed=seed)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+
+    def _similarity(self, sig1: np.ndarray, sig2: np.ndarray) -> float:
+        """签名中相同位置取值相等的比例即为 Jaccard 相似度的估计"""
+        return float(np.count_nonzero(sig1 == sig2)) / self.num_perm
+
+    def find_duplicates(self, texts: List[str]) -> List[Tuple[int, int, float]]:
+        """
+        返回 (被丢弃下标, 保留下标, 相似度) 列表，先出现的切片优先保留
+        """
+        lsh = MinHashLSH(num_perm=self.num_perm, bands=self.bands)
+        signatures = []
+        duplicates = []
+        for idx, text in enumerate(texts):
+            sig = self.hasher.signature(shingles(text, self.shingle_size))
+            signatures.append(sig)
+            best, best_sim = None, 0.0
+            for cand in lsh.query(sig):
+                sim = self._similarity(sig, signatures[cand])
+                if sim >= self.threshold and sim > best_sim:
+                    best, best_sim = cand, sim
+            if best is not None:
+                duplicates.append((idx, best, best_sim))
+                continue
+            # 只有保留的切片进入 LSH 桶，被丢弃的切片不再作为候选
+            lsh.insert(idx, sig)
+        return duplicates
+
+    def deduplicate(self, docs: List[Document]) -> DedupResult:
+        duplicates = self.find_duplicates([d.page_content for d in docs])
+        dropped = {idx for idx, _, _ in duplicates}
+
+        provenance: Dict[int, List[dict]] = {}
+        for idx, kept_idx, sim in duplicates:
+            doc = docs[idx]
+            provenance.setdefault(kept_idx, []).append({
+                "source": doc.metadata.get("source"),
+                "start_index": doc.metadata.get("start_index"),
+                "similarity": round(sim, 4),
+                "length": len(doc.page_content),
+            })
+
+        kept_docs = []
+        for idx, doc in enumerate(docs):
+            if idx in dropped:
+                continue
+            if idx in provenance:
+                doc.metadata["duplicates"] = provenance[idx]
+            kept_docs.append(doc)
+
+        stats = DedupStats(total=len(docs), kept=len(kept_docs), dropped=len(dropped))
+        return DedupResult(docs=kept_docs, stats=stats, provenance=provenance)
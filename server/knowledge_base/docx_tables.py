@@ -0,0 +1,333 @@
+import json
+import os
+import xml.etree.ElementTree as ET
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Union
+
+from langchain.schema import Document
+
+from server.knowledge_base.metadata_filter import FilterValue
+from server.knowledge_base.text_splitter import StreamingTextSplitter
+from server.knowledge_base.utils import get_kb_path, kb_cfg, validate_kb_name
+
+table_cfg = kb_cfg.get('table', {})
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+W_BODY, W_P, W_T, W_TAB, W_BR, W_CR = f"{_W}body", f"{_W}p", f"{_W}t", f"{_W}tab", f"{_W}br", f"{_W}cr"
+W_TBL, W_TR, W_TC, W_TR_PR, W_TC_PR = f"{_W}tbl", f"{_W}tr", f"{_W}tc", f"{_W}trPr", f"{_W}tcPr"
+W_GRID_SPAN, W_VMERGE, W_TBL_HEADER, W_VAL = f"{_W}gridSpan", f"{_W}vMerge", f"{_W}tblHeader", f"{_W}val"
+
+# 表格行切片的 metadata["block"] 取值，正文切片为 "text"
+TABLE_ROW_BLOCK = "table_row"
+TEXT_BLOCK = "text"
+# 表格前的段落作为表格标题时截断的长度
+MAX_TITLE_CHARS = 100
+
+
+class TableRow(NamedTuple):
+    table_index: int
+    row_index: int
+    # 按网格列展开后的单元格文本，横向合并的单元格在每一列重复，纵向合并的单元格沿用上一行的值
+    cells: List[str]
+    # 行属性中标记了 "标题行重复"(w:tblHeader)
+    is_header: bool
+
+
+def iter_docx_blocks(file_path: str) -> Iterator[Union[str, TableRow]]:
+    """
+    流式解析 docx 的 word/document.xml，按文档顺序产出表格外的段落文本(str)和顶层表格的行(TableRow)。
+
+    不构建整个文档对象：每个表格行、每个正文段落处理完后即从树中移除，内存占用与单行大小相关，
+    与表格行数无关。嵌套表格的文本并入外层单元格。
+    """
+    with zipfile.ZipFile(file_path) as zf, zf.open('word/document.xml') as f:
+        body = None
+        table = None
+        depth = 0
+        tbl_depth = 0
+        table_index = -1
+        row_index = 0
+        runs: List[str] = []
+        cell_paragraphs: List[str] = []
+        cells: List[str] = []
+        prev_cells: List[str] = []
+
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            tag = elem.tag
+            if event == 'start':
+                depth += 1
+                if tag == W_BODY:
+                    body = elem
+                elif tag == W_TBL:
+                    tbl_depth += 1
+                    if tbl_depth == 1:
+                        table = elem
+                        table_index += 1
+                        row_index = 0
+                        prev_cells = []
+                continue
+
+            if tag == W_T:
+                if elem.text:
+                    runs.append(elem.text)
+            elif tag == W_TAB:
+                runs.append('\t')
+            elif tag in (W_BR, W_CR):
+                runs.append('\n')
+            elif tag == W_P:
+                text = ''.join(runs).strip()
+                runs = []
+                if text:
+                    if tbl_depth:
+                        cell_paragraphs.append(text)
+                    else:
+                        yield text
+            elif tag == W_TC and tbl_depth == 1:
+                span, merged = 1, False
+                tc_pr = elem.find(W_TC_PR)
+                if tc_pr is not None:
+                    grid_span = tc_pr.find(W_GRID_SPAN)
+                    if grid_span is not None:
+                        span = max(int(grid_span.get(W_VAL, 1)), 1)
+                    v_merge = tc_pr.find(W_VMERGE)
+                    # vMerge 不带 val 或 val="continue" 表示与上方单元格合并
+                    merged = v_merge is not None and v_merge.get(W_VAL, 'continue') != 'restart'
+                text = '\n'.join(cell_paragraphs)
+                cell_paragraphs = []
+                col = len(cells)
+                for k in range(span):
+                    cells.append(prev_cells[col + k] if merged and col + k < len(prev_cells) else text)
+            elif tag == W_TR and tbl_depth == 1:
+                tr_pr = elem.find(W_TR_PR)
+                is_header = tr_pr is not None and tr_pr.find(W_TBL_HEADER) is not None
+                yield TableRow(table_index, row_index, cells, is_header)
+                prev_cells, cells = cells, []
+                row_index += 1
+                elem.clear()
+                try:
+                    table.remove(elem)
+                except ValueError:
+                    # 行包在 sdt 等容器中，随顶层元素一起释放
+                    pass
+            elif tag == W_TBL:
+                tbl_depth -= 1
+
+            depth -= 1
+            # document(1) > body(2) > 段落/表格(3)，顶层元素处理完后移出 body
+            if depth == 2 and body is not None:
+                elem.clear()
+                body.remove(elem)
+
+
+def _merge_headers(headers: List[str], cells: List[str]) -> List[str]:
+    """多行表头按列合并为 "上级/下级"，横向合并产生的重复值只保留一次"""
+    merged = list(headers) + [''] * (len(cells) - len(headers))
+    for j, cell in enumerate(cells):
+        cell = ' '.join(cell.split())
+        if cell and cell != merged[j] and not merged[j].endswith(f"/{cell}"):
+            merged[j] = f"{merged[j]}/{cell}" if merged[j] else cell
+    return merged
+
+
+def row_columns(headers: List[str], cells: List[str]) -> Dict[str, str]:
+    """表头 -> 单元格文本，表头为空的列命名为 "列N"，同名列追加列号区分"""
+    columns = {}
+    for j, cell in enumerate(cells):
+        value = ' '.join(cell.split())
+        name = headers[j] if j < len(headers) and headers[j] else f"列{j + 1}"
+        if name in columns:
+            if columns[name] == value:
+                # 横向合并单元格展开后的重复列
+                continue
+            name = f"{name}_{j + 1}"
+        columns[name] = value
+    return columns
+
+
+def _text_document(paragraphs: List[str], file_path: str) -> Document:
+    return Document(page_content="\n\n".join(paragraphs), metadata={"source": file_path, "block": TEXT_BLOCK})
+
+
+def iter_docx_table_docs(file_path: str,
+                         header_rows: int = table_cfg.get('header_rows', 1),
+                         text_block_chars: int = table_cfg.get('text_block_chars', 20000)) -> Iterator[Document]:
+    """
+    按文档顺序产出 Document：
+    - 表格外的连续段落合并为一个正文块，metadata["block"] 为 "text"，超过 text_block_chars 时提前输出
+    - 表格每个数据行一个 Document，metadata["block"] 为 "table_row"，正文为逐列的 "表头: 单元格"，
+      表格前最近的段落作为表格标题，表头与单元格的对应关系写入 metadata["columns"]
+
+    Args:
+        header_rows: 每个表格开头作为表头的行数；标记了 "标题行重复" 的开头行同样作为表头
+    """
+    paragraphs: List[str] = []
+    size = 0
+    caption = ""
+    current_table = -1
+    title = ""
+    headers: List[str] = []
+    in_header = True
+
+    for block in iter_docx_blocks(file_path):
+        if isinstance(block, str):
+            paragraphs.append(block)
+            size += len(block)
+            caption = block
+            if size >= text_block_chars:
+                yield _text_document(paragraphs, file_path)
+                paragraphs, size = [], 0
+            continue
+
+        if block.table_index != current_table:
+            current_table = block.table_index
+            title, caption = caption[:MAX_TITLE_CHARS], ""
+            headers, in_header = [], True
+            if paragraphs:
+                yield _text_document(paragraphs, file_path)
+                paragraphs, size = [], 0
+
+        if not any(cell.strip() for cell in block.cells):
+            continue
+        if in_header and (block.is_header or block.row_index < header_rows):
+            headers = _merge_headers(headers, block.cells)
+            continue
+        in_header = False
+
+        columns = row_columns(headers, block.cells)
+        lines = [f"{name}: {value}" for name, value in columns.items() if value]
+        yield Document(page_content="\n".join(lines), metadata={
+            "source": file_path,
+            "block": TABLE_ROW_BLOCK,
+            "table_index": block.table_index,
+            "row_index": block.row_index,
+            "table_title": title,
+            "columns": columns,
+        })
+
+    if paragraphs:
+        yield _text_document(paragraphs, file_path)
+
+
+def split_row_document(doc: Document, text_splitter: StreamingTextSplitter) -> List[Document]:
+    """
+    表格行一般作为一个切片；单元格内容过长时按切分器继续切分，每个切片都带上表格标题，保留表格上下文
+    """
+    title = doc.metadata.get("table_title")
+    prefix = f"表格: {title}\n" if title else ""
+    docs = []
+    for chunk in text_splitter.iter_chunks(doc.page_content):
+        metadata = dict(doc.metadata)
+        metadata["start_index"] = chunk.start
+        docs.append(Document(page_content=prefix + chunk.text, metadata=metadata))
+    return docs
+
+
+def get_table_rows_path(kb_name: str, file_name: Optional[str] = None) -> Path:
+    """表格行的结构化记录存放目录，每个文件一个 jsonl。file_name 只能是文件名，不能带目录"""
+    path = get_kb_path(validate_kb_name(kb_name)) / 'tables'
+    if not file_name:
+        return path
+    if Path(file_name).name != file_name or file_name in ('.', '..'):
+        raise ValueError(f"文件名不合法: {file_name!r}")
+    return path / f"{file_name}.jsonl"
+
+
+class TableRowWriter:
+    """
+    入库时把表格行的结构化记录(含对应切片id)逐批写入 jsonl，供按列查询；
+    先写临时文件，全部写完后替换旧记录，入库失败时保留旧记录
+    """
+    def __init__(self, kb_name: str, file_name: str):
+        self.path = get_table_rows_path(kb_name, file_name)
+        self.tmp_path = self.path.with_name(self.path.name + '.tmp')
+        self.rows = 0
+        self._file = None
+        self._last_key = None
+
+    def __enter__(self) -> "TableRowWriter":
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.tmp_path, 'w', encoding='utf-8')
+        return self
+
+    def write(self, doc_infos: List[dict]) -> None:
+        """doc_infos 为 embed_and_store 的返回值，同一行切分出的多个切片合并为一条记录"""
+        record = None
+        for info in doc_infos:
+            metadata = info["metadata"]
+            if metadata.get("block") != TABLE_ROW_BLOCK:
+                continue
+            key = (metadata["table_index"], metadata["row_index"])
+            if key == self._last_key and record is not None:
+                record["ids"].append(info["id"])
+                continue
+            if record is not None:
+                self._dump(record)
+            self._last_key = key
+            record = {
+                "table_index": metadata["table_index"],
+                "row_index": metadata["row_index"],
+                "table_title": metadata.get("table_title", ""),
+                "columns": metadata["columns"],
+                "ids": [info["id"]],
+            }
+        if record is not None:
+            self._dump(record)
+
+    def _dump(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.rows += 1
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+
+
+def _match(cell: Optional[str], expected: FilterValue, contains: bool) -> bool:
+    if cell is None:
+        return False
+    values = expected if isinstance(expected, list) else [expected]
+    if contains:
+        return any(str(v) in cell for v in values)
+    return any(str(v) == cell for v in values)
+
+
+def lookup_table_rows(kb_name: str,
+                      filters: Dict[str, FilterValue],
+                      file_name: Optional[str] = None,
+                      table_index: Optional[int] = None,
+                      contains: bool = False,
+                      limit: int = 100) -> List[dict]:
+    """
+    按列取值查询表格行，逐行扫描 jsonl，不加载整个表格
+
+    Args:
+        filters: 列名 -> 取值，取值为列表时匹配任意一个，多个列之间为"且"
+        contains: True 时按子串匹配，否则要求单元格与取值完全相同
+    Returns:
+        [{"file_name", "table_index", "row_index", "table_title", "columns", "ids"}, ...]
+    """
+    if file_name:
+        paths = [get_table_rows_path(kb_name, file_name)]
+    else:
+        root = get_table_rows_path(kb_name)
+        paths = sorted(root.glob('*.jsonl')) if root.exists() else []
+
+    rows = []
+    for path in paths:
+        if not path.exists():
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if table_index is not None and record["table_index"] != table_index:
+                    continue
+                columns = record["columns"]
+                if all(_match(columns.get(column), value, contains) for column, value in filters.items()):
+                    rows.append({"file_name": path.name[:-len('.jsonl')], **record})
+                    if len(rows) >= limit:
+                        return rows
+    return rows
@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+import weakref
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from server.knowledge_base.index_versions import hot_reload_cfg, read_current_version
+from server.knowledge_base.quantization import QuantizedFAISS
+from server.knowledge_base.utils import (
+    cached_sharded_stores,
+    cached_vector_store_versions,
+    get_embeddings,
+    get_vs_type_path,
+    swap_cached_vector_store,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def warmup_vector_store(vector_store: FAISS) -> None:
+    """
+    切换前先做一次检索，让索引数据页和 faiss 内部结构就绪，避免切换后第一批查询变慢
+    """
+    index = vector_store.index
+    if index.ntotal == 0:
+        return
+    query = np.zeros((1, index.d), dtype=np.float32)
+    index.search(query, 1)
+
+
+class VectorStoreReloader:
+    """
+    后台轮询已加载知识库的版本指针，发现新版本后在后台加载、预热，再替换缓存中的引用。
+    替换后新的检索立即使用新版本，正在进行的检索持有旧对象直到结束，旧版本随最后一个引用释放。
+    原始和量化向量库按向量库目录的 CURRENT 切换，分片向量库按各分片目录的 CURRENT 逐个分片切换
+    """
+    def __init__(self, poll_interval: float = hot_reload_cfg.get('poll_interval', 5)):
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="vs_reloader", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.check_once()
+            except Exception as e:
+                logger.error(f"向量库热加载检查失败: {e}")
+
+    def check_once(self) -> None:
+        for (kb_name, embed_model, vs_type), loaded_version in cached_vector_store_versions().items():
+            latest = read_current_version(get_vs_type_path(kb_name, vs_type))
+            if latest and latest != loaded_version:
+                self.reload(kb_name, embed_model, latest, loaded_version, vs_type)
+        for store in cached_sharded_stores():
+            store.reload_changed_shards()
+
+    def reload(self, kb_name: str, embed_model: str, version: str, loaded_version: str = None,
+               vs_type: str = 'faiss') -> bool:
+        start = time.perf_counter()
+        vs_path = get_vs_type_path(kb_name, vs_type)
+        if vs_type == 'faiss':
+            vector_store = FAISS.load_local(vs_path / version, get_embeddings(embed_model),
+                                            distance_strategy="METRIC_INNER_PRODUCT",
+                                            allow_dangerous_deserialization=True)
+        else:
+            vector_store = QuantizedFAISS.load_quantized(vs_path, get_embeddings(embed_model), version=version)
+        warmup_vector_store(vector_store)
+        track_release(vector_store, kb_name, version)
+        if not swap_cached_vector_store(kb_name, embed_model, vector_store, version, loaded_version, vs_type):
+            return False
+        logger.info(f"知识库 {kb_name} 切换到 {vs_type} 向量库版本 {version}, "
+                    f"加载耗时 {(time.perf_counter() - start) * 1000:.0f}ms")
+        return True
+
+
+_reloader = VectorStoreReloader()
+_reloader_lock = threading.Lock()
+
+
+def start_reloader() -> VectorStoreReloader:
+    with _reloader_lock:
+        _reloader.start()
+    return _reloader
+
+
+def track_release(vector_store: FAISS, kb_name: str, version: str) -> None:
+    """旧版本被最后一个检索释放时记录日志"""
+    weakref.finalize(vector_store, logger.info, f"知识库 {kb_name} 向量库版本 {version} 已释放")
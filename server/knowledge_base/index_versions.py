@@ -0,0 +1,113 @@
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from configs.config import cfg
+
+logger = logging.getLogger(__name__)
+
+hot_reload_cfg = cfg.get('kb', {}).get('hot_reload', {})
+
+# 向量库目录下的版本指针文件，内容为当前版本目录名
+CURRENT_FILE = "CURRENT"
+VERSION_PREFIX = "v"
+# publish_version 不检查基础版本
+ANY_VERSION = object()
+
+# 旧布局直接保存在向量库目录下的文件，vectors.npy 为量化向量库的原始向量
+LEGACY_FILES = ('index.faiss', 'index.pkl', 'vectors.npy')
+
+
+class StaleVersionError(RuntimeError):
+    """写入所基于的版本已不是当前版本，说明有其他写入先发布了，直接发布会丢掉对方的数据"""
+
+
+def new_version() -> str:
+    """版本号按时间递增，目录名排序即为版本先后"""
+    return f"{VERSION_PREFIX}{time.time_ns()}"
+
+
+def read_current_version(vs_path) -> Optional[str]:
+    """读取当前版本，旧的未分版本目录返回 None"""
+    pointer = Path(vs_path) / CURRENT_FILE
+    try:
+        version = pointer.read_text(encoding='utf-8').strip()
+    except FileNotFoundError:
+        return None
+    return version or None
+
+
+def resolve_vs_dir(vs_path) -> Path:
+    """当前版本的索引目录，没有版本指针时兼容直接保存在 vs_path 下的旧布局"""
+    version = read_current_version(vs_path)
+    return Path(vs_path) / version if version else Path(vs_path)
+
+
+def list_versions(vs_path) -> List[str]:
+    if not os.path.isdir(vs_path):
+        return []
+    return sorted(name for name in os.listdir(vs_path)
+                  if name.startswith(VERSION_PREFIX) and not name.endswith('.tmp')
+                  and os.path.isdir(Path(vs_path) / name))
+
+
+def _write_pointer(vs_path: Path, version: str) -> None:
+    tmp_path = vs_path / f"{CURRENT_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    # os.replace 是原子操作，读取方要么看到旧版本要么看到新版本
+    os.replace(tmp_path, vs_path / CURRENT_FILE)
+
+
+def prune_versions(vs_path, keep: int = hot_reload_cfg.get('keep_versions', 3)) -> None:
+    """
+    删除多余的旧版本，保留最新的 keep 个。
+    其他进程可能仍在加载较旧的版本，因此不会只保留当前版本
+    """
+    vs_path = Path(vs_path)
+    current = read_current_version(vs_path)
+    versions = [v for v in list_versions(vs_path) if v != current]
+    for version in versions[:max(0, len(versions) - (keep - 1))]:
+        shutil.rmtree(vs_path / version, ignore_errors=True)
+    if current:
+        # 迁移到版本目录后，旧布局直接保存在 vs_path 下的索引文件不再使用
+        for name in LEGACY_FILES:
+            if os.path.exists(vs_path / name):
+                os.remove(vs_path / name)
+
+
+def publish_version(vs_path, write: Callable[[Path], None], base_version=ANY_VERSION) -> str:
+    """
+    调用 write(目录) 把新版本写入临时目录，改名为版本目录后再切换版本指针。
+    已发布的版本目录不会再被写入，正在读取(或 mmap)旧版本文件的进程不受影响
+
+    Args:
+        base_version: 写入所基于的版本(旧布局为 None)，切换指针前当前版本已不是它时放弃发布，
+            抛出 StaleVersionError；默认不检查
+    Returns:
+        str: 新版本号
+    """
+    vs_path = Path(vs_path)
+    os.makedirs(vs_path, exist_ok=True)
+    version = new_version()
+    tmp_dir = vs_path / f"{version}.tmp"
+    write(tmp_dir)
+    current = read_current_version(vs_path)
+    if base_version is not ANY_VERSION and current != base_version:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise StaleVersionError(f"向量库 {vs_path} 当前版本为 {current}，写入基于的版本 {base_version} 已过期")
+    os.replace(tmp_dir, vs_path / version)
+    _write_pointer(vs_path, version)
+    prune_versions(vs_path)
+    logger.info(f"向量库 {vs_path} 发布新版本 {version}")
+    return version
+
+
+def publish_vector_store(vector_store, vs_path, base_version=ANY_VERSION) -> str:
+    """保存为新版本目录后再切换版本指针，正在读取旧版本的进程不受影响"""
+    return publish_version(vs_path, vector_store.save_local, base_version)
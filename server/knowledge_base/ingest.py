@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import os
+import uuid
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, List
+
+from langchain.schema import Document
+
+from lianxi.doc_tree.tree_embedding import embed_batches, plan_batches
+from repository.knowledge_file_repository import list_docs_from_db, replace_file_in_db
+from server.knowledge_base.dedup import ChunkDeduplicator, DedupStats
+from server.knowledge_base.docx_tables import (
+    TABLE_ROW_BLOCK,
+    TableRowWriter,
+    iter_docx_table_docs,
+    split_row_document,
+    table_cfg,
+)
+from server.knowledge_base.text_splitter import SemanticTextSplitter, make_text_splitter
+from server.scheduler import Priority, scheduler
+from server.knowledge_base.utils import (
+    kb_cfg,
+    CHUNK_SIZE,
+    CHUNK_OVERLAP,
+    DEFAULT_EMBED_MODEL,
+    DEFAULT_VS_TYPE,
+    get_embeddings,
+    get_loader_class,
+    load_file_docs,
+)
+from server.knowledge_base.vs_writer import VectorStoreWriter
+
+logger = logging.getLogger(__name__)
+
+dedup_cfg = kb_cfg.get('dedup', {})
+
+# 按语义边界切分，记录在 KnowledgeFileModel.text_splitter_name 中
+SEMANTIC_SPLITTER = "SemanticChunker"
+# docx 表格按行抽取为结构化切片
+TABLE_SPLITTER = "DocxTable"
+
+
+def split_docs(docs: List[Document],
+               chunk_size: int = CHUNK_SIZE,
+               chunk_overlap: int = CHUNK_OVERLAP,
+               text_splitter_name: str = "RecursiveCharacterTextSplitter",
+               embed_model: str = DEFAULT_EMBED_MODEL) -> List[Document]:
+    if text_splitter_name == SEMANTIC_SPLITTER:
+        return SemanticTextSplitter(get_embeddings(embed_model), max_chunk_size=chunk_size).split_documents(docs)
+    text_splitter = make_text_splitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return text_splitter.split_documents(docs)
+
+
+def get_deduplicator() -> ChunkDeduplicator:
+    return ChunkDeduplicator(
+        num_perm=dedup_cfg.get('num_perm', 128),
+        bands=dedup_cfg.get('bands', 32),
+        shingle_size=dedup_cfg.get('shingle_size', 5),
+        threshold=dedup_cfg.get('threshold', 0.85),
+    )
+
+
+def embed_and_store(kb_name: str,
+                    docs: List[Document],
+                    embed_model: str = DEFAULT_EMBED_MODEL,
+                    vs_type: str = DEFAULT_VS_TYPE,
+                    writer: VectorStoreWriter = None) -> List[dict]:
+    """
+    向量化并写入知识库向量库，返回 [{"id": str, "metadata": dict}, ...]
+
+    Args:
+        writer: 分批写入时传入同一个 VectorStoreWriter，全部写完后统一发布；为空时单独写入并发布一次
+    """
+    if not docs:
+        return []
+    for d in docs:
+        # 与 FileDocModel 对应的字段写入metadata，检索时可按知识库/文件过滤
+        d.metadata.setdefault("kb_name", kb_name)
+        if d.metadata.get("source"):
+            d.metadata.setdefault("file_name", os.path.basename(d.metadata["source"]))
+    texts = [d.page_content for d in docs]
+    metadatas = [d.metadata for d in docs]
+    ids = [str(uuid.uuid4()) for _ in docs]
+
+    with VectorStoreWriter(kb_name, embed_model, vs_type) if writer is None else nullcontext(writer) as writer:
+        # 按长度装箱后并发向量化，每完成一个批次写入一次向量库副本
+        batches = plan_batches(texts)
+        # 每提交一个批次前检查：有检索请求在排队或执行时先让出，不再向嵌入模型发新批次
+        for batch, vectors in embed_batches(get_embeddings(embed_model), texts, batches,
+                                            before_submit=lambda: scheduler.checkpoint(Priority.BULK)):
+            writer.add(zip([texts[i] for i in batch], vectors.tolist()),
+                       [metadatas[i] for i in batch],
+                       [ids[i] for i in batch])
+    return [{"id": i, "metadata": m} for i, m in zip(ids, metadatas)]
+
+
+def load_tree_docs(file_path: str) -> List[Document]:
+    """
+    按章节树加载文档，每个有正文的节点对应一个Document，章节路径写入metadata。
+    解析结果走文档树缓存，同一文件再次入库时跳过 unstructured 解析
+    """
+    from lianxi.doc_tree.tree_cache import load_doc_tree
+
+    builder = load_doc_tree(file_path)
+    docs = []
+    for node in builder.store.nodes:
+        if not node.content.strip():
+            continue
+        doc = node.to_langchain_document()
+        doc.metadata.update({"source": file_path, "title_path": node.title_path, "node_id": node.node_id})
+        docs.append(doc)
+    return docs
+
+
+def _ingest_docx_tables_sync(kb_name: str, file_path: str, embed_model: str, dedup: bool,
+                             vs_writer: VectorStoreWriter):
+    """
+    表格密集的大 docx：流式抽取正文块和表格行，凑满一批切片就向量化写入 vs_writer，由调用方统一发布。
+    表格行不做近似去重(同一表格的行往往只有个别单元格不同)，结构化记录写入 tables/<文件名>.jsonl 供按列查询
+    """
+    text_splitter = make_text_splitter()
+    deduplicator = get_deduplicator() if dedup else None
+    stats = DedupStats() if dedup else None
+    batch_size = table_cfg.get('batch_size', 256)
+    doc_infos, batch = [], []
+    rows = 0
+
+    with TableRowWriter(kb_name, Path(file_path).name) as writer:
+        def flush():
+            infos = embed_and_store(kb_name, batch, embed_model, writer=vs_writer)
+            writer.write(infos)
+            doc_infos.extend(infos)
+            batch.clear()
+
+        for doc in iter_docx_table_docs(file_path):
+            scheduler.checkpoint(Priority.BULK)
+            if doc.metadata["block"] == TABLE_ROW_BLOCK:
+                rows += 1
+                # 同一行的切片放在同一批次，写结构化记录时按行合并切片id
+                batch.extend(split_row_document(doc, text_splitter))
+            else:
+                chunks = text_splitter.split_documents([doc])
+                if deduplicator is not None:
+                    result = deduplicator.deduplicate(chunks)
+                    chunks = result.docs
+                    stats.total += result.stats.total
+                    stats.kept += result.stats.kept
+                    stats.dropped += result.stats.dropped
+                batch.extend(chunks)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+
+    logger.info(f"{file_path} 表格抽取: {rows} 行, 共 {len(doc_infos)} 个切片")
+    return doc_infos, stats
+
+
+def _ingest_file_sync(kb_name: str, file_path: str, embed_model: str, dedup: bool, text_splitter_name: str,
+                      vs_type: str, old_doc_ids: List[str], save_to_db: Callable[[List[dict]], None]):
+    """
+    在同一次向量库写入中删除文件原有的切片并写入新切片。save_to_db 在发布向量库之前调用，
+    数据库写入失败时向量库不发布；发布失败时数据库已指向新切片，旧切片仍按 metadata 中的文件名在下次重新入库时删除
+    """
+    file_name = Path(file_path).name
+    with VectorStoreWriter(kb_name, embed_model, vs_type) as writer:
+        # 数据库记录的旧切片，加上向量库中按文件名找到的(并发入库或上次发布失败留下的)
+        writer.delete(old_doc_ids + writer.file_doc_ids(file_name))
+        if text_splitter_name == TABLE_SPLITTER:
+            doc_infos, stats = _ingest_docx_tables_sync(kb_name, file_path, embed_model, dedup, writer)
+        else:
+            doc_infos, stats = _split_and_store(kb_name, file_path, embed_model, dedup, text_splitter_name, writer)
+        save_to_db(doc_infos)
+    return doc_infos, stats
+
+
+def _split_and_store(kb_name: str, file_path: str, embed_model: str, dedup: bool, text_splitter_name: str,
+                     writer: VectorStoreWriter):
+    if text_splitter_name == "DocTree":
+        # 章节过长时仍按字符长度继续切分，章节信息保留在metadata中
+        chunks = split_docs(load_tree_docs(file_path))
+    else:
+        chunks = split_docs(load_file_docs(file_path), text_splitter_name=text_splitter_name, embed_model=embed_model)
+    logger.info(f"{file_path} 切分({text_splitter_name}): {len(chunks)} 个切片, "
+                f"平均 {sum(len(c.page_content) for c in chunks) / max(len(chunks), 1):.0f} 字符")
+
+    stats = None
+    if dedup:
+        result = get_deduplicator().deduplicate(chunks)
+        chunks, stats = result.docs, result.stats
+        logger.info(f"{file_path} 切片去重: {stats.to_dict()}")
+
+    doc_infos = embed_and_store(kb_name, chunks, embed_model, writer=writer)
+    return doc_infos, stats
+
+
+def _loader_name(file_path: str, text_splitter_name: str) -> str:
+    if text_splitter_name == "DocTree":
+        return "unstructured"
+    if text_splitter_name == TABLE_SPLITTER:
+        return "DocxTableExtractor"
+    return get_loader_class(file_path).__name__
+
+
+async def ingest_file(kb_name: str,
+                      file_path: str,
+                      embed_model: str = DEFAULT_EMBED_MODEL,
+                      dedup: bool = None,
+                      text_splitter_name: str = "RecursiveCharacterTextSplitter",
+                      vs_type: str = DEFAULT_VS_TYPE):
+    """
+    文件入库流程：加载 -> 切分 -> 近似去重 -> 向量化 -> 记录到数据库 -> 发布向量库。
+    同一文件重新入库时，原有切片在同一次向量库写入中删除，数据库中的切片记录在同一个事务中替换
+
+    text_splitter_name 为 "DocTree" 时按文档章节树切分，为 "SemanticChunker" 时按语义边界切分，
+    为 "DocxTable" 时流式抽取 docx 表格行，按行入库；
+    vs_type 为 faiss_sharded 时写入分片向量库
+
+    Returns:
+        Dict: 包含入库切片数量和去重统计的字典
+    """
+    if dedup is None:
+        dedup = dedup_cfg.get('enable', True)
+    file_name = Path(file_path).name
+    file_ext = Path(file_path).suffix.lower()
+    if text_splitter_name == TABLE_SPLITTER and file_ext != '.docx':
+        raise ValueError(f"{TABLE_SPLITTER} 只支持 .docx 文件: {file_name}")
+
+    old_doc_ids = [d["id"] for d in await list_docs_from_db(kb_name=kb_name, file_name=file_name)]
+    loader_name = _loader_name(file_path, text_splitter_name)
+    loop = asyncio.get_running_loop()
+
+    def save_to_db(doc_infos: List[dict]) -> None:
+        # 在入库线程中等待数据库事务完成：删除旧切片记录、写入新切片记录、更新文件记录
+        coro = replace_file_in_db(kb_name=kb_name,
+                                  file_name=file_name,
+                                  file_ext=file_ext,
+                                  doc_infos=doc_infos,
+                                  document_loader_name=loader_name,
+                                  text_splitter_name=text_splitter_name,
+                                  file_mtime=os.path.getmtime(file_path),
+                                  file_size=os.path.getsize(file_path))
+        asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    # 解析、切分和向量化都是阻塞调用，放到批量任务线程池中执行，不占用检索请求的线程
+    doc_infos, stats = await scheduler.run(Priority.BULK, _ingest_file_sync, kb_name, file_path, embed_model, dedup,
+                                           text_splitter_name, vs_type, old_doc_ids, save_to_db)
+    return {
+        "kb_name": kb_name,
+        "file_name": file_name,
+        "docs_count": len(doc_infos),
+        "dedup": stats.to_dict() if stats else None,
+    }
+
+
+if __name__ == '__main__':
+    res = asyncio.run(ingest_file('company_zhidu', 'lianxi/load_text/files/企业报销制度.docx'))
+    print(res)
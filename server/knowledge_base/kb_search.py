@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Tuple
+
+import faiss
+from langchain.schema import Document
+
+from server.knowledge_base.metadata_filter import filtered_search_by_vector
+from server.knowledge_base.quantization import QUANTIZED_VS_TYPES
+from server.knowledge_base.query_cache import embed_query
+from server.knowledge_base.reranker import get_reranker, rerank_cfg
+from server.knowledge_base.sharded_store import ShardedFAISS
+from server.knowledge_base.utils import (
+    DEFAULT_EMBED_MODEL,
+    DEFAULT_VS_TYPE,
+    SHARDED_VS_TYPE,
+    VectorStoreNotFound,
+    get_vector_store,
+)
+from server.scheduler import Priority, scheduler
+
+logger = logging.getLogger(__name__)
+
+
+def format_source(doc: Document, score: float, kb_name: str, rerank_info: Dict = None) -> Dict:
+    """将检索结果整理为接口返回的 sources 条目"""
+    source = doc.metadata.get("source") or ""
+    return {
+        "kb_name": kb_name,
+        "doc_id": getattr(doc, "id", None) or doc.metadata.get("doc_id"),
+        "file_name": os.path.basename(source),
+        "content": doc.page_content,
+        "score": float(score),
+        "metadata": doc.metadata,
+        "rerank": rerank_info,
+    }
+
+
+def search_by_vector(vector_store,
+                     query_vector: List[float],
+                     k: int,
+                     score_threshold: float = None,
+                     metadata_filter: Dict = None) -> List[Tuple[Document, float]]:
+    """按向量检索，分片向量库在各分片上并行检索后合并"""
+    if isinstance(vector_store, ShardedFAISS):
+        return vector_store.search_by_vector(query_vector, k=k, score_threshold=score_threshold,
+                                             metadata_filter=metadata_filter)
+    if metadata_filter:
+        return filtered_search_by_vector(vector_store, query_vector, metadata_filter,
+                                         k=k, score_threshold=score_threshold)
+    return vector_store.similarity_search_with_score_by_vector(query_vector, k=k, score_threshold=score_threshold)
+
+
+def metric_type_of(vector_store) -> int:
+    if isinstance(vector_store, ShardedFAISS):
+        return vector_store.metric_type
+    return vector_store.index.metric_type
+
+
+def search_docs(query: str,
+                kb_name: str,
+                top_k: int = 3,
+                score_threshold: float = None,
+                embed_model: str = DEFAULT_EMBED_MODEL,
+                vs_type: str = DEFAULT_VS_TYPE,
+                rerank: bool = None,
+                rerank_budget_ms: float = None,
+                metadata_filter: Dict = None) -> Dict:
+    """
+    知识库检索，可选对 top_n 候选做 cross-encoder 重排序
+
+    metadata_filter 形如 {"file_name": "企业报销制度.docx"}，在ANN检索内部按位图过滤
+
+    Returns:
+        Dict: {"sources": [...]}，每条 source 的 rerank 字段记录重排序是否生效及原因
+    """
+    if rerank is None:
+        rerank = rerank_cfg.get('enable', False)
+
+    vector_store = get_vector_store(kb_name, embed_model, vs_type)
+    fetch_k = max(top_k, rerank_cfg.get('top_n', 20)) if rerank else top_k
+    query_vector = embed_query(query, embed_model)
+    docs_with_scores = search_by_vector(vector_store, query_vector, fetch_k, score_threshold, metadata_filter)
+
+    rerank_info = {"status": "disabled"}
+    if rerank and docs_with_scores:
+        budget_ms = rerank_budget_ms if rerank_budget_ms is not None else rerank_cfg.get('budget_ms', 300)
+        docs_with_scores, rerank_info = get_reranker().rerank(query, docs_with_scores, top_k, budget_ms)
+    else:
+        docs_with_scores = docs_with_scores[:top_k]
+
+    return {"sources": [format_source(doc, score, kb_name, rerank_info) for doc, score in docs_with_scores]}
+
+
+def normalize_scores(docs_with_scores: List[Tuple[Document, float]], higher_is_better: bool = True) -> List[float]:
+    """
+    把原始分数换算到 [0, 1] 的绝对相似度，越大越相似，不同知识库的结果可以直接比较。
+    按度量自身的尺度换算，而不是在单个知识库内做 min-max：否则每个知识库的第一名都是 1.0，
+    只有弱匹配的知识库会和有强匹配的知识库并列。
+
+    - 内积(归一化向量即余弦相似度)：截断到 [0, 1]
+    - L2：faiss 返回平方距离，归一化向量满足 d = 2 - 2cos，换算为 1 - d / 2 后截断到 [0, 1]
+    """
+    if higher_is_better:
+        return [min(max(float(s), 0.0), 1.0) for _, s in docs_with_scores]
+    return [min(max(1.0 - float(s) / 2, 0.0), 1.0) for _, s in docs_with_scores]
+
+
+async def search_multi_kb(query: str,
+                          kbs: List[Dict],
+                          top_k: int = 3,
+                          score_threshold: float = None,
+                          per_kb_timeout: float = 2.0,
+                          metadata_filter: Dict = None) -> Dict:
+    """
+    并发检索多个知识库并合并结果
+
+    Args:
+        kbs: [{"kb_name": str, "vs_type": str, "embed_model": str}, ...]
+        per_kb_timeout: 单个知识库(含向量化)的超时时间(秒)，超时的知识库不参与合并
+
+    Returns:
+        Dict: {"sources": 合并后的 top_k, "kbs": {kb_name: {"status", "count", "elapsed_ms"}}}
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    # 同一个嵌入模型只向量化一次查询
+    embed_models = {kb.get("embed_model") or DEFAULT_EMBED_MODEL for kb in kbs}
+    embed_tasks = {m: asyncio.ensure_future(scheduler.run(Priority.INTERACTIVE, embed_query, query, m))
+                   for m in embed_models}
+
+    async def search_one(kb: Dict):
+        vs_type = kb.get("vs_type") or DEFAULT_VS_TYPE
+        if vs_type not in ("faiss", SHARDED_VS_TYPE) and vs_type not in QUANTIZED_VS_TYPES:
+            return [], True, "unsupported_vs_type"
+        embed_model = kb.get("embed_model") or DEFAULT_EMBED_MODEL
+        # shield: 单个知识库超时被取消时，不能连带取消其他知识库共用的向量化任务
+        query_vector = await asyncio.shield(embed_tasks[embed_model])
+        vector_store = await scheduler.run(Priority.INTERACTIVE, get_vector_store, kb["kb_name"], embed_model, vs_type)
+        higher_is_better = metric_type_of(vector_store) == faiss.METRIC_INNER_PRODUCT
+        docs = await scheduler.run(Priority.INTERACTIVE, search_by_vector, vector_store, query_vector, top_k,
+                                   score_threshold, metadata_filter)
+        return docs, higher_is_better, "ok"
+
+    async def search_with_timeout(kb: Dict):
+        try:
+            docs, higher_is_better, status = await asyncio.wait_for(search_one(kb), timeout=per_kb_timeout)
+        except asyncio.TimeoutError:
+            docs, higher_is_better, status = [], True, "timeout"
+        except VectorStoreNotFound:
+            docs, higher_is_better, status = [], True, "not_found"
+        except Exception as e:
+            logger.error(f"知识库 {kb['kb_name']} 检索失败: {e}")
+            docs, higher_is_better, status = [], True, "error"
+        return kb["kb_name"], docs, higher_is_better, status, round((loop.time() - start) * 1000, 2)
+
+    results = await asyncio.gather(*(search_with_timeout(kb) for kb in kbs))
+    for task in embed_tasks.values():
+        task.cancel()
+
+    merged = []
+    kb_status = {}
+    for kb_name, docs, higher_is_better, status, elapsed_ms in results:
+        kb_status[kb_name] = {"status": status, "count": len(docs), "elapsed_ms": elapsed_ms}
+        for (doc, score), norm_score in zip(docs, normalize_scores(docs, higher_is_better)):
+            source = format_source(doc, norm_score, kb_name)
+            source["raw_score"] = float(score)
+            merged.append(source)
+
+    merged.sort(key=lambda x: -x["score"])
+    return {"sources": merged[:top_k], "kbs": kb_status}
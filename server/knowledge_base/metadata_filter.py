@@ -0,0 +1,195 @@
+import os
+import threading
+import weakref
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+
+from server.knowledge_base.quantization import rescore_positions
+
+# 默认建立位图索引的元数据字段，file_name 由 metadata["source"] 推导
+DEFAULT_FILTER_FIELDS = ("file_name", "kb_name", "title", "title_path", "doc_id")
+
+# 命中的向量数量不超过该值时，直接取出这些向量精确打分，比带过滤的ANN检索更快
+EXACT_SEARCH_MAX_IDS = 4096
+
+FilterValue = Union[str, int, List[Union[str, int]]]
+
+
+def _doc_field(doc: Document, field: str):
+    if field == "file_name" and "file_name" not in doc.metadata:
+        source = doc.metadata.get("source")
+        return os.path.basename(source) if source else None
+    return doc.metadata.get(field)
+
+
+class MetadataBitmapIndex:
+    """
+    向量库元数据的位图索引
+
+    每个 (字段, 取值) 对应一个按 FAISS 内部编号排列的位图(np.packbits, little-endian 位序，
+    与 faiss.IDSelectorBitmap 的位序一致)，过滤条件直接在位图上做与/或运算，
+    结果作为 IDSelector 传给 FAISS，在ANN检索内部完成过滤，返回结果数量不受过滤影响。
+    """
+    def __init__(self, fields: Iterable[str] = DEFAULT_FILTER_FIELDS):
+        self.fields = tuple(fields)
+        self.ntotal = 0
+        self._last_docstore_id = None
+        # field -> value -> 编号列表(构建期) / 位图(查询期)
+        self._ids: Dict[str, Dict[object, List[int]]] = {f: {} for f in self.fields}
+        self._bitmaps: Dict[str, Dict[object, np.ndarray]] = {f: {} for f in self.fields}
+        self._lock = threading.Lock()
+
+    def _index_docs(self, vector_store: FAISS, start: int, end: int) -> None:
+        for i in range(start, end):
+            doc = vector_store.docstore.search(vector_store.index_to_docstore_id[i])
+            if not isinstance(doc, Document):
+                continue
+            for field in self.fields:
+                value = _doc_field(doc, field)
+                if value is not None:
+                    self._ids[field].setdefault(value, []).append(i)
+
+    def sync(self, vector_store: FAISS) -> None:
+        """
+        与向量库保持同步：只追加了新向量时增量索引，发生过删除(编号重排)时全量重建
+        """
+        mapping = vector_store.index_to_docstore_id
+        n = vector_store.index.ntotal
+        with self._lock:
+            appended = n >= self.ntotal and (self.ntotal == 0 or mapping.get(self.ntotal - 1) == self._last_docstore_id)
+            if appended and n == self.ntotal:
+                return
+            if not appended:
+                self._ids = {f: {} for f in self.fields}
+                self.ntotal = 0
+            self._index_docs(vector_store, self.ntotal, n)
+            self.ntotal = n
+            self._last_docstore_id = mapping.get(n - 1) if n else None
+            self._bitmaps = {f: {} for f in self.fields}
+
+    def _value_bitmap(self, field: str, value) -> np.ndarray:
+        bitmap = self._bitmaps[field].get(value)
+        if bitmap is None:
+            mask = np.zeros(self.ntotal, dtype=bool)
+            mask[self._ids[field].get(value, [])] = True
+            bitmap = np.packbits(mask, bitorder='little')
+            self._bitmaps[field][value] = bitmap
+        return bitmap
+
+    def bitmap(self, metadata_filter: Dict[str, FilterValue]) -> np.ndarray:
+        """
+        同一字段的多个取值之间为"或"，不同字段之间为"与"
+        """
+        result = None
+        with self._lock:
+            for field, values in metadata_filter.items():
+                if field not in self._ids:
+                    raise ValueError(f"字段 {field} 未建立位图索引，可用字段: {self.fields}")
+                if not isinstance(values, (list, tuple, set)):
+                    values = [values]
+                field_bitmap = np.zeros((self.ntotal + 7) // 8, dtype=np.uint8)
+                for value in values:
+                    field_bitmap |= self._value_bitmap(field, value)
+                result = field_bitmap if result is None else result & field_bitmap
+        if result is None:
+            result = np.packbits(np.ones(self.ntotal, dtype=bool), bitorder='little')
+        return result
+
+
+_bitmap_indexes: "weakref.WeakKeyDictionary[FAISS, MetadataBitmapIndex]" = weakref.WeakKeyDictionary()
+_bitmap_lock = threading.Lock()
+
+
+def get_bitmap_index(vector_store: FAISS) -> MetadataBitmapIndex:
+    with _bitmap_lock:
+        index = _bitmap_indexes.get(vector_store)
+        if index is None:
+            index = MetadataBitmapIndex()
+            _bitmap_indexes[vector_store] = index
+    index.sync(vector_store)
+    return index
+
+
+def _search_parameters(index: faiss.Index, selector: faiss.IDSelector, k: int, selectivity: float):
+    """
+    不同类型的索引需要对应的 SearchParameters 子类。
+    过滤条件越严格，近似检索访问到的候选里满足条件的越少，按命中比例放大 nprobe / efSearch
+    """
+    scale = 1.0 / max(selectivity, 1e-6)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        nprobe = min(ivf.nlist, int(np.ceil(ivf.nprobe * scale)))
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        ef = min(index.ntotal, max(index.hnsw.efSearch, int(np.ceil(k * scale))))
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef)
+    return faiss.SearchParameters(sel=selector)
+
+
+def filtered_search_by_vector(vector_store: FAISS,
+                              query_vector: List[float],
+                              metadata_filter: Dict[str, FilterValue],
+                              k: int = 3,
+                              score_threshold: float = None) -> List[Tuple[Document, float]]:
+    """
+    带元数据过滤的向量检索，与 FAISS.similarity_search_with_score_by_vector 返回格式一致
+    """
+    bitmap_index = get_bitmap_index(vector_store)
+    bitmap = bitmap_index.bitmap(metadata_filter)
+    mask = np.unpackbits(bitmap, count=bitmap_index.ntotal, bitorder='little').astype(bool)
+    ids = np.flatnonzero(mask)
+    if not len(ids):
+        return []
+
+    index = vector_store.index
+    query = np.asarray([query_vector], dtype=np.float32)
+    if vector_store._normalize_L2:
+        faiss.normalize_L2(query)
+
+    inner_product = index.metric_type == faiss.METRIC_INNER_PRODUCT
+    # 量化向量库解码出的向量和检索分数都是近似值，候选统一用原始向量精确打分
+    rescore_vectors = getattr(vector_store, "rescore_vectors", None)
+    scores: Optional[np.ndarray] = None
+    if len(ids) <= EXACT_SEARCH_MAX_IDS:
+        # 命中数量少时直接取出向量精确打分
+        if rescore_vectors is not None:
+            scores, positions = rescore_positions(rescore_vectors, query[0], ids, k, inner_product)
+        else:
+            try:
+                vectors = index.reconstruct_batch(ids.astype(np.int64))
+            except RuntimeError:
+                vectors = None
+            if vectors is not None:
+                if inner_product:
+                    dist = vectors @ query[0]
+                    order = np.argsort(-dist)[:k]
+                else:
+                    dist = ((vectors - query[0]) ** 2).sum(axis=1)
+                    order = np.argsort(dist)[:k]
+                positions, scores = ids[order], dist[order]
+
+    if scores is None:
+        fetch_k = k * vector_store.rescore_factor if rescore_vectors is not None else k
+        selector = faiss.IDSelectorBitmap(bitmap_index.ntotal, faiss.swig_ptr(bitmap))
+        params = _search_parameters(index, selector, fetch_k, len(ids) / bitmap_index.ntotal)
+        distances, positions = index.search(query, fetch_k, params=params)
+        keep = positions[0] >= 0
+        positions, scores = positions[0][keep], distances[0][keep]
+        if rescore_vectors is not None and len(positions):
+            scores, positions = rescore_positions(rescore_vectors, query[0], positions, k, inner_product)
+
+    results = []
+    for pos, score in zip(positions.tolist(), scores.tolist()):
+        doc = vector_store.docstore.search(vector_store.index_to_docstore_id[pos])
+        if score_threshold is not None:
+            # 与 LangChain FAISS 的约定一致：内积越大越相似，L2距离越小越相似
+            if inner_product and score < score_threshold:
+                continue
+            if not inner_product and score > score_threshold:
+                continue
+        results.append((doc, score))
+    return results
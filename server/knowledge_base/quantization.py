@@ -0,0 +1,216 @@
+import logging
+import os
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+
+from server.knowledge_base.index_versions import publish_version, read_current_version
+from server.knowledge_base.utils import kb_cfg
+
+logger = logging.getLogger(__name__)
+
+quant_cfg = kb_cfg.get('quantization', {})
+
+QUANTIZED_VS_TYPES = {"faiss_sq8": "sq8", "faiss_pq": "pq"}
+RESCORE_VECTORS_FILE = "vectors.npy"
+
+
+def extract_vectors(index: faiss.Index) -> np.ndarray:
+    """从原始(未量化)索引中取出全部向量"""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def build_quantized_index(vectors: np.ndarray,
+                          method: str,
+                          metric_type: int = faiss.METRIC_INNER_PRODUCT,
+                          pq_m: int = quant_cfg.get('pq_m', 64),
+                          pq_nbits: int = quant_cfg.get('pq_nbits', 8)) -> faiss.Index:
+    """
+    Args:
+        method: "sq8" 每维 1 字节；"pq" 每个向量 pq_m * pq_nbits / 8 字节
+    """
+    n, d = vectors.shape
+    if method == "sq8":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, metric_type)
+    elif method == "pq":
+        if d % pq_m != 0:
+            raise ValueError(f"向量维度 {d} 必须能被 pq_m({pq_m}) 整除")
+        # 训练样本少于 2^nbits 时无法训练码本，降低每段的比特数
+        nbits = max(1, min(pq_nbits, int(np.log2(max(n, 2)))))
+        if nbits < pq_nbits:
+            logger.warning(f"训练向量数量({n})不足，PQ 比特数由 {pq_nbits} 降为 {nbits}")
+        index = faiss.IndexPQ(d, pq_m, nbits, metric_type)
+    else:
+        raise ValueError(f"不支持的量化方式: {method}")
+    if n:
+        index.train(vectors)
+        index.add(vectors)
+    return index
+
+
+def rescore_positions(rescore_vectors: np.ndarray,
+                      query: np.ndarray,
+                      positions: np.ndarray,
+                      k: int,
+                      inner_product: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    用原始向量给候选位置精确打分，返回按相似度排序的前 k 个 (scores, positions)
+    """
+    # mmap 按行顺序读取更友好，先排序再取
+    positions = np.sort(np.asarray(positions, dtype=np.int64))
+    vectors = np.asarray(rescore_vectors[positions], dtype=np.float32)
+    if inner_product:
+        scores = vectors @ query
+        order = np.argsort(-scores)[:k]
+    else:
+        scores = ((vectors - query) ** 2).sum(axis=1)
+        order = np.argsort(scores)[:k]
+    return scores[order], positions[order]
+
+
+def search_with_rescoring(index: faiss.Index,
+                          rescore_vectors: np.ndarray,
+                          queries: np.ndarray,
+                          k: int,
+                          rescore_factor: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    先用量化索引取 k * rescore_factor 个候选，再用原始向量精确打分
+
+    Returns:
+        (scores, positions)，形状均为 [len(queries), k]，不足 k 个时 positions 以 -1 补齐
+    """
+    inner_product = index.metric_type == faiss.METRIC_INNER_PRODUCT
+    shortlist_k = min(index.ntotal, k * rescore_factor)
+    out_scores = np.full((len(queries), k), -np.inf if inner_product else np.inf, dtype=np.float32)
+    out_positions = np.full((len(queries), k), -1, dtype=np.int64)
+    if shortlist_k <= 0:
+        return out_scores, out_positions
+
+    _, shortlists = index.search(queries, shortlist_k)
+    for qi, query in enumerate(queries):
+        scores, positions = rescore_positions(rescore_vectors, query, shortlists[qi][shortlists[qi] >= 0],
+                                              k, inner_product)
+        out_scores[qi, :len(positions)] = scores
+        out_positions[qi, :len(positions)] = positions
+    return out_scores, out_positions
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """索引常驻内存的大小，以序列化后的字节数近似"""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+class ReadOnlyVectorStore(RuntimeError):
+    """向只读的派生向量库(量化向量库)写入"""
+
+
+class QuantizedFAISS(FAISS):
+    """
+    量化索引 + 原始向量精确重排的向量库
+
+    - 常驻内存的是量化后的索引(sq8 约为原来的 1/4，pq 更小)
+    - 原始 float32 向量保存在磁盘上，以 mmap 方式打开，只有候选集对应的行会被读入内存
+    - 检索时先用量化索引取 k * rescore_factor 个候选，再用原始向量精确打分取 top k
+
+    量化索引由原始 faiss 向量库派生，是只读的，新增文档后需调用 quantize_vector_store 重新生成。
+    """
+    rescore_vectors: Optional[np.ndarray] = None
+    rescore_factor: int = quant_cfg.get('rescore_factor', 4)
+    # 量化向量库按版本目录保存，与原始向量库一样由 CURRENT 指向当前版本
+    version: Optional[str] = None
+
+    @classmethod
+    def load_quantized(cls, folder_path, embeddings, rescore_factor: int = None, version: str = None,
+                       **kwargs) -> "QuantizedFAISS":
+        """加载指定版本，默认加载当前版本；没有版本指针时兼容直接保存在 folder_path 下的旧布局"""
+        version = version or read_current_version(folder_path)
+        version_dir = Path(folder_path) / version if version else Path(folder_path)
+        vector_store = cls.load_local(version_dir, embeddings, allow_dangerous_deserialization=True, **kwargs)
+        vectors_path = version_dir / RESCORE_VECTORS_FILE
+        if os.path.exists(vectors_path):
+            vector_store.rescore_vectors = np.load(vectors_path, mmap_mode='r')
+        if rescore_factor:
+            vector_store.rescore_factor = rescore_factor
+        vector_store.version = version
+        return vector_store
+
+    def add_embeddings(self, *args, **kwargs):
+        raise ReadOnlyVectorStore("量化向量库为只读，请写入原始向量库后重新量化")
+
+    def add_texts(self, *args, **kwargs):
+        raise ReadOnlyVectorStore("量化向量库为只读，请写入原始向量库后重新量化")
+
+    def similarity_search_with_score_by_vector(self,
+                                               embedding: List[float],
+                                               k: int = 4,
+                                               filter: Any = None,
+                                               fetch_k: int = 20,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        if self.rescore_vectors is None:
+            return super().similarity_search_with_score_by_vector(embedding, k, filter, fetch_k, **kwargs)
+
+        query = np.asarray([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(query)
+        inner_product = self.index.metric_type == faiss.METRIC_INNER_PRODUCT
+        if filter is None:
+            scores, positions = search_with_rescoring(self.index, self.rescore_vectors, query, k, self.rescore_factor)
+            scores, positions = scores[0], positions[0]
+        else:
+            # 带过滤时量化索引多取候选，过滤后同样用原始向量精确打分，分数与不过滤时一致
+            filter_func = self._create_filter_func(filter)
+            shortlist_k = min(self.index.ntotal, max(fetch_k, k * self.rescore_factor))
+            if shortlist_k <= 0:
+                return []
+            _, shortlist = self.index.search(query, shortlist_k)
+            kept = [pos for pos in shortlist[0].tolist()
+                    if pos >= 0 and filter_func(self.docstore.search(self.index_to_docstore_id[pos]).metadata)]
+            if not kept:
+                return []
+            scores, positions = rescore_positions(self.rescore_vectors, query[0], np.asarray(kept), k, inner_product)
+
+        score_threshold = kwargs.get("score_threshold")
+        results = []
+        for score, pos in zip(scores.tolist(), positions.tolist()):
+            if pos < 0:
+                break
+            if score_threshold is not None:
+                if (inner_product and score < score_threshold) or (not inner_product and score > score_threshold):
+                    continue
+            doc = self.docstore.search(self.index_to_docstore_id[pos])
+            results.append((doc, score))
+        return results
+
+
+def quantize_vector_store(vector_store: FAISS, folder_path, method: str, **kwargs) -> QuantizedFAISS:
+    """
+    由原始向量库生成量化向量库，发布为 folder_path 下的新版本：index.faiss/index.pkl 为量化索引和文档，
+    vectors.npy 为原始向量。旧版本的 vectors.npy 可能正被检索 mmap，不能原地覆盖
+    """
+    vectors = extract_vectors(vector_store.index)
+    index = build_quantized_index(vectors, method, metric_type=vector_store.index.metric_type, **kwargs)
+    quantized = QuantizedFAISS(
+        embedding_function=vector_store.embedding_function,
+        index=index,
+        docstore=vector_store.docstore,
+        index_to_docstore_id=vector_store.index_to_docstore_id,
+        normalize_L2=vector_store._normalize_L2,
+        distance_strategy=vector_store.distance_strategy,
+    )
+
+    def write(version_dir: Path):
+        quantized.save_local(version_dir)
+        np.save(version_dir / RESCORE_VECTORS_FILE, vectors)
+
+    version = publish_version(folder_path, write)
+    quantized.rescore_vectors = np.load(Path(folder_path) / version / RESCORE_VECTORS_FILE, mmap_mode='r')
+    quantized.version = version
+    logger.info(f"量化完成({method}): 原始索引 {index_memory_bytes(vector_store.index)} 字节, "
+                f"量化索引 {index_memory_bytes(index)} 字节")
+    return quantized
@@ -0,0 +1,115 @@
+import logging
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from server.knowledge_base.utils import DEFAULT_EMBED_MODEL, get_embeddings, kb_cfg
+from server.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+query_cache_cfg = kb_cfg.get('query_cache', {})
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# 问句首尾的句读标点不影响语义，如 "报销流程？" 与 "报销流程"；不包含 + # 等可能有含义的符号
+_SENTENCE_PUNCT = r"\s.,!?;:'\"`~…。、"
+_EDGE_PUNCT_RE = re.compile(rf"^[{_SENTENCE_PUNCT}]+|[{_SENTENCE_PUNCT}]+$")
+
+
+@lru_cache(maxsize=1)
+def _get_t2s_converter():
+    """繁体转简体依赖可选的 opencc，未安装时跳过该步骤"""
+    try:
+        import opencc
+    except ImportError:
+        logger.warning("未安装 opencc，查询归一化跳过繁简转换")
+        return None
+    return opencc.OpenCC('t2s')
+
+
+def normalize_query(query: str, to_simplified: bool = query_cache_cfg.get('to_simplified', False)) -> str:
+    """
+    查询归一化：NFKC(全角转半角、兼容字符统一) -> 小写 -> 合并空白 -> 去掉首尾标点，可选繁体转简体
+    """
+    text = unicodedata.normalize('NFKC', query).lower()
+    text = _WHITESPACE_RE.sub(' ', text)
+    text = _EDGE_PUNCT_RE.sub('', text)
+    if to_simplified:
+        converter = _get_t2s_converter()
+        if converter is not None:
+            text = converter.convert(text)
+    # 全是标点的查询归一化后为空，保留原文
+    return text or query.strip()
+
+
+class QueryEmbeddingCache:
+    """
+    查询向量的LRU缓存，按 (嵌入模型, 归一化后的查询) 缓存，线程安全。
+    归一化文本只用作缓存键，缓存中保存的是首次出现的原始查询的向量
+    """
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._data.get(key)
+            if vector is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return vector
+
+    def put(self, key: Tuple[str, str], vector: List[float]) -> None:
+        with self._lock:
+            self._data[key] = vector
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_query_cache = QueryEmbeddingCache(max_size=query_cache_cfg.get('max_size', 10000))
+metrics.register_collector("query_embedding_cache", _query_cache.stats)
+
+
+def get_query_cache() -> QueryEmbeddingCache:
+    return _query_cache
+
+
+def embed_query(query: str, embed_model: str = DEFAULT_EMBED_MODEL) -> List[float]:
+    """
+    向量化查询，重复或仅有空白、标点、全半角差异的问题直接复用缓存的向量。
+    未命中时向量化原始查询而不是归一化文本，大小写、标点等仍按模型原本的方式参与编码
+    """
+    if not query_cache_cfg.get('enable', True):
+        return get_embeddings(embed_model).embed_query(query)
+
+    normalized = normalize_query(query)
+    key = (embed_model, normalized)
+    vector = _query_cache.get(key)
+    if vector is None:
+        vector = get_embeddings(embed_model).embed_query(query)
+        _query_cache.put(key, vector)
+    return vector
@@ -0,0 +1,214 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from langchain.schema import Document
+
+from server.knowledge_base.text_splitter import token_length_function
+from server.knowledge_base.utils import kb_cfg
+
+logger = logging.getLogger(__name__)
+
+rerank_cfg = kb_cfg.get('rerank', {})
+
+
+class PairScoreCache:
+    """(query, 切片) 打分结果的LRU缓存，线程安全"""
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(query: str, text: str) -> bytes:
+        return hashlib.blake2b(f"{query}\x00{text}".encode('utf-8'), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[float]:
+        with self._lock:
+            score = self._data.get(key)
+            if score is not None:
+                self._data.move_to_end(key)
+            return score
+
+    def put(self, key: bytes, score: float) -> None:
+        with self._lock:
+            self._data[key] = score
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+class CrossEncoderReranker:
+    """
+    本地 cross-encoder 重排序，CPU 推理
+
+    - 候选按长度排序后分批，同一批内长度接近，padding 更少
+    - 已打过分的 (query, 切片) 直接走缓存
+    - 有耗时预算：模型尚未加载完成，或预计耗时超出预算时跳过重排序，返回原始顺序；
+      推理中途用完预算时，已打分的切片在各自原来的位置之间按分数重排，未打分的切片保持检索顺序
+    """
+    def __init__(self,
+                 model_name: str = rerank_cfg.get('model', 'BAAI/bge-reranker-base'),
+                 batch_size: int = rerank_cfg.get('batch_size', 16),
+                 max_length: int = rerank_cfg.get('max_length', 512),
+                 cache_size: int = rerank_cfg.get('cache_size', 10000),
+                 num_threads: int = None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.num_threads = num_threads
+        self.cache = PairScoreCache(cache_size)
+
+        self._model = None
+        self._tokenizer = None
+        self._load_error: Optional[str] = None
+        self._load_lock = threading.Lock()
+        self._loading = False
+        # 每个 padding 后token的平均推理耗时(秒)，用于预估是否超出预算
+        self._unit_cost: Optional[float] = None
+
+    def _load(self) -> None:
+        try:
+            import torch
+            from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+            if self.num_threads:
+                torch.set_num_threads(self.num_threads)
+            tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+            model.eval()
+            self._tokenizer, self._model = tokenizer, model
+            # 用一批典型长度的文本校准推理耗时，加载后的第一个请求也能按预算判断
+            self._predict_batches("校准", [["样" * 128] * self.batch_size], deadline=float('inf'))
+            logger.info(f"重排序模型加载完成: {self.model_name}")
+        except Exception as e:
+            self._load_error = f"{e.__class__.__name__}: {e}"
+            logger.error(f"重排序模型加载失败: {self._load_error}")
+        finally:
+            self._loading = False
+
+    def warmup(self, background: bool = True) -> None:
+        """加载模型，默认在后台线程中进行，加载期间的请求跳过重排序"""
+        with self._load_lock:
+            if self._model is not None or self._loading or self._load_error:
+                return
+            self._loading = True
+        if background:
+            threading.Thread(target=self._load, daemon=True).start()
+        else:
+            self._load()
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    def _predict(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        import torch
+
+        with torch.inference_mode():
+            inputs = self._tokenizer(pairs, padding=True, truncation=True,
+                                     max_length=self.max_length, return_tensors='pt')
+            logits = self._model(**inputs).logits.view(-1).float()
+            return torch.sigmoid(logits).tolist()
+
+    def score(self, query: str, texts: List[str], deadline: float) -> Tuple[Optional[List[float]], str]:
+        """
+        为每个文本打分，返回 (分数列表, 状态)：
+        - "applied": 全部打分完成
+        - "partial": 推理中途超出 deadline(perf_counter 时间点)，未打分的文本分数为 None
+        - "budget_exceeded": 一个文本都没有打分，分数列表为 None
+        """
+        scores: List[Optional[float]] = [None] * len(texts)
+        keys = [self.cache.make_key(query, t) for t in texts]
+        todo = []
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key)
+            if cached is None:
+                todo.append(i)
+            else:
+                scores[i] = cached
+
+        # 按长度排序后分批，减少padding
+        todo.sort(key=lambda i: len(texts[i]))
+        batches = [todo[start:start + self.batch_size] for start in range(0, len(todo), self.batch_size)]
+        batch_scores = self._predict_batches(query, [[texts[i] for i in batch] for batch in batches], deadline)
+        for batch, batch_result in zip(batches, batch_scores):
+            for i, s in zip(batch, batch_result):
+                scores[i] = s
+                self.cache.put(keys[i], s)
+        if len(batch_scores) == len(batches):
+            return scores, "applied"
+        if all(s is None for s in scores):
+            return None, "budget_exceeded"
+        return scores, "partial"
+
+    def _batch_units(self, query_tokens: int, texts: List[str]) -> int:
+        """一批的推理量：批大小 * padding 后的token数(批内最长的 query + 文本，截断到 max_length)"""
+        estimate = token_length_function()
+        return len(texts) * min(query_tokens + max(estimate(t) for t in texts), self.max_length)
+
+    def _predict_batches(self, query: str, batches: List[List[str]], deadline: float) -> List[List[float]]:
+        """
+        逐批推理，返回已完成批次的结果。每批开始前(包括第一批)按剩余全部批次的推理量预估完成时间，
+        预计超出 deadline 时立即停止，不再做注定用不上的推理。
+        推理量按token数加权：批次按长度升序排列，只按已完成批次的单批耗时估计会低估后面的长文本批次
+        """
+        query_tokens = token_length_function()(query)
+        units = [self._batch_units(query_tokens, batch) for batch in batches]
+        remaining = sum(units)
+        results = []
+        for batch, batch_units in zip(batches, units):
+            now = time.perf_counter()
+            if self._unit_cost is not None and now + self._unit_cost * remaining > deadline:
+                break
+            results.append(self._predict([(query, t) for t in batch]))
+            cost = (time.perf_counter() - now) / batch_units
+            self._unit_cost = cost if self._unit_cost is None else 0.8 * self._unit_cost + 0.2 * cost
+            remaining -= batch_units
+        return results
+
+    def rerank(self,
+               query: str,
+               docs_with_scores: List[Tuple[Document, float]],
+               top_k: int,
+               budget_ms: float = rerank_cfg.get('budget_ms', 300)) -> Tuple[List[Tuple[Document, float]], dict]:
+        """
+        Returns:
+            (重排后的 [(Document, 分数)], 重排序信息 {"status": ..., "elapsed_ms": ...})
+        """
+        start = time.perf_counter()
+        if not self.ready:
+            self.warmup()
+            status = "unavailable" if self._load_error else "model_loading"
+            return docs_with_scores[:top_k], {"status": status, "elapsed_ms": 0.0}
+
+        scores, status = self.score(query, [d.page_content for d, _ in docs_with_scores],
+                                    deadline=start + budget_ms / 1000)
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 2)
+        if scores is None:
+            logger.warning(f"重排序超出耗时预算({budget_ms}ms)，使用向量检索顺序")
+            return docs_with_scores[:top_k], {"status": status, "elapsed_ms": elapsed_ms}
+
+        # 只在已打分的切片占据的位置之间重排，未打分的切片保留检索顺序和检索分数
+        slots = [i for i, s in enumerate(scores) if s is not None]
+        ranked = list(docs_with_scores)
+        for slot, i in zip(slots, sorted(slots, key=lambda i: -scores[i])):
+            ranked[slot] = (docs_with_scores[i][0], scores[i])
+        info = {"status": status, "elapsed_ms": elapsed_ms}
+        if status == "partial":
+            info["scored"] = len(slots)
+            logger.warning(f"重排序超出耗时预算({budget_ms}ms)，仅 {len(slots)}/{len(scores)} 个切片参与重排")
+        return ranked[:top_k], info
+
+
+_reranker: Optional[CrossEncoderReranker] = None
+
+
+def get_reranker() -> CrossEncoderReranker:
+    global _reranker
+    if _reranker is None:
+        _reranker = CrossEncoderReranker()
+    return _reranker
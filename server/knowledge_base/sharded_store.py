@@ -0,0 +1,274 @@
+import heapq
+import json
+import logging
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import faiss
+from langchain.schema import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from server.knowledge_base.index_versions import publish_vector_store, read_current_version
+from server.knowledge_base.metadata_filter import filtered_search_by_vector
+from server.knowledge_base.utils import kb_cfg
+
+logger = logging.getLogger(__name__)
+
+shard_cfg = kb_cfg.get('sharding', {})
+
+SHARDS_META_FILE = "shards.json"
+
+
+class ShardedFAISS:
+    """
+    按文档ID哈希分片的FAISS向量库
+
+    - 每个分片是一个独立的 FAISS 向量库，保存在 shard_xxx 目录下，按版本目录发布，CURRENT 指向当前版本
+    - 检索时各分片在线程池中并行检索(faiss 检索期间释放GIL)，再合并 top k
+    - 每个分片一把锁，同一分片的创建、写入和发布串行执行，不同分片之间并行
+    - 入库时写入分片的副本(ShardStaging)，publish_shards 发布新版本后只替换内存中的引用，正在进行的检索继续使用旧分片
+    - 其他进程发布的分片版本由热加载线程调用 reload_changed_shards 逐个分片切换
+    - 单个分片可以通过 rebuild_shard 重建、swap_shard 替换，同样走发布新版本的流程
+    """
+    def __init__(self,
+                 folder_path,
+                 embeddings,
+                 num_shards: int = shard_cfg.get('num_shards', 8),
+                 max_workers: int = shard_cfg.get('max_workers', 8)):
+        self.folder_path = Path(folder_path)
+        self.embeddings = embeddings
+        self.num_shards = num_shards
+        self.shards: List[Optional[FAISS]] = [None] * num_shards
+        # 各分片已加载的版本，旧布局(直接保存在分片目录下)为 None
+        self.versions: List[Optional[str]] = [None] * num_shards
+        self._shard_locks = [threading.Lock() for _ in range(num_shards)]
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vs_shard")
+
+    def shard_of(self, doc_id: str) -> int:
+        return zlib.crc32(doc_id.encode('utf-8')) % self.num_shards
+
+    def shard_path(self, shard_id: int) -> Path:
+        return self.folder_path / f"shard_{shard_id:03d}"
+
+    @classmethod
+    def load_or_create(cls, folder_path, embeddings, **kwargs) -> "ShardedFAISS":
+        """
+        分片数量保存在 shards.json 中，已有向量库按保存时的分片数加载，保证哈希分布不变
+        """
+        meta_path = Path(folder_path) / SHARDS_META_FILE
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                kwargs["num_shards"] = json.load(f)["num_shards"]
+        store = cls(folder_path, embeddings, **kwargs)
+        os.makedirs(folder_path, exist_ok=True)
+        if not os.path.exists(meta_path):
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({"num_shards": store.num_shards}, f)
+        store.load()
+        return store
+
+    def _load_shard(self, shard_id: int, version: str = None) -> Tuple[Optional[FAISS], Optional[str]]:
+        """加载分片的指定版本，默认加载当前版本，返回 (分片, 版本号)"""
+        path = self.shard_path(shard_id)
+        version = version or read_current_version(path)
+        shard_dir = path / version if version else path
+        if not os.path.exists(shard_dir / 'index.faiss'):
+            return None, version
+        shard = FAISS.load_local(shard_dir, self.embeddings, distance_strategy="METRIC_INNER_PRODUCT",
+                                 allow_dangerous_deserialization=True)
+        return shard, version
+
+    def load(self) -> None:
+        loaded = list(self._executor.map(self._load_shard, range(self.num_shards)))
+        self.shards = [shard for shard, _ in loaded]
+        self.versions = [version for _, version in loaded]
+
+    def reload_changed_shards(self) -> List[int]:
+        """
+        加载版本指针已变化的分片(其他进程发布的)并替换引用，返回切换了的分片编号
+        """
+        changed = []
+        for shard_id in range(self.num_shards):
+            latest = read_current_version(self.shard_path(shard_id))
+            if not latest or latest == self.versions[shard_id]:
+                continue
+            shard, version = self._load_shard(shard_id, latest)
+            with self._shard_locks[shard_id]:
+                if self.versions[shard_id] == version:
+                    continue
+                self.shards[shard_id], self.versions[shard_id] = shard, version
+            changed.append(shard_id)
+            logger.info(f"分片 {self.shard_path(shard_id)} 切换到版本 {version}")
+        return changed
+
+    def _partition(self, ids: List[str]) -> Dict[int, List[int]]:
+        parts: Dict[int, List[int]] = {}
+        for i, doc_id in enumerate(ids):
+            parts.setdefault(self.shard_of(doc_id), []).append(i)
+        return parts
+
+    def add_embeddings(self,
+                       text_embeddings: Iterable[Tuple[str, List[float]]],
+                       metadatas: List[dict],
+                       ids: List[str],
+                       staged: "ShardStaging" = None) -> List[int]:
+        """
+        按ID哈希写入对应分片，各分片并行写入
+
+        Args:
+            staged: 不为空时不修改检索使用的分片，写入各分片的副本(首次写入时复制)，
+                由调用方通过 publish_shards 发布，放弃发布时副本直接丢弃
+        Returns:
+            List[int]: 本次写入涉及的分片编号
+        """
+        text_embeddings = list(text_embeddings)
+
+        def add_to_shard(shard_id: int, rows: List[int]):
+            shard_te = [text_embeddings[i] for i in rows]
+            shard_meta = [metadatas[i] for i in rows]
+            shard_ids = [ids[i] for i in rows]
+            # 检查和创建在同一把锁内完成，并发写入同一个缺失的分片时只会创建一次
+            with self._shard_locks[shard_id]:
+                shard = self._staged_shard(shard_id, staged) if staged is not None else self.shards[shard_id]
+                if shard is None:
+                    shard = FAISS.from_embeddings(shard_te, self.embeddings, metadatas=shard_meta, ids=shard_ids,
+                                                  distance_strategy="METRIC_INNER_PRODUCT")
+                    if staged is not None:
+                        staged.shards[shard_id] = shard
+                    else:
+                        self.shards[shard_id] = shard
+                else:
+                    shard.add_embeddings(shard_te, metadatas=shard_meta, ids=shard_ids)
+
+        parts = self._partition(ids)
+        list(self._executor.map(lambda item: add_to_shard(*item), parts.items()))
+        return sorted(parts)
+
+    def _staged_shard(self, shard_id: int, staged: "ShardStaging") -> Optional[FAISS]:
+        """取分片在本次写入中的副本，首次取用时复制并记录所基于的版本。调用方需持有该分片的锁"""
+        if shard_id not in staged.shards:
+            staged.base_versions[shard_id] = self.versions[shard_id]
+            if self.shards[shard_id] is not None:
+                staged.shards[shard_id] = copy_shard(self.shards[shard_id])
+        return staged.shards.get(shard_id)
+
+    def delete(self, ids: List[str], staged: "ShardStaging") -> None:
+        """从各分片的副本中删除文档，检索使用的分片不变，随 publish_shards 一起发布；不存在的ID跳过"""
+        for shard_id, rows in self._partition(ids).items():
+            with self._shard_locks[shard_id]:
+                shard = self._staged_shard(shard_id, staged)
+                existing = [ids[i] for i in rows if shard is not None and ids[i] in shard.docstore._dict]
+                if existing:
+                    shard.delete(existing)
+
+    def publish_shards(self, staged: "ShardStaging") -> None:
+        """
+        把 add_embeddings 写入的分片副本发布为各分片的新版本，再替换内存中的分片引用。
+        分片的当前版本已不是副本所基于的版本时抛出 StaleVersionError(调用方应持有知识库写锁，正常不会发生)
+        """
+        def publish(item: Tuple[int, FAISS]):
+            shard_id, shard = item
+            with self._shard_locks[shard_id]:
+                version = publish_vector_store(shard, self.shard_path(shard_id), staged.base_versions.get(shard_id))
+                self.shards[shard_id], self.versions[shard_id] = shard, version
+
+        list(self._executor.map(publish, staged.shards.items()))
+
+    def swap_shard(self, shard_id: int, shard: FAISS) -> str:
+        """
+        把一个分片替换为给定的新分片：发布为该分片的新版本后替换引用，其他分片不受影响。
+        正在进行的检索继续使用旧分片；分片已被其他写入更新时抛出 StaleVersionError
+        """
+        with self._shard_locks[shard_id]:
+            base_version = self.versions[shard_id]
+        staged = ShardStaging()
+        staged.shards[shard_id] = shard
+        staged.base_versions[shard_id] = base_version
+        self.publish_shards(staged)
+        return self.versions[shard_id]
+
+    def rebuild_shard(self, shard_id: int) -> Optional[str]:
+        """
+        用分片自身保存的文档和向量重建分片并替换，用于索引参数变化或删除较多后压缩索引。
+        已发布的分片对象不会再被修改，直接读取当前分片即可，不影响检索
+
+        Returns:
+            Optional[str]: 新版本号，分片不存在时返回 None
+        """
+        shard = self.shards[shard_id]
+        if shard is None:
+            return None
+        positions = sorted(shard.index_to_docstore_id)
+        vectors = shard.index.reconstruct_n(0, shard.index.ntotal) if positions else []
+        ids = [shard.index_to_docstore_id[p] for p in positions]
+        docs = [shard.docstore.search(i) for i in ids]
+        new_shard = FAISS.from_embeddings(
+            [(d.page_content, vectors[p].tolist()) for d, p in zip(docs, positions)],
+            self.embeddings,
+            metadatas=[d.metadata for d in docs],
+            ids=ids,
+            distance_strategy="METRIC_INNER_PRODUCT",
+        )
+        version = self.swap_shard(shard_id, new_shard)
+        logger.info(f"分片 {shard_id} 重建完成, 向量数: {len(ids)}, 版本: {version}")
+        return version
+
+    @property
+    def metric_type(self) -> int:
+        for shard in self.shards:
+            if shard is not None:
+                return shard.index.metric_type
+        return faiss.METRIC_L2
+
+    @property
+    def ntotal(self) -> int:
+        return sum(s.index.ntotal for s in self.shards if s is not None)
+
+    def search_by_vector(self,
+                         embedding: List[float],
+                         k: int = 4,
+                         score_threshold: float = None,
+                         metadata_filter: Dict = None) -> List[Tuple[Document, float]]:
+        """并行检索全部分片并合并 top k"""
+        shards = [s for s in self.shards if s is not None]
+
+        def search_shard(shard: FAISS):
+            if metadata_filter:
+                return filtered_search_by_vector(shard, embedding, metadata_filter, k=k,
+                                                 score_threshold=score_threshold)
+            return shard.similarity_search_with_score_by_vector(embedding, k=k, score_threshold=score_threshold)
+
+        results = [r for shard_results in self._executor.map(search_shard, shards) for r in shard_results]
+        if self.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return heapq.nlargest(k, results, key=lambda x: x[1])
+        return heapq.nsmallest(k, results, key=lambda x: x[1])
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, **kwargs):
+        return self.search_by_vector(embedding, k=k, score_threshold=kwargs.get("score_threshold"))
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs):
+        embedding = self.embeddings.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)
+
+
+class ShardStaging:
+    """一次写入涉及的分片副本，以及每个副本所基于的分片版本"""
+    def __init__(self):
+        self.shards: Dict[int, FAISS] = {}
+        self.base_versions: Dict[int, Optional[str]] = {}
+
+
+def copy_shard(shard: FAISS) -> FAISS:
+    """复制分片的索引、文档和编号映射，写入副本不影响正在检索原分片的线程"""
+    return FAISS(embedding_function=shard.embedding_function,
+                 index=faiss.clone_index(shard.index),
+                 docstore=InMemoryDocstore(dict(shard.docstore._dict)),
+                 index_to_docstore_id=dict(shard.index_to_docstore_id),
+                 normalize_L2=shard._normalize_L2,
+                 distance_strategy=shard.distance_strategy)
+
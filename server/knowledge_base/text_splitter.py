@@ -0,0 +1,339 @@
+import copy
+import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from operator import add, sub
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+from server.knowledge_base.utils import CHUNK_OVERLAP, CHUNK_SIZE, TEXT_SEPARATORS, kb_cfg
+
+splitter_cfg = kb_cfg.get('splitter', {})
+semantic_cfg = splitter_cfg.get('semantic', {})
+
+
+class TextChunk(NamedTuple):
+    text: str
+    # 切片在原文中的起始位置(去掉首部空白之后)
+    start: int
+
+
+def _self_overlapping(separator: str) -> bool:
+    """分隔符自身能否重叠出现(如 "\\n\\n" 在 "\\n\\n\\n" 中)，这类分隔符不能直接复用全文的匹配位置"""
+    return any(separator[:i] == separator[-i:] for i in range(1, len(separator)))
+
+
+def token_length_function() -> Callable[[str], int]:
+    """按token估计长度，与向量化分批使用同一估计方法"""
+    from lianxi.doc_tree.tree_embedding import estimate_tokens
+    return estimate_tokens
+
+
+class StreamingTextSplitter:
+    """
+    与 LangChain RecursiveCharacterTextSplitter(keep_separator=True) 切分结果一致的流式切分器
+
+    - 每级分隔符预先编译，对全文只扫描一次得到全部匹配位置，递归切分时只在位置数组上二分查找，
+      不再对每个子串重复 re.search / re.split
+    - 切分过程只处理 (start, end) 区间，不生成中间子串；切片逐个 yield，并带有在原文中的起始位置
+    - length_function 默认按字符计数，与现有配置一致；传入 token_length_function() 时按token预算切分
+    """
+    def __init__(self,
+                 chunk_size: int = CHUNK_SIZE,
+                 chunk_overlap: int = CHUNK_OVERLAP,
+                 separators: Sequence[str] = TEXT_SEPARATORS,
+                 length_function: Callable[[str], int] = None,
+                 keep_separator: str = "start",
+                 strip_whitespace: bool = True):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap({chunk_overlap}) 不能大于 chunk_size({chunk_size})")
+        if keep_separator not in ("start", "end"):
+            raise ValueError(f"keep_separator 只支持 start / end: {keep_separator}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = list(separators)
+        self.length_function = length_function
+        self.keep_separator = keep_separator
+        self.strip_whitespace = strip_whitespace
+        self._patterns = [re.compile(re.escape(s)) if s else None for s in self.separators]
+        self._overlapping = [bool(s) and _self_overlapping(s) for s in self.separators]
+
+    # ---------------- 分隔符匹配 ----------------
+
+    def _starts(self, text: str, level: int, cache: Dict) -> List[int]:
+        """全文中该级分隔符的全部匹配起点，每级只扫描一次"""
+        starts = cache.get(level)
+        if starts is None:
+            separator = self.separators[level]
+            if len(separator) == 1:
+                # 单字符分隔符：全文转为码点数组后向量化比较，所有单字符分隔符共用一次转换
+                codes = cache.get("codes")
+                if codes is None:
+                    codes = cache["codes"] = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+                starts = np.flatnonzero(codes == ord(separator)).tolist()
+            else:
+                # 不会自身重叠的字面量分隔符，str.split 的切分位置就是全部匹配位置，由片段长度累加得到
+                parts = text.split(separator)
+                width = len(separator)
+                starts = list(map(add, accumulate(map(len, parts[:-1])),
+                                  range(0, width * (len(parts) - 1), width)))
+            cache[level] = starts
+        return starts
+
+    def _matches(self, text: str, level: int, a: int, b: int, cache: Dict[int, List[int]]) -> List[int]:
+        """区间 [a, b) 内该级分隔符的匹配起点，与对 text[a:b] 做 finditer 的结果一致"""
+        if self._overlapping[level]:
+            return [m.start() for m in self._patterns[level].finditer(text, a, b)]
+        starts = self._starts(text, level, cache)
+        width = len(self.separators[level])
+        return starts[bisect_left(starts, a):bisect_right(starts, b - width)]
+
+    def _has_match(self, text: str, level: int, a: int, b: int, cache: Dict[int, List[int]]) -> bool:
+        if self._overlapping[level]:
+            return self._patterns[level].search(text, a, b) is not None
+        starts = self._starts(text, level, cache)
+        i = bisect_left(starts, a)
+        return i < len(starts) and starts[i] + len(self.separators[level]) <= b
+
+    def _bounds(self, text: str, level: int, a: int, b: int, cache) -> List[int]:
+        """
+        按该级分隔符切分 [a, b) 的片段边界，第 i 个片段为 [bounds[i], bounds[i + 1])，不含空片段
+        """
+        separator = self.separators[level]
+        if not separator:
+            return list(range(a, b + 1))
+        matches = self._matches(text, level, a, b, cache)
+        if self.keep_separator == "end":
+            width = len(separator)
+            bounds = [a, *(m + width for m in matches), b]
+        else:
+            bounds = [a, *matches, b]
+        # 匹配位置互不重叠，空片段只可能出现在两端
+        if len(bounds) > 1 and bounds[1] == bounds[0]:
+            bounds.pop(0)
+        if len(bounds) > 1 and bounds[-1] == bounds[-2]:
+            bounds.pop()
+        return bounds if len(bounds) > 1 else []
+
+    # ---------------- 切分与合并 ----------------
+
+    def _lengths(self, text: str, bounds: List[int], lo: int, hi: int) -> List[int]:
+        if self.length_function is None:
+            return list(map(sub, bounds[lo + 1:hi + 1], bounds[lo:hi]))
+        return [self.length_function(text[bounds[i]:bounds[i + 1]]) for i in range(lo, hi)]
+
+    def _join(self, text: str, a: int, b: int) -> Optional[TextChunk]:
+        chunk = text[a:b]
+        if self.strip_whitespace:
+            stripped = chunk.lstrip()
+            a += len(chunk) - len(stripped)
+            chunk = stripped.rstrip()
+        return TextChunk(chunk, a) if chunk else None
+
+    def _merge(self, text: str, bounds: List[int], lengths: List[int], lo: int, hi: int) -> Iterator[TextChunk]:
+        """
+        把第 lo 到 hi-1 个连续的小片段合并到 chunk_size 以内，相邻切片保留不超过 chunk_overlap 的重叠。
+        片段在原文中是连续的，当前窗口 [first, i) 对应的原文就是 bounds[first]:bounds[i]
+        """
+        first = lo
+        total = 0
+        for i in range(lo, hi):
+            length = lengths[i - lo]
+            if total + length > self.chunk_size and i > first:
+                chunk = self._join(text, bounds[first], bounds[i])
+                if chunk is not None:
+                    yield chunk
+                while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                    total -= lengths[first - lo]
+                    first += 1
+            total += length
+        if hi > first:
+            chunk = self._join(text, bounds[first], bounds[hi])
+            if chunk is not None:
+                yield chunk
+
+    def _split(self, text: str, a: int, b: int, level: int, cache) -> Iterator[TextChunk]:
+        # 选取区间内出现的第一级分隔符，更细的分隔符留给超长片段继续切分
+        sep_level, next_level = len(self.separators) - 1, None
+        for i in range(level, len(self.separators)):
+            if not self.separators[i]:
+                sep_level = i
+                break
+            if self._has_match(text, i, a, b, cache):
+                sep_level = i
+                next_level = i + 1 if i + 1 < len(self.separators) else None
+                break
+
+        bounds = self._bounds(text, sep_level, a, b, cache)
+        lengths = self._lengths(text, bounds, 0, len(bounds) - 1)
+        good_start = 0
+        for i, length in enumerate(lengths):
+            if length < self.chunk_size:
+                continue
+            # 超长片段之前连续的小片段先合并输出
+            if i > good_start:
+                yield from self._merge(text, bounds, lengths[good_start:i], good_start, i)
+            good_start = i + 1
+            if next_level is None:
+                yield TextChunk(text[bounds[i]:bounds[i + 1]], bounds[i])
+            else:
+                yield from self._split(text, bounds[i], bounds[i + 1], next_level, cache)
+        if len(lengths) > good_start:
+            yield from self._merge(text, bounds, lengths[good_start:], good_start, len(lengths))
+
+    def iter_chunks(self, text: str) -> Iterator[TextChunk]:
+        if not self.separators:
+            raise ValueError("separators 不能为空")
+        if self.length_function is None and len(text) < self.chunk_size:
+            # 短文本合并后就是全文，无需扫描分隔符
+            chunk = self._join(text, 0, len(text))
+            if chunk is not None:
+                yield chunk
+            return
+        yield from self._split(text, 0, len(text), 0, {})
+
+    def split_text(self, text: str) -> List[str]:
+        return [chunk.text for chunk in self.iter_chunks(text)]
+
+    def iter_documents(self, docs: Iterable[Document], add_start_index: bool = True) -> Iterator[Document]:
+        """逐个产出切片，metadata 复制自原文档，start_index 为切片在原文中的真实起始位置"""
+        for doc in docs:
+            for chunk in self.iter_chunks(doc.page_content):
+                metadata = copy.deepcopy(doc.metadata)
+                if add_start_index:
+                    metadata["start_index"] = chunk.start
+                yield Document(page_content=chunk.text, metadata=metadata)
+
+    def split_documents(self, docs: Iterable[Document], add_start_index: bool = True) -> List[Document]:
+        return list(self.iter_documents(docs, add_start_index))
+
+
+# 句末标点(含其后的引号、括号)或换行处断句；英文句点后需跟空白，避免切开小数和缩写
+_SENTENCE_END_RE = re.compile(r"[。！？!?；;…]+[”’」』)）\"']*|\.(?=\s)|\n+")
+
+
+def split_sentences(text: str) -> List[TextChunk]:
+    """按句切分，返回去掉首尾空白的句子及其在原文中的起始位置"""
+    sentences = []
+    start = 0
+    for m in _SENTENCE_END_RE.finditer(text):
+        if m.end() > start:
+            sentences.append((start, m.end()))
+            start = m.end()
+    if start < len(text):
+        sentences.append((start, len(text)))
+
+    result = []
+    for a, b in sentences:
+        raw = text[a:b]
+        stripped = raw.strip()
+        if stripped:
+            result.append(TextChunk(stripped, a + len(raw) - len(raw.lstrip())))
+    return result
+
+
+class SemanticTextSplitter:
+    """
+    按语义边界切分：句子向量化后，在相邻句子相似度明显下降处切开
+
+    - 每个句子与前后 buffer_size 个句子拼接后向量化，降低单个短句带来的噪声
+    - 相邻位置的余弦距离超过全文距离分布的 breakpoint_percentile 分位数时视为语义边界
+    - 切片不短于 min_chunk_size 才在语义边界处切开，超过 max_chunk_size 时强制切开；
+      单个超长句子交给 StreamingTextSplitter 按字符长度继续切分
+    - 多个文档的句子合在一起分批并发向量化，减少嵌入模型的请求次数
+    """
+    def __init__(self,
+                 embed_model,
+                 min_chunk_size: int = semantic_cfg.get('min_chunk_size', 100),
+                 max_chunk_size: int = semantic_cfg.get('max_chunk_size', CHUNK_SIZE),
+                 breakpoint_percentile: float = semantic_cfg.get('breakpoint_percentile', 90),
+                 buffer_size: int = semantic_cfg.get('buffer_size', 1),
+                 max_batch_size: int = semantic_cfg.get('max_batch_size', 256)):
+        if min_chunk_size > max_chunk_size:
+            raise ValueError(f"min_chunk_size({min_chunk_size}) 不能大于 max_chunk_size({max_chunk_size})")
+        self.embed_model = embed_model
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.breakpoint_percentile = breakpoint_percentile
+        self.buffer_size = buffer_size
+        self.max_batch_size = max_batch_size
+        self._fallback = StreamingTextSplitter(chunk_size=max_chunk_size, chunk_overlap=0)
+
+    def _windows(self, sentences: List[TextChunk]) -> List[str]:
+        n = len(sentences)
+        return ["".join(s.text for s in sentences[max(0, i - self.buffer_size):min(n, i + self.buffer_size + 1)])
+                for i in range(n)]
+
+    def _breakpoints(self, vectors: np.ndarray) -> np.ndarray:
+        """返回长度为 n-1 的布尔数组，第 i 个表示第 i 句与第 i+1 句之间是否为语义边界"""
+        if len(vectors) < 2:
+            return np.zeros(0, dtype=bool)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        unit = vectors / np.maximum(norms, 1e-12)
+        distances = 1.0 - (unit[:-1] * unit[1:]).sum(axis=1)
+        return distances > np.percentile(distances, self.breakpoint_percentile)
+
+    def _chunks(self, text: str, sentences: List[TextChunk], breakpoints: np.ndarray) -> Iterator[TextChunk]:
+        start = end = None
+        for i, sentence in enumerate(sentences):
+            s_end = sentence.start + len(sentence.text)
+            if s_end - sentence.start > self.max_chunk_size:
+                # 单个句子超过上限，先输出已累积的内容，再按字符长度切分该句
+                if start is not None:
+                    yield TextChunk(text[start:end], start)
+                    start = None
+                for chunk in self._fallback.iter_chunks(sentence.text):
+                    yield TextChunk(chunk.text, sentence.start + chunk.start)
+                continue
+            if start is not None:
+                boundary = breakpoints[i - 1] and end - start >= self.min_chunk_size
+                if boundary or s_end - start > self.max_chunk_size:
+                    yield TextChunk(text[start:end], start)
+                    start = None
+            if start is None:
+                start = sentence.start
+            end = s_end
+        if start is not None:
+            yield TextChunk(text[start:end], start)
+
+    def split_documents(self, docs: Iterable[Document], add_start_index: bool = True) -> List[Document]:
+        from lianxi.doc_tree.tree_embedding import embed_texts
+
+        docs = list(docs)
+        doc_sentences = [split_sentences(doc.page_content) for doc in docs]
+        windows = [w for sentences in doc_sentences for w in self._windows(sentences)]
+        vectors = embed_texts(self.embed_model, windows, max_batch_size=self.max_batch_size)
+
+        result = []
+        offset = 0
+        for doc, sentences in zip(docs, doc_sentences):
+            breakpoints = self._breakpoints(vectors[offset:offset + len(sentences)])
+            offset += len(sentences)
+            for chunk in self._chunks(doc.page_content, sentences, breakpoints):
+                metadata = copy.deepcopy(doc.metadata)
+                if add_start_index:
+                    metadata["start_index"] = chunk.start
+                result.append(Document(page_content=chunk.text, metadata=metadata))
+        return result
+
+    def split_text(self, text: str) -> List[str]:
+        return [d.page_content for d in self.split_documents([Document(page_content=text)], add_start_index=False)]
+
+
+def make_text_splitter(chunk_size: int = CHUNK_SIZE,
+                       chunk_overlap: int = CHUNK_OVERLAP,
+                       length_unit: str = splitter_cfg.get('length_unit', 'char')) -> StreamingTextSplitter:
+    """
+    Args:
+        length_unit: "char" 按字符计数(与原有配置一致)，"token" 按token估计值计数
+    """
+    if length_unit not in ("char", "token"):
+        raise ValueError(f"不支持的长度单位: {length_unit}")
+    return StreamingTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=TEXT_SEPARATORS,
+        length_function=token_length_function() if length_unit == "token" else None,
+    )
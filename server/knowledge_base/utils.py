@@ -0,0 +1,333 @@
+import os
+os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
+import re
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，知识库写锁只在进程内生效
+    fcntl = None
+
+from langchain.schema import Document
+from langchain_community.document_loaders import Docx2txtLoader, TextLoader, UnstructuredMarkdownLoader
+from langchain_community.vectorstores import FAISS
+from langchain_ollama import OllamaEmbeddings
+
+from configs.config import cfg
+from server.knowledge_base.index_versions import (
+    hot_reload_cfg,
+    publish_vector_store,
+    read_current_version,
+    resolve_vs_dir,
+)
+
+kb_cfg = cfg.get('kb', {})
+
+# 项目根目录
+BASE_PATH = Path(__file__).resolve().parents[2]
+KB_ROOT_PATH = BASE_PATH / kb_cfg.get('root_path', 'knowledge_base')
+
+DEFAULT_VS_TYPE = kb_cfg.get('default_vs_type', 'faiss')
+DEFAULT_EMBED_MODEL = kb_cfg.get('default_embed_model', 'bge-m3:latest')
+CHUNK_SIZE = kb_cfg.get('chunk_size', 500)
+CHUNK_OVERLAP = kb_cfg.get('chunk_overlap', 100)
+SHARDED_VS_TYPE = 'faiss_sharded'
+
+# 中文文档切分时使用的分隔符，与 lianxi/load_text/load_docx.py 保持一致
+TEXT_SEPARATORS = ["\n\n", "\n", "。", "！", "？", "，", ""]
+
+
+# 知识库名称直接作为目录名，只允许字母、数字(含中文)、下划线和中划线
+_KB_NAME_RE = re.compile(r"^[\w\-]+$")
+
+
+def validate_kb_name(kb_name: str) -> str:
+    """知识库名称不能包含路径分隔符或 ..，否则拼接出的路径会越出知识库根目录"""
+    if not kb_name or not _KB_NAME_RE.match(kb_name):
+        raise ValueError(f"知识库名称不合法: {kb_name!r}")
+    return kb_name
+
+
+def get_kb_path(kb_name: str) -> Path:
+    return KB_ROOT_PATH / kb_name
+
+
+def get_doc_path(kb_name: str) -> Path:
+    """知识库原始文件存放目录"""
+    return get_kb_path(kb_name) / 'content'
+
+
+def resolve_doc_file(kb_name: str, file_name: str) -> Path:
+    """
+    知识库中原始文件的绝对路径。file_name 含 ../ 或为绝对路径等越出知识库目录的情况，
+    与文件不存在一样抛出 FileNotFoundError
+    """
+    doc_root = get_doc_path(validate_kb_name(kb_name)).resolve()
+    path = (doc_root / file_name).resolve()
+    if not path.is_relative_to(doc_root) or not path.is_file():
+        raise FileNotFoundError(f"文件不存在: {file_name}")
+    return path
+
+
+def get_vs_path(kb_name: str, vector_name: str = 'vector_store') -> Path:
+    """知识库向量库存放目录"""
+    return get_kb_path(kb_name) / vector_name
+
+
+def get_vs_type_path(kb_name: str, vs_type: str = DEFAULT_VS_TYPE) -> Path:
+    """
+    各类型向量库的存放目录：原始 vector_store，量化 vector_store_<sq8|pq>，分片 vector_store_sharded。
+    原始和量化向量库的目录下是版本目录和 CURRENT 指针，分片向量库每个分片目录各有自己的版本
+    """
+    if vs_type == 'faiss':
+        return get_vs_path(kb_name)
+    if vs_type == SHARDED_VS_TYPE:
+        return get_vs_path(kb_name, 'vector_store_sharded')
+    from server.knowledge_base.quantization import QUANTIZED_VS_TYPES
+    if vs_type not in QUANTIZED_VS_TYPES:
+        raise ValueError(f"不支持的向量库类型: {vs_type}")
+    return get_vs_path(kb_name, f"vector_store_{QUANTIZED_VS_TYPES[vs_type]}")
+
+
+@lru_cache(maxsize=8)
+def get_embeddings(embed_model: str = DEFAULT_EMBED_MODEL) -> OllamaEmbeddings:
+    """同一个嵌入模型只创建一次客户端"""
+    return OllamaEmbeddings(model=embed_model)
+
+
+LOADER_DICT = {
+    '.docx': Docx2txtLoader,
+    '.md': UnstructuredMarkdownLoader,
+}
+
+
+def get_loader_class(file_path: str):
+    """根据文件扩展名选择合适的加载器，默认按纯文本读取"""
+    return LOADER_DICT.get(Path(file_path).suffix.lower(), TextLoader)
+
+
+def load_file_docs(file_path: str) -> List[Document]:
+    loader_class = get_loader_class(file_path)
+    if loader_class is UnstructuredMarkdownLoader:
+        loader = loader_class(file_path, mode="single")
+    elif loader_class is TextLoader:
+        loader = loader_class(file_path, encoding='utf-8')
+    else:
+        loader = loader_class(file_path)
+    return loader.load()
+
+
+class VectorStoreNotFound(FileNotFoundError):
+    """知识库不存在，或还没有入库过文件(没有向量库)"""
+
+
+def vector_store_exists(kb_name: str, vs_type: str = DEFAULT_VS_TYPE) -> bool:
+    if vs_type == SHARDED_VS_TYPE:
+        return os.path.exists(get_vs_type_path(kb_name, vs_type) / 'shards.json')
+    # 量化向量库由原始向量库派生，原始向量库存在即可按需生成
+    return os.path.exists(resolve_vs_dir(get_vs_path(kb_name)) / 'index.faiss')
+
+
+def load_vector_store(kb_name: str,
+                      embed_model: str = DEFAULT_EMBED_MODEL,
+                      vs_type: str = DEFAULT_VS_TYPE,
+                      create: bool = False) -> FAISS:
+    """
+    加载知识库对应的FAISS向量库，不存在时 create 为 True 则创建一个空库(只有入库流程这样做)，否则抛出 VectorStoreNotFound。
+    vs_type 为 faiss_sq8 / faiss_pq 时加载量化向量库，首次使用时由原始向量库生成；
+    vs_type 为 faiss_sharded 时加载按文档ID哈希分片的向量库
+    """
+    validate_kb_name(kb_name)
+    if not create and not vector_store_exists(kb_name, vs_type):
+        raise VectorStoreNotFound(f"知识库 {kb_name} 没有 {vs_type} 向量库")
+    if vs_type == SHARDED_VS_TYPE:
+        from server.knowledge_base.sharded_store import ShardedFAISS
+        return ShardedFAISS.load_or_create(get_vs_type_path(kb_name, vs_type), get_embeddings(embed_model))
+
+    if vs_type != 'faiss':
+        from server.knowledge_base.quantization import QUANTIZED_VS_TYPES, QuantizedFAISS, quantize_vector_store
+        quantized_path = get_vs_type_path(kb_name, vs_type)
+        if os.path.exists(resolve_vs_dir(quantized_path) / 'index.faiss'):
+            return QuantizedFAISS.load_quantized(quantized_path, get_embeddings(embed_model))
+        return quantize_vector_store(load_vector_store(kb_name, embed_model), quantized_path,
+                                     QUANTIZED_VS_TYPES[vs_type])
+
+    return load_flat_vector_store(kb_name, embed_model, create)[0]
+
+
+def load_flat_vector_store(kb_name: str,
+                           embed_model: str = DEFAULT_EMBED_MODEL,
+                           create: bool = False) -> Tuple[FAISS, Optional[str]]:
+    """
+    加载原始faiss向量库的当前版本，返回 (向量库, 版本号)，旧的未分版本目录版本号为 None。
+    不存在时 create 为 True 则创建并发布一个空库，否则抛出 VectorStoreNotFound
+    """
+    vs_path = get_vs_path(validate_kb_name(kb_name))
+    embeddings = get_embeddings(embed_model)
+    version = read_current_version(vs_path)
+    vs_dir = vs_path / version if version else vs_path
+    if os.path.exists(vs_dir / 'index.faiss'):
+        vector_store = FAISS.load_local(vs_dir, embeddings, distance_strategy="METRIC_INNER_PRODUCT",
+                                        allow_dangerous_deserialization=True)
+        return vector_store, version
+    if not create:
+        raise VectorStoreNotFound(f"知识库 {kb_name} 没有向量库")
+
+    # 通过一个占位文档初始化向量库，随后删除
+    doc = Document(page_content="init", metadata={})
+    vector_store = FAISS.from_documents([doc], embeddings, distance_strategy="METRIC_INNER_PRODUCT")
+    ids = list(vector_store.docstore._dict.keys())
+    vector_store.delete(ids)
+    return vector_store, publish_vector_store(vector_store, vs_path)
+
+
+_vs_cache = {}
+# 缓存中原始/量化向量库对应的版本号，热加载线程据此判断是否有新版本(分片向量库由各分片自己记录)
+_vs_versions = {}
+_vs_lock = threading.Lock()
+
+
+def get_vector_store(kb_name: str,
+                     embed_model: str = DEFAULT_EMBED_MODEL,
+                     vs_type: str = DEFAULT_VS_TYPE,
+                     create: bool = False) -> FAISS:
+    """
+    进程内缓存已加载的向量库，避免每次检索都从磁盘加载索引。
+    检索只加载已有的向量库，不存在时抛出 VectorStoreNotFound，不会为未知的知识库名称创建目录
+    """
+    try:
+        validate_kb_name(kb_name)
+    except ValueError as e:
+        raise VectorStoreNotFound(str(e))
+    key = (kb_name, embed_model, vs_type)
+    with _vs_lock:
+        if key not in _vs_cache:
+            if vs_type == 'faiss':
+                _vs_cache[key], _vs_versions[key] = load_flat_vector_store(kb_name, embed_model, create)
+            else:
+                _vs_cache[key] = load_vector_store(kb_name, embed_model, vs_type, create)
+                if vs_type != SHARDED_VS_TYPE:
+                    _vs_versions[key] = _vs_cache[key].version
+        vector_store = _vs_cache[key]
+    if hot_reload_cfg.get('enable', True):
+        from server.knowledge_base.hot_reload import start_reloader
+        start_reloader()
+    return vector_store
+
+
+def drop_cached_vector_store(kb_name: str, embed_model: str = DEFAULT_EMBED_MODEL, vs_type: str = DEFAULT_VS_TYPE):
+    with _vs_lock:
+        _vs_cache.pop((kb_name, embed_model, vs_type), None)
+        _vs_versions.pop((kb_name, embed_model, vs_type), None)
+
+
+# 知识库目录下的写锁文件
+WRITE_LOCK_FILE = ".write.lock"
+
+
+class KBWriteLock:
+    """
+    知识库写锁：同一知识库的写入(加载副本 -> 写入 -> 发布)串行执行，避免两次写入基于同一版本、后发布的覆盖先发布的。
+    进程内用 threading.Lock，进程间对知识库目录下的 .write.lock 加 flock，多个 worker 进程同样互斥；
+    没有 fcntl 的平台(Windows)只在进程内互斥，靠发布时的基础版本检查(StaleVersionError)兜底
+    """
+    def __init__(self, kb_name: str):
+        self.path = get_kb_path(kb_name) / WRITE_LOCK_FILE
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def acquire(self) -> None:
+        self._thread_lock.acquire()
+        if fcntl is None:
+            return
+        try:
+            os.makedirs(self.path.parent, exist_ok=True)
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._thread_lock.release()
+            raise
+
+    def release(self) -> None:
+        try:
+            if self._file is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+                self._file.close()
+                self._file = None
+        finally:
+            self._thread_lock.release()
+
+    def __enter__(self) -> "KBWriteLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release()
+
+
+_kb_write_locks: Dict[str, KBWriteLock] = {}
+
+
+def kb_write_lock(kb_name: str) -> KBWriteLock:
+    with _vs_lock:
+        if kb_name not in _kb_write_locks:
+            _kb_write_locks[kb_name] = KBWriteLock(kb_name)
+        return _kb_write_locks[kb_name]
+
+
+def save_vector_store(kb_name: str,
+                      vector_store: FAISS,
+                      embed_model: str = DEFAULT_EMBED_MODEL,
+                      base_version: Optional[str] = None) -> str:
+    """
+    以新版本保存原始faiss向量库。vector_store 必须是写入方的私有副本，发布后不再修改：
+    缓存中仍是写入所基于的 base_version 时直接替换为该副本，否则由热加载线程加载最新版本。
+    当前版本已不是 base_version(其他进程先发布了)时抛出 StaleVersionError，不覆盖对方的写入
+    """
+    version = publish_vector_store(vector_store, get_vs_path(kb_name), base_version)
+    swap_cached_vector_store(kb_name, embed_model, vector_store, version, base_version)
+    return version
+
+
+def replace_cached_vector_store(kb_name: str, embed_model: str, vs_type: str, vector_store,
+                                version: Optional[str]) -> None:
+    """
+    派生向量库(如量化向量库)重新生成后替换缓存中的引用，只替换已缓存的，正在检索旧对象的请求不受影响
+    """
+    key = (kb_name, embed_model, vs_type)
+    with _vs_lock:
+        if key in _vs_cache:
+            _vs_cache[key] = vector_store
+            _vs_versions[key] = version
+
+
+def cached_vector_store_versions() -> Dict[Tuple[str, str, str], Optional[str]]:
+    with _vs_lock:
+        return dict(_vs_versions)
+
+
+def cached_sharded_stores() -> List:
+    with _vs_lock:
+        return [store for (_, _, vs_type), store in _vs_cache.items() if vs_type == SHARDED_VS_TYPE]
+
+
+def swap_cached_vector_store(kb_name: str, embed_model: str, vector_store: FAISS, version: str,
+                             expected_version: Optional[str], vs_type: str = 'faiss') -> bool:
+    """
+    替换缓存中的原始/量化向量库。只替换引用：已取得旧向量库的检索继续使用旧对象，
+    结束后旧对象没有引用即被释放。缓存版本已被其他写入更新时放弃替换
+    """
+    key = (kb_name, embed_model, vs_type)
+    with _vs_lock:
+        if key not in _vs_cache or _vs_versions.get(key) != expected_version:
+            return False
+        _vs_cache[key] = vector_store
+        _vs_versions[key] = version
+        return True
@@ -0,0 +1,149 @@
+import logging
+import os
+from typing import Dict, Iterable, List, Tuple
+
+from server.knowledge_base.index_versions import resolve_vs_dir
+from server.knowledge_base.quantization import QUANTIZED_VS_TYPES, quantize_vector_store
+from server.knowledge_base.sharded_store import ShardStaging
+from server.knowledge_base.utils import (
+    DEFAULT_EMBED_MODEL,
+    DEFAULT_VS_TYPE,
+    SHARDED_VS_TYPE,
+    get_vector_store,
+    get_vs_type_path,
+    kb_write_lock,
+    load_flat_vector_store,
+    replace_cached_vector_store,
+    save_vector_store,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_quantized_stores(kb_name: str, vector_store, embed_model: str = DEFAULT_EMBED_MODEL) -> None:
+    """
+    量化向量库是只读派生物，原始向量库变化后为已存在的量化向量库发布新版本，再替换缓存中的引用
+    """
+    for vs_type, method in QUANTIZED_VS_TYPES.items():
+        quantized_path = get_vs_type_path(kb_name, vs_type)
+        if os.path.exists(resolve_vs_dir(quantized_path) / 'index.faiss'):
+            quantized = quantize_vector_store(vector_store, quantized_path, method)
+            replace_cached_vector_store(kb_name, embed_model, vs_type, quantized, quantized.version)
+
+
+def rebuild_shards(kb_name: str,
+                   shard_ids: List[int] = None,
+                   embed_model: str = DEFAULT_EMBED_MODEL) -> Dict[int, str]:
+    """
+    逐个重建分片向量库的分片，默认重建全部分片。持有知识库写锁，期间的入库等待重建完成；
+    检索不受影响，每个分片重建完成后立即切换
+
+    Returns:
+        Dict[int, str]: 分片编号 -> 新版本号，不存在的分片不重建
+    """
+    with kb_write_lock(kb_name):
+        store = get_vector_store(kb_name, embed_model, SHARDED_VS_TYPE)
+        store.reload_changed_shards()
+        shard_ids = range(store.num_shards) if shard_ids is None else shard_ids
+        versions = {}
+        for shard_id in shard_ids:
+            version = store.rebuild_shard(shard_id)
+            if version is not None:
+                versions[shard_id] = version
+        return versions
+
+
+class VectorStoreWriter:
+    """
+    一次入库对知识库向量库的写入，检索使用的向量库对象在写入期间不会被修改：
+
+    - 原始faiss向量库：从磁盘加载当前版本作为私有副本写入，正常退出时发布为新版本并替换缓存中的引用
+    - 分片向量库：写入涉及分片的副本，正常退出时把这些分片发布为新版本并替换引用
+
+    写入期间持有知识库写锁(进程内的锁加锁文件)，多个 worker 对同一知识库的写入串行执行；
+    with 块内出错时副本直接丢弃，需要与向量库一起成功或失败的步骤(如写数据库)放在 with 块的最后
+
+    用法:
+        with VectorStoreWriter(kb_name, embed_model, vs_type) as writer:
+            writer.delete(old_ids)
+            writer.add(text_embeddings, metadatas, ids)
+    """
+    def __init__(self, kb_name: str, embed_model: str = DEFAULT_EMBED_MODEL, vs_type: str = DEFAULT_VS_TYPE):
+        self.kb_name = kb_name
+        self.embed_model = embed_model
+        self.sharded = vs_type == SHARDED_VS_TYPE
+        self.vector_store = None
+        self.base_version = None
+        self.ids: List[str] = []
+        self.deleted: List[str] = []
+        self._staged = ShardStaging()
+        self._lock = kb_write_lock(kb_name)
+
+    def __enter__(self) -> "VectorStoreWriter":
+        self._lock.acquire()
+        try:
+            if self.sharded:
+                self.vector_store = get_vector_store(self.kb_name, self.embed_model, SHARDED_VS_TYPE, create=True)
+                # 其他 worker 可能已发布了新的分片版本，副本要基于最新版本复制
+                self.vector_store.reload_changed_shards()
+            else:
+                # 每次写入都从磁盘重新加载，得到的对象不与缓存中的检索向量库共享
+                self.vector_store, self.base_version = load_flat_vector_store(self.kb_name, self.embed_model,
+                                                                              create=True)
+        except BaseException:
+            self._lock.release()
+            raise
+        return self
+
+    def file_doc_ids(self, file_name: str) -> List[str]:
+        """向量库中属于某个文件的文档ID(按 metadata 中的 file_name)，在写锁内读取，不会漏掉刚由其他写入发布的文档"""
+        stores = self.vector_store.shards if self.sharded else [self.vector_store]
+        return [doc_id for store in stores if store is not None
+                for doc_id, doc in store.docstore._dict.items() if doc.metadata.get("file_name") == file_name]
+
+    def delete(self, ids: List[str]) -> None:
+        """从副本中删除文档，随本次写入一起发布；不存在的ID跳过"""
+        ids = list(dict.fromkeys(ids))
+        if self.sharded:
+            self.vector_store.delete(ids, staged=self._staged)
+        else:
+            existing = [i for i in ids if i in self.vector_store.docstore._dict]
+            if existing:
+                self.vector_store.delete(existing)
+        self.deleted.extend(ids)
+
+    def add(self, text_embeddings: Iterable[Tuple[str, List[float]]], metadatas: List[dict], ids: List[str]) -> None:
+        if self.sharded:
+            self.vector_store.add_embeddings(text_embeddings, metadatas, ids, staged=self._staged)
+        else:
+            self.vector_store.add_embeddings(text_embeddings=text_embeddings, metadatas=metadatas, ids=ids)
+        self.ids.extend(ids)
+
+    def commit(self) -> None:
+        if not self.ids and not self.deleted:
+            return
+        if self.sharded:
+            self.vector_store.publish_shards(self._staged)
+            self._staged = ShardStaging()
+            return
+        save_vector_store(self.kb_name, self.vector_store, self.embed_model, self.base_version)
+        refresh_quantized_stores(self.kb_name, self.vector_store, self.embed_model)
+
+    def rollback(self) -> None:
+        """丢弃已写入副本的向量，检索使用的向量库和磁盘上的版本都没有变化"""
+        if self.ids or self.deleted:
+            logger.warning(f"知识库 {self.kb_name} 入库失败，丢弃未发布的 {len(self.ids)} 个向量"
+                           f"和 {len(self.deleted)} 个删除")
+        self.vector_store = None
+        self._staged = ShardStaging()
+        self.ids = []
+        self.deleted = []
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            self._lock.release()
@@ -0,0 +1,58 @@
+import threading
+from collections import deque
+from typing import Callable, Dict
+
+import numpy as np
+
+# 每个直方图保留的最近样本数，分位数按这些样本计算
+HISTOGRAM_WINDOW = 2048
+
+
+class Metrics:
+    """
+    进程内指标：计数器、直方图(最近样本的分位数)，以及按需采集的组件状态
+    """
+    def __init__(self, window: int = HISTOGRAM_WINDOW):
+        self.window = window
+        self._counters: Dict[str, float] = {}
+        self._histograms: Dict[str, deque] = {}
+        self._collectors: Dict[str, Callable[[], Dict]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            samples = self._histograms.get(name)
+            if samples is None:
+                samples = self._histograms[name] = deque(maxlen=self.window)
+            samples.append(value)
+
+    def register_collector(self, name: str, collector: Callable[[], Dict]) -> None:
+        """组件自身维护的统计(如缓存命中率)，在读取指标时调用 collector 获取"""
+        with self._lock:
+            self._collectors[name] = collector
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {name: np.asarray(samples, dtype=np.float64) for name, samples in self._histograms.items()}
+            collectors = dict(self._collectors)
+
+        summary = {}
+        for name, samples in histograms.items():
+            if not len(samples):
+                continue
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99]).tolist()
+            summary[name] = {"count": len(samples), "mean": float(samples.mean()),
+                             "p50": p50, "p95": p95, "p99": p99, "max": float(samples.max())}
+        return {
+            "counters": counters,
+            "histograms": summary,
+            **{name: collector() for name, collector in collectors.items()},
+        }
+
+
+metrics = Metrics()
@@ -0,0 +1,96 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import IntEnum
+from typing import Callable, Dict
+
+from configs.config import cfg
+from server.metrics import metrics
+
+scheduler_cfg = cfg.get('scheduler', {})
+
+
+class Priority(IntEnum):
+    """数值越小优先级越高"""
+    # 用户等待中的请求：查询向量化、检索、重排序
+    INTERACTIVE = 0
+    # 用户触发但可以稍慢的操作：文档目录解析、表格查询
+    NORMAL = 1
+    # 批量后台任务：文件入库、重建索引、批量摘要
+    BULK = 2
+
+
+class WorkScheduler:
+    """
+    按优先级分池执行阻塞任务：每个优先级一个独立线程池，批量任务不会占满交互请求的线程。
+
+    批量任务在批次之间调用 checkpoint()，有更高优先级的任务在排队或执行时暂停让出CPU和GIL，
+    最多暂停 max_pause 秒，避免批量任务在持续的查询压力下饿死
+    """
+    def __init__(self, workers: Dict[Priority, int], max_pause: float = 2.0):
+        self.max_pause = max_pause
+        self._executors = {p: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f"sched_{p.name.lower()}")
+                           for p, n in workers.items()}
+        self._queued = {p: 0 for p in Priority}
+        self._running = {p: 0 for p in Priority}
+        self._cond = threading.Condition()
+
+    def _run(self, priority: Priority, submitted: float, fn: Callable, *args, **kwargs):
+        with self._cond:
+            self._queued[priority] -= 1
+            self._running[priority] += 1
+        metrics.observe(f"scheduler_wait_ms.{priority.name.lower()}", (time.perf_counter() - submitted) * 1000)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._cond:
+                self._running[priority] -= 1
+                self._cond.notify_all()
+
+    def submit(self, priority: Priority, fn: Callable, *args, **kwargs) -> Future:
+        with self._cond:
+            self._queued[priority] += 1
+        return self._executors[priority].submit(self._run, priority, time.perf_counter(), fn, *args, **kwargs)
+
+    async def run(self, priority: Priority, fn: Callable, *args, **kwargs):
+        """在对应优先级的线程池中执行，用法同 asyncio.to_thread(会传递 contextvars)"""
+        ctx = contextvars.copy_context()
+        call = functools.partial(ctx.run, fn, *args, **kwargs)
+        return await asyncio.wrap_future(self.submit(priority, call))
+
+    def _busy_above(self, priority: Priority) -> bool:
+        return any(self._queued[p] or self._running[p] for p in Priority if p < priority)
+
+    def checkpoint(self, priority: Priority = Priority.BULK) -> None:
+        """在批次边界调用：有更高优先级的任务时阻塞等待，直到它们完成或超过 max_pause 秒"""
+        with self._cond:
+            if not self._busy_above(priority):
+                return
+            start = time.monotonic()
+            deadline = start + self.max_pause
+            while self._busy_above(priority):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        metrics.inc(f"scheduler_preemptions.{priority.name.lower()}")
+        metrics.observe(f"scheduler_pause_ms.{priority.name.lower()}", (time.monotonic() - start) * 1000)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {p.name.lower(): {"queued": self._queued[p], "running": self._running[p]} for p in Priority}
+
+
+_workers = scheduler_cfg.get('workers', {})
+scheduler = WorkScheduler(
+    workers={
+        Priority.INTERACTIVE: _workers.get('interactive', 8),
+        Priority.NORMAL: _workers.get('normal', 4),
+        Priority.BULK: _workers.get('bulk', 2),
+    },
+    max_pause=scheduler_cfg.get('max_pause', 2.0),
+)
+metrics.register_collector("scheduler", scheduler.stats)
@@ -233,63 +233,96 @@ async function sendMessage() {
 }
 
 // 流式响应处理
+// 断线时携带 message_id 和 Last-Event-ID 重新请求，服务端从断点续传，不会重新生成回答
+const STREAM_MAX_RESUMES = 3;
+
 async function streamResponse(message, messageId) {
-    try {
-        const response = await fetchWithAuth('/api/chat', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ 
-                message: message,
-                conversation_id: currentChatId
-            })
-        });
+    let currentContent = '';
+    let serverMessageId = null;
+    let lastEventId = null;
+
+    for (let attempt = 0; ; attempt++) {
+        try {
+            const headers = { 'Content-Type': 'application/json' };
+            if (lastEventId !== null) {
+                headers['Last-Event-ID'] = lastEventId;
+            }
+            const response = await fetchWithAuth('/api/chat', {
+                method: 'POST',
+                headers: headers,
+                body: JSON.stringify({
+                    message: message,
+                    conversation_id: currentChatId,
+                    message_id: serverMessageId
+                })
+            });
 
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
+            if (response.status === 429) {
+                const retryAfter = response.headers.get('Retry-After') || '1';
+                updateMessageContent(messageId, `请求过于频繁，请 ${retryAfter} 秒后再试。`, false);
+                return;
+            }
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
 
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-        let buffer = '';
-        let currentContent = '';
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let eventId = null;
 
-        while (true) {
-            const { done, value } = await reader.read();
-            if (done) break;
-            
-            buffer += decoder.decode(value, { stream: true });
-            const lines = buffer.split('\n');
-            buffer = lines.pop() || '';
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) return;
 
-            for (const line of lines) {
-                if (!line.trim()) continue; // 跳过空行
-                
-                try {
-                    if (line.startsWith('data: ')) {
-                        const jsonStr = line.slice(6).trim();
-                        if (!jsonStr) continue; // 跳过空数据
-                        
-                        const data = JSON.parse(jsonStr);
-                        
-                        if (data.text) {
-                            currentContent += data.text;
-                            updateMessageContent(messageId, currentContent, true);
-                            await new Promise(resolve => setTimeout(resolve, 10));
-                        } else if (data.type === 'error') {
-                            currentContent = data.text || data.content || '处理请求时出错';
-                            updateMessageContent(messageId, currentContent, false);
-                            break;
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop() || '';
+
+                for (const line of lines) {
+                    if (!line.trim()) continue; // 跳过空行
+
+                    try {
+                        if (line.startsWith('id: ')) {
+                            eventId = line.slice(4).trim();
+                        } else if (line.startsWith('data: ')) {
+                            const jsonStr = line.slice(6).trim();
+                            if (!jsonStr) continue; // 跳过空数据
+
+                            const data = JSON.parse(jsonStr);
+
+                            if (data.message_id) {
+                                serverMessageId = data.message_id;
+                            } else if (data.text && data.type !== 'error') {
+                                currentContent += data.text;
+                                if (eventId !== null) {
+                                    lastEventId = eventId;
+                                    eventId = null;
+                                }
+                                updateMessageContent(messageId, currentContent, true);
+                                await new Promise(resolve => setTimeout(resolve, 10));
+                            } else if (data.type === 'error') {
+                                currentContent = data.text || data.content || '处理请求时出错';
+                                updateMessageContent(messageId, currentContent, false);
+                                return;
+                            }
                         }
+                    } catch (e) {
+                        console.error('解析SSE数据失败:', e, '原始数据:', line);
                     }
-                } catch (e) {
-                    console.error('解析SSE数据失败:', e, '原始数据:', line);
                 }
             }
+        } catch (error) {
+            // 已拿到消息ID时断线续传，否则按原逻辑报错
+            if (serverMessageId && lastEventId !== null && attempt < STREAM_MAX_RESUMES && error.message !== 'Unauthorized') {
+                console.warn(`流式响应中断，从 ${lastEventId} 处续传:`, error);
+                await new Promise(resolve => setTimeout(resolve, 500 * (attempt + 1)));
+                continue;
+            }
+            console.error('流式响应错误:', error);
+            updateMessageContent(messageId, '抱歉，处理您的请求时出现了错误。请重试。', true);
+            throw error;
         }
-    } catch (error) {
-        console.error('流式响应错误:', error);
-        updateMessageContent(messageId, '抱歉，处理您的请求时出现了错误。请重试。', true);
-        throw error;
     }
 }
 
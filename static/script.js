@@ -126,10 +126,11 @@ async function handleRegister(e) {
 
 
 function checkLoginStatus() {
-    authToken = localStorage.getItem('username');
-    if (authToken) {
-        // Simple check - just show app with stored username
-        showApp({ username: authToken });
+    authToken = localStorage.getItem('authToken');
+    const username = localStorage.getItem('username');
+    if (authToken && username) {
+        // 令牌由服务端校验签名和有效期
+        showApp({ username });
         // 创建新会话
         createNewConversation();
     } else {
@@ -168,7 +169,8 @@ async function handleLogin(e) {
         const data = await response.json();
         
         if (response.ok) {
-            authToken = data.username; // Using username as simple auth token
+            authToken = data.token; // 服务端签发的登录令牌
+            localStorage.setItem('authToken', data.token);
             localStorage.setItem('username', data.username);
             localStorage.setItem('userid', data.id);
             showApp({ username: data.username , userId: data.user_id }); // 显示用户ID
@@ -184,6 +186,7 @@ async function handleLogin(e) {
 
 function handleLogout() {
     authToken = null;
+    localStorage.removeItem('authToken');
     localStorage.removeItem('username');
     localStorage.removeItem('userid');
     elements.logoutBtn.style.display = 'none';
@@ -739,7 +742,7 @@ async function handleFileUpload(event) {
         
         if (response.ok) {
             const result = await response.json();
-            alert(`文件上传成功: ${result.message}`);
+            alert(`文件上传成功: ${result.data.file_name}，共 ${result.data.docs_count} 个切片`);
         } else {
             throw new Error('上传失败');
         }
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试从项目根目录导入模块，与 scripts/ 下脚本的做法一致
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
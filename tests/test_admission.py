@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from server.auth import issue_token, verify_token
+from server.chat.admission import AdmissionController, AdmissionRejected
+
+
+def test_rejected_or_withdrawn_admission_refunds_rate_token():
+    async def run():
+        controller = AdmissionController(rate=0.001, burst=2, max_concurrent=1, max_queue=0, max_queue_wait=1)
+        first = await controller.admit("u")
+        # 并发已满且不允许排队：被拒，令牌退回
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.admit("u")
+        assert rejected.value.reason == "queue_full"
+        controller.release_slot(first)
+
+        # 排队期间相同请求已开始生成：释放名额并退回令牌
+        second = await controller.admit("u")
+        await controller.withdraw("u", second)
+        assert controller.semaphore.active == 0
+
+        # 只有 first 真正启动了生成，消耗一个令牌，还剩一个
+        await controller.admit("u")
+        with pytest.raises(AdmissionRejected) as limited:
+            await controller.check_rate("u")
+        return limited.value.reason
+
+    assert asyncio.run(run()) == "rate_limited"
+
+
+def test_login_token_cannot_be_forged():
+    token = issue_token("user-1")
+    assert verify_token(token) == "user-1"
+    user_id, expires, signature = token.rsplit(".", 2)
+    # 换成别人的用户ID、篡改过期时间、直接传用户名都不能通过校验
+    assert verify_token(f"user-2.{expires}.{signature}") is None
+    assert verify_token(f"{user_id}.{int(expires) + 1}.{signature}") is None
+    assert verify_token("user-1") is None
+    assert verify_token(issue_token("user-1", ttl=-1)) is None
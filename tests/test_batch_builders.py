@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from server.batch.builders import kb_document_items, prompt_items
+
+
+async def collect(items):
+    return [item async for item in items]
+
+
+def test_template_fills_bare_fields():
+    items = asyncio.run(collect(prompt_items([{"id": "a", "variables": {"name": "报销", "n": 3}}],
+                                             template="总结{name}制度，列出{n}条要点。{{原样}}")))
+    assert items[0]["prompt"] == "总结报销制度，列出3条要点。{原样}"
+
+
+@pytest.mark.parametrize("template", [
+    "{name.__class__}",
+    "{name[0]}",
+    "{name!r}",
+    "{name:>20}",
+    "{}",
+    "{0}",
+    "未闭合的 {name",
+])
+def test_template_rejects_non_bare_fields(template):
+    with pytest.raises(ValueError):
+        asyncio.run(collect(prompt_items([{"id": "a", "variables": {"name": "报销"}}], template=template)))
+
+
+def test_missing_variable_is_reported_with_item_id():
+    with pytest.raises(ValueError, match="条目 b"):
+        asyncio.run(collect(prompt_items([{"id": "a", "variables": {"name": "x"}}, {"id": "b", "variables": {}}],
+                                         template="{name}")))
+
+
+@pytest.mark.parametrize("kb_name", ["../outside", "a/b", ".."])
+def test_kb_document_items_rejects_invalid_kb_name(kb_name):
+    with pytest.raises(ValueError):
+        asyncio.run(collect(kb_document_items(kb_name, "kb_summary")))
@@ -0,0 +1,217 @@
+import asyncio
+
+from server.chat.broadcaster import ChatBroadcaster, GenerationStream
+
+
+async def collect(stream: GenerationStream, after: int = 0, load_persisted=None):
+    async def no_persisted():
+        return None
+
+    return [frame async for frame in stream.follow(after, load_persisted or no_persisted)]
+
+
+def test_resume_after_last_event_id_within_ring():
+    async def run():
+        stream = GenerationStream(("c", "q"), ring_size=8)
+        for token in ["你好", "，", "世界"]:
+            stream.publish(token)
+        stream.finish()
+        # 断点落在 token 中间时只补发剩余部分
+        return await collect(stream, after=1)
+
+    assert asyncio.run(run()) == [(5, "好，世界")]
+
+
+def test_ring_keeps_unpersisted_tokens_and_refills_from_db():
+    async def run():
+        stream = GenerationStream(("c", "q"), ring_size=2)
+        tokens = [f"t{i}" for i in range(10)]
+        for token in tokens[:5]:
+            stream.publish(token)
+        # 还没有保存到数据库，超出 ring_size 的token也不能移出
+        assert len(stream.ring) == 5 and stream.ring_start == 0
+
+        persisted = "".join(tokens[:5])
+        stream.mark_persisted(len(persisted))
+        assert len(stream.ring) == 2 and stream.ring_start == 6
+        for token in tokens[5:]:
+            stream.publish(token)
+        stream.finish()
+
+        loads = []
+
+        async def load_persisted():
+            loads.append(1)
+            return persisted
+
+        return await collect(stream, after=2, load_persisted=load_persisted), loads, "".join(tokens)
+
+    frames, loads, answer = asyncio.run(run())
+    assert loads == [1]
+    # 第一帧来自数据库中保存的部分回答，之后从缓冲续传，拼起来正好是断点之后的回答
+    assert frames[0] == (10, answer[2:10])
+    assert "".join(text for _, text in frames) == answer[2:]
+    assert frames[-1][0] == len(answer)
+
+
+def test_slow_subscriber_falling_behind_ring_is_refilled():
+    async def run():
+        stream = GenerationStream(("c", "q"), ring_size=1)
+        stream.publish("a")
+        saved = []
+
+        async def load_persisted():
+            return "".join(saved)
+
+        frames = []
+        agen = stream.follow(0, load_persisted)
+        frames.append(await agen.__anext__())
+        # 订阅者读取第一帧期间又生成并保存了多个token，未读的部分已移出缓冲
+        for token in "bcd":
+            stream.publish(token)
+        saved.extend("abcd")
+        stream.mark_persisted(4)
+        stream.publish("e")
+        stream.finish()
+        frames.extend([frame async for frame in agen])
+        return frames
+
+    # "bcd" 从数据库补齐，"e" 仍在缓冲中
+    assert asyncio.run(run()) == [(1, "a"), (4, "bcd"), (5, "e")]
+
+
+def test_duplicate_request_joins_running_generation():
+    async def run():
+        broadcaster = ChatBroadcaster(linger=0, cancel_on_disconnect=False, ring_size=4)
+        release = asyncio.Event()
+        calls = []
+
+        async def producer(stream: GenerationStream):
+            calls.append(1)
+            stream.publish("第一段")
+            await release.wait()
+            stream.publish("第二段")
+
+        first, created = broadcaster.get_or_start("c", "问题", producer)
+        second, joined = broadcaster.get_or_start("c", " 问题 ", producer)
+        await asyncio.sleep(0)
+        release.set()
+        frames = await collect(second)
+        await first.task
+        return created, joined, first is second, calls, frames
+
+    created, joined, same, calls, frames = asyncio.run(run())
+    assert created and not joined and same
+    assert calls == [1]
+    assert "".join(text for _, text in frames) == "第一段第二段"
+
+
+def test_tokens_coalesce_until_max_chars():
+    async def run():
+        stream = GenerationStream(("c", "q"), ring_size=64)
+        stream.publish("a")
+        agen = stream.subscribe(0, flush_interval=10, max_chars=4)
+        # 第一帧立即发出
+        frames = [await agen.__anext__()]
+        pending = asyncio.ensure_future(agen.__anext__())
+        for token in "bc":
+            stream.publish(token)
+        await asyncio.sleep(0.01)
+        # 缓冲不足 max_chars 且未到 flush_interval，不发帧
+        assert not pending.done()
+        for token in "de":
+            stream.publish(token)
+        frames.append(await pending)
+        stream.publish("f")
+        stream.finish()
+        # 生成结束时剩余的文本立即发出
+        frames.extend([frame async for frame in agen])
+        return frames
+
+    assert asyncio.run(run()) == [(1, "a"), (5, "bcde"), (6, "f")]
+
+
+def test_tokens_flush_after_interval():
+    async def run():
+        loop = asyncio.get_running_loop()
+        stream = GenerationStream(("c", "q"), ring_size=64)
+        stream.publish("a")
+        agen = stream.subscribe(0, flush_interval=0.05)
+        first = await agen.__anext__()
+        stream.publish("b")
+        stream.publish("c")
+        started = loop.time()
+        second = await agen.__anext__()
+        elapsed = loop.time() - started
+        await agen.aclose()
+        return first, second, elapsed
+
+    first, second, elapsed = asyncio.run(run())
+    assert first == (1, "a")
+    assert second == (3, "bc")
+    assert elapsed >= 0.04
+
+
+async def endless_producer(stream: GenerationStream):
+    stream.publish("开始")
+    await asyncio.Event().wait()
+
+
+def test_generation_cancelled_when_all_clients_disconnect():
+    async def run():
+        broadcaster = ChatBroadcaster(linger=0, cancel_grace=0.01)
+        stream, _ = broadcaster.get_or_start("c", "问题", endless_producer)
+        agen = stream.subscribe()
+        first = await agen.__anext__()
+        await agen.aclose()
+        await asyncio.wait_for(asyncio.shield(stream.task), 1)
+        return first, stream, broadcaster.get("c", "问题"), broadcaster.get_by_message(stream.message_id)
+
+    first, stream, by_key, by_message = asyncio.run(run())
+    assert first == (2, "开始")
+    assert stream.cancelled and stream.done
+    assert stream.wasted_tokens == 0
+    # 被取消的生成立即移除，重试时重新生成
+    assert by_key is None and by_message is None
+
+
+def test_reconnect_within_grace_keeps_generation():
+    async def run():
+        broadcaster = ChatBroadcaster(linger=0, cancel_grace=0.05)
+        stream, _ = broadcaster.get_or_start("c", "问题", endless_producer)
+        agen = stream.subscribe()
+        await agen.__anext__()
+        await agen.aclose()
+        # 宽限期内断点续传重连
+        resumed = stream.subscribe(after=2)
+        pending = asyncio.ensure_future(resumed.__anext__())
+        await asyncio.sleep(0.1)
+        cancelled = stream.cancelled or stream.task.done()
+        stream.publish("继续")
+        frame = await pending
+        await resumed.aclose()
+        stream.task.cancel()
+        return cancelled, frame
+
+    cancelled, frame = asyncio.run(run())
+    assert not cancelled
+    assert frame == (4, "继续")
+
+
+def test_no_cancel_when_disabled():
+    async def run():
+        broadcaster = ChatBroadcaster(linger=0, cancel_on_disconnect=False, cancel_grace=0)
+        stream, _ = broadcaster.get_or_start("c", "问题", endless_producer)
+        agen = stream.subscribe()
+        await agen.__anext__()
+        await agen.aclose()
+        await asyncio.sleep(0.02)
+        stream.publish("没人接收")
+        running = not stream.task.done()
+        stream.task.cancel()
+        return running, stream.wasted_tokens
+
+    running, wasted = asyncio.run(run())
+    assert running
+    # 没有订阅者期间生成的token计为浪费
+    assert wasted == 1
@@ -0,0 +1,99 @@
+import docx
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+from server.knowledge_base.docx_tables import (
+    TABLE_ROW_BLOCK,
+    TEXT_BLOCK,
+    TableRow,
+    iter_docx_blocks,
+    iter_docx_table_docs,
+)
+
+
+def mark_header(row) -> None:
+    """设置 "标题行重复"(w:tblHeader)"""
+    tr_pr = row._tr.get_or_add_trPr()
+    tr_pr.append(OxmlElement("w:tblHeader"))
+
+
+def make_docx(path) -> str:
+    """
+    正文段落 + 一个表格：
+    第 0、1 行为两级表头("成绩" 横跨 "语文"/"数学" 两列，"姓名" 纵向合并)，
+    数据行中 "班级" 列纵向合并、备注横向合并
+    """
+    document = docx.Document()
+    document.add_paragraph("学生成绩说明")
+    document.add_paragraph("表1 期中成绩")
+    table = document.add_table(rows=5, cols=4)
+    values = [
+        ["班级", "姓名", "成绩", ""],
+        ["", "", "语文", "数学"],
+        ["一班", "张三", "90", "85"],
+        ["", "李四", "缺考", ""],
+        ["二班", "王五", "70", "95"],
+    ]
+    for i, row in enumerate(values):
+        for j, value in enumerate(row):
+            if value:
+                table.cell(i, j).text = value
+    # 表头：成绩横向合并，班级、姓名纵向合并
+    table.cell(0, 2).merge(table.cell(0, 3))
+    table.cell(0, 0).merge(table.cell(1, 0))
+    table.cell(0, 1).merge(table.cell(1, 1))
+    # 数据：一班纵向合并，缺考横向合并
+    table.cell(2, 0).merge(table.cell(3, 0))
+    table.cell(3, 2).merge(table.cell(3, 3))
+    mark_header(table.rows[0])
+    mark_header(table.rows[1])
+    document.add_paragraph("表后说明")
+    file_path = str(path / "scores.docx")
+    document.save(file_path)
+    return file_path
+
+
+def test_blocks_expand_merged_cells(tmp_path):
+    blocks = list(iter_docx_blocks(make_docx(tmp_path)))
+    assert blocks[:2] == ["学生成绩说明", "表1 期中成绩"]
+    assert blocks[-1] == "表后说明"
+    rows = blocks[2:-1]
+    assert all(isinstance(r, TableRow) for r in rows)
+    assert [r.row_index for r in rows] == [0, 1, 2, 3, 4]
+    assert [r.is_header for r in rows] == [True, True, False, False, False]
+    # 横向合并在每一列重复，纵向合并沿用上一行的值
+    assert rows[0].cells == ["班级", "姓名", "成绩", "成绩"]
+    assert rows[1].cells == ["班级", "姓名", "语文", "数学"]
+    assert rows[3].cells == ["一班", "李四", "缺考", "缺考"]
+
+
+def test_table_docs_use_merged_headers(tmp_path):
+    file_path = make_docx(tmp_path)
+    docs = list(iter_docx_table_docs(file_path, header_rows=1))
+    assert [d.metadata["block"] for d in docs] == [TEXT_BLOCK] + [TABLE_ROW_BLOCK] * 3 + [TEXT_BLOCK]
+    assert docs[0].page_content == "学生成绩说明\n\n表1 期中成绩"
+
+    rows = docs[1:4]
+    assert all(d.metadata["table_title"] == "表1 期中成绩" for d in rows)
+    # 第 1 行标记了标题行重复，即使 header_rows=1 也作为表头，两级表头合并为 "成绩/语文"
+    assert rows[0].metadata["columns"] == {"班级": "一班", "姓名": "张三", "成绩/语文": "90", "成绩/数学": "85"}
+    assert rows[0].page_content == "班级: 一班\n姓名: 张三\n成绩/语文: 90\n成绩/数学: 85"
+    assert rows[1].metadata["columns"]["班级"] == "一班"
+    assert rows[1].metadata["columns"]["成绩/数学"] == "缺考"
+    assert [d.metadata["row_index"] for d in rows] == [2, 3, 4]
+
+
+def test_header_rows_without_marker(tmp_path):
+    document = docx.Document()
+    table = document.add_table(rows=3, cols=2)
+    for i, row in enumerate([["名称", "数量"], ["苹果", "3"], ["香蕉", "5"]]):
+        for j, value in enumerate(row):
+            table.cell(i, j).text = value
+    file_path = str(tmp_path / "plain.docx")
+    document.save(file_path)
+
+    docs = list(iter_docx_table_docs(file_path, header_rows=1))
+    assert [d.metadata["columns"] for d in docs] == [{"名称": "苹果", "数量": "3"}, {"名称": "香蕉", "数量": "5"}]
+    # 不指定表头时列名为 "列N"
+    docs = list(iter_docx_table_docs(file_path, header_rows=0))
+    assert docs[0].metadata["columns"] == {"列1": "名称", "列2": "数量"}
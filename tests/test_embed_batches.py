@@ -0,0 +1,57 @@
+import threading
+import time
+
+from lianxi.doc_tree.tree_embedding import embed_batches
+from server.scheduler import Priority, WorkScheduler
+
+
+class FakeEmbeddings:
+    def __init__(self, delay: float = 0.02):
+        self.delay = delay
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        return [[float(len(t)), 1.0] for t in texts]
+
+
+def test_in_flight_batches_are_bounded():
+    embeddings = FakeEmbeddings()
+    texts = [f"文本{i}" for i in range(40)]
+    batches = [list(range(i, i + 2)) for i in range(0, 40, 2)]
+    results = list(embed_batches(embeddings, texts, batches, max_workers=3))
+    assert sorted(i for batch, _ in results for i in batch) == list(range(40))
+    assert embeddings.max_in_flight <= 3
+
+
+def test_pending_interactive_task_stops_new_submissions():
+    scheduler = WorkScheduler({p: 2 for p in Priority}, max_pause=10)
+    release = threading.Event()
+    interactive = scheduler.submit(Priority.INTERACTIVE, release.wait)
+    time.sleep(0.05)
+
+    embeddings = FakeEmbeddings()
+    texts = [f"文本{i}" for i in range(12)]
+    batches = [[i] for i in range(12)]
+    results = []
+    consumer = threading.Thread(target=lambda: results.extend(
+        embed_batches(embeddings, texts, batches, max_workers=2,
+                      before_submit=lambda: scheduler.checkpoint(Priority.BULK))))
+    consumer.start()
+    time.sleep(0.3)
+    # 交互任务未完成前一个批次都没有发出
+    assert embeddings.calls == 0
+
+    release.set()
+    interactive.result(timeout=1)
+    consumer.join(timeout=5)
+    assert embeddings.calls == 12 and len(results) == 12
@@ -0,0 +1,42 @@
+from lianxi.doc_tree.doc_tree import TreeBuilder
+from lianxi.load_text.file_parse.fast_parse import parse_file_fast
+
+
+def write_markdown(tmp_path, text: str) -> str:
+    path = tmp_path / "doc.md"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def titles(doc: dict):
+    return [(e.text, e.metadata.category_depth) for e in doc["elements"] if e.category == "Title"]
+
+
+def test_markdown_blocks_and_parent_ids(tmp_path):
+    doc = parse_file_fast(write_markdown(tmp_path, (
+        "# 第一章\n\n正文 **加粗** [链接](http://a)\n\n"
+        "## 1.1 小节\n\n- 列表项\n\n| 列 | 值 |\n|---|---|\n| a | 1 |\n\n"
+        "```\n# 代码里的井号\n```\n"
+    )))
+    categories = [e.category for e in doc["elements"]]
+    assert categories == ["Title", "NarrativeText", "Title", "ListItem", "Table", "NarrativeText"]
+    chapter, body, section, item, table, code = doc["elements"]
+    assert body.text == "正文 加粗 链接"
+    assert table.text == "列 值\na 1"
+    assert code.text == "# 代码里的井号"
+    assert body.metadata.parent_id == chapter.id
+    assert section.metadata.parent_id == chapter.id
+    assert item.metadata.parent_id == table.metadata.parent_id == section.id
+
+
+def test_heading_shallower_than_first_heading_builds_tree(tmp_path):
+    doc = parse_file_fast(write_markdown(tmp_path, (
+        "## 前言\n\n说明\n\n# 第一章\n\n### 1.1.1 跳级标题\n\n内容\n\n## 1.2 小节\n\n内容2\n"
+    )))
+    assert titles(doc) == [("前言", 0), ("第一章", 0), ("1.1.1 跳级标题", 1), ("1.2 小节", 1)]
+
+    root = TreeBuilder(doc["file_path"], doc=doc).build_tree().root
+    assert [n.title for n in root.children] == ["前言", "第一章"]
+    chapter = root.children[1]
+    assert [n.title for n in chapter.children] == ["1.1.1 跳级标题", "1.2 小节"]
+    assert chapter.children[0].content == "内容\n"
@@ -0,0 +1,47 @@
+import pytest
+
+import server.knowledge_base.utils as kb_utils
+
+
+@pytest.fixture
+def kb_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(kb_utils, "KB_ROOT_PATH", tmp_path)
+    content = tmp_path / "kb1" / "content"
+    content.mkdir(parents=True)
+    (content / "a.docx").write_text("x")
+    (tmp_path / "secret.txt").write_text("s")
+    return tmp_path
+
+
+def test_resolve_doc_file_inside_kb(kb_root):
+    assert kb_utils.resolve_doc_file("kb1", "a.docx") == (kb_root / "kb1" / "content" / "a.docx").resolve()
+
+
+@pytest.mark.parametrize("kb_name, file_name", [
+    ("kb1", "../../secret.txt"),
+    ("kb1", "/etc/passwd"),
+    ("kb1", "missing.docx"),
+    ("kb2", "a.docx"),
+])
+def test_resolve_doc_file_rejects_outside_or_missing(kb_root, kb_name, file_name):
+    with pytest.raises(FileNotFoundError):
+        kb_utils.resolve_doc_file(kb_name, file_name)
+
+
+@pytest.mark.parametrize("kb_name", ["..", "kb1/../kb1", "", "a/b", "a\\b"])
+def test_validate_kb_name_rejects_path_parts(kb_name):
+    with pytest.raises(ValueError):
+        kb_utils.validate_kb_name(kb_name)
+
+
+@pytest.mark.parametrize("kb_name, file_name", [
+    ("kb1", "../../secret.txt"),
+    ("kb1", "/etc/passwd"),
+    ("kb1", ".."),
+    ("../kb1", "a.docx"),
+])
+def test_table_rows_path_rejects_path_parts(kb_root, kb_name, file_name):
+    from server.knowledge_base.docx_tables import lookup_table_rows
+
+    with pytest.raises(ValueError):
+        lookup_table_rows(kb_name, {}, file_name=file_name)
@@ -0,0 +1,35 @@
+import asyncio
+
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.prompt_values import StringPromptValue
+
+import server.chat.model_router as model_router
+from server.chat.model_router import Backend, ModelRouter
+
+
+def fake_create_chat_model(provider, model, base_url=None, **kwargs):
+    if provider == "deepseek":
+        # 与未设置 DEEPSEEK_API_KEY 时 ChatDeepSeek 的校验错误一样，在创建客户端时抛出
+        raise ValueError("DEEPSEEK_API_KEY 未设置")
+    return FakeListChatModel(responses=["本地模型的回答"])
+
+
+async def collect(router: ModelRouter, meta: dict):
+    return [token async for token in router.astream(StringPromptValue(text="报销流程"), meta=meta)]
+
+
+def test_client_creation_failure_falls_back_to_next_backend(monkeypatch):
+    monkeypatch.setattr(model_router, "create_chat_model", fake_create_chat_model)
+    backends = {
+        "deepseek": Backend("deepseek", provider="deepseek", model="deepseek-chat"),
+        "ollama": Backend("ollama", provider="ollama", model="qwen2.5"),
+    }
+    router = ModelRouter(backends, hedge=False)
+    meta = {}
+    tokens = asyncio.run(collect(router, meta))
+
+    assert "".join(tokens) == "本地模型的回答"
+    assert meta["backend"] == "ollama"
+    assert meta["attempted"] == ["deepseek", "ollama"]
+    assert backends["deepseek"].failures == 1
+    assert all(b.in_flight == 0 for b in backends.values())
@@ -0,0 +1,43 @@
+import asyncio
+from types import SimpleNamespace
+
+import faiss
+from langchain.schema import Document
+
+import server.knowledge_base.kb_search as kb_search
+
+
+def fake_store(metric_type: int, results):
+    return SimpleNamespace(index=SimpleNamespace(metric_type=metric_type), results=results)
+
+
+def run_multi_kb(monkeypatch, stores):
+    monkeypatch.setattr(kb_search, "embed_query", lambda query, embed_model: [0.0])
+    monkeypatch.setattr(kb_search, "get_vector_store", lambda kb_name, embed_model, vs_type: stores[kb_name])
+    monkeypatch.setattr(kb_search, "search_by_vector",
+                        lambda store, query_vector, k, score_threshold, metadata_filter: store.results[:k])
+    kbs = [{"kb_name": name} for name in stores]
+    return asyncio.run(kb_search.search_multi_kb("报销流程", kbs, top_k=4))
+
+
+def test_weak_only_kb_does_not_tie_with_strong_kb(monkeypatch):
+    strong = [(Document(page_content="强匹配"), 0.92), (Document(page_content="一般"), 0.55)]
+    weak = [(Document(page_content="弱匹配1"), 0.21), (Document(page_content="弱匹配2"), 0.18)]
+    result = run_multi_kb(monkeypatch, {
+        "strong_kb": fake_store(faiss.METRIC_INNER_PRODUCT, strong),
+        "weak_kb": fake_store(faiss.METRIC_INNER_PRODUCT, weak),
+    })
+    ranked = [(s["kb_name"], s["content"]) for s in result["sources"]]
+    assert ranked == [("strong_kb", "强匹配"), ("strong_kb", "一般"), ("weak_kb", "弱匹配1"), ("weak_kb", "弱匹配2")]
+    top_weak = next(s for s in result["sources"] if s["kb_name"] == "weak_kb")
+    assert top_weak["score"] < 0.5
+
+
+def test_l2_and_inner_product_share_scale(monkeypatch):
+    # 平方L2距离 0.2 对应余弦 0.9，应排在内积 0.5 之前
+    result = run_multi_kb(monkeypatch, {
+        "ip_kb": fake_store(faiss.METRIC_INNER_PRODUCT, [(Document(page_content="ip"), 0.5)]),
+        "l2_kb": fake_store(faiss.METRIC_L2, [(Document(page_content="l2"), 0.2)]),
+    })
+    assert [s["kb_name"] for s in result["sources"]] == ["l2_kb", "ip_kb"]
+    assert abs(result["sources"][0]["score"] - 0.9) < 1e-6
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.embeddings import FakeEmbeddings
+
+from server.knowledge_base.metadata_filter import filtered_search_by_vector
+from server.knowledge_base.quantization import quantize_vector_store
+
+DIM = 16
+
+
+def build_stores(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(200, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    texts = [f"段落{i}" for i in range(len(vectors))]
+    metadatas = [{"source": f"/docs/file{i % 4}.docx"} for i in range(len(vectors))]
+    store = FAISS.from_embeddings(list(zip(texts, vectors.tolist())), FakeEmbeddings(size=DIM),
+                                  metadatas=metadatas, distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT)
+    quantized = quantize_vector_store(store, tmp_path / "faiss_pq", "pq", pq_m=4, pq_nbits=4)
+    query = rng.normal(size=DIM).astype(np.float32)
+    return vectors, quantized, (query / np.linalg.norm(query)).tolist()
+
+
+def assert_exact(results, vectors, query):
+    assert results
+    for doc, score in results:
+        position = int(doc.page_content[2:])
+        assert abs(score - float(vectors[position] @ np.asarray(query, dtype=np.float32))) < 1e-5
+
+
+def test_bitmap_filter_rescores_with_flat_vectors(tmp_path):
+    vectors, quantized, query = build_stores(tmp_path)
+    results = filtered_search_by_vector(quantized, query, {"file_name": "file1.docx"}, k=5)
+    assert all(doc.metadata["source"].endswith("file1.docx") for doc, _ in results)
+    assert_exact(results, vectors, query)
+    expected = sorted((i for i in range(len(vectors)) if i % 4 == 1),
+                      key=lambda i: -float(vectors[i] @ np.asarray(query, dtype=np.float32)))[:5]
+    assert [int(doc.page_content[2:]) for doc, _ in results] == expected
+
+
+def test_langchain_filter_rescores_with_flat_vectors(tmp_path):
+    vectors, quantized, query = build_stores(tmp_path)
+    results = quantized.similarity_search_with_score_by_vector(
+        query, k=5, filter=lambda metadata: metadata["source"].endswith("file2.docx"), fetch_k=80)
+    assert all(doc.metadata["source"].endswith("file2.docx") for doc, _ in results)
+    assert_exact(results, vectors, query)
+
+
+def test_quantized_store_rejects_writes(tmp_path):
+    from server.knowledge_base.quantization import ReadOnlyVectorStore
+
+    _, quantized, query = build_stores(tmp_path)
+    with pytest.raises(ReadOnlyVectorStore):
+        quantized.add_embeddings([("新文本", query)])
+    with pytest.raises(ReadOnlyVectorStore):
+        quantized.add_texts(["新文本"])
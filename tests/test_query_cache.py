@@ -0,0 +1,28 @@
+import pytest
+
+import server.knowledge_base.query_cache as query_cache
+
+
+class RecordingEmbeddings:
+    def __init__(self):
+        self.queries = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return [float(len(self.queries))]
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    embeddings = RecordingEmbeddings()
+    monkeypatch.setattr(query_cache, "get_embeddings", lambda embed_model: embeddings)
+    monkeypatch.setattr(query_cache, "_query_cache", query_cache.QueryEmbeddingCache(max_size=10))
+    monkeypatch.setitem(query_cache.query_cache_cfg, "enable", True)
+    return embeddings
+
+
+def test_miss_embeds_original_query_and_variants_hit(embeddings):
+    first = query_cache.embed_query("  差旅报销流程是什么？", embed_model="m")
+    second = query_cache.embed_query("差旅报销流程是什么", embed_model="m")
+    assert embeddings.queries == ["  差旅报销流程是什么？"]
+    assert first == second
@@ -0,0 +1,86 @@
+import time
+
+from langchain.schema import Document
+
+from server.knowledge_base.reranker import CrossEncoderReranker
+
+# 模拟推理耗时：与 padding 后的token数成正比
+SECONDS_PER_TOKEN = 2e-6
+
+
+class FakeReranker(CrossEncoderReranker):
+    def __init__(self, **kwargs):
+        super().__init__(cache_size=1000, **kwargs)
+        self._model = object()
+        self.predicted = 0
+
+    def _predict(self, pairs):
+        longest = max(len(q) + len(t) for q, t in pairs)
+        time.sleep(len(pairs) * min(longest, self.max_length) * SECONDS_PER_TOKEN)
+        self.predicted += len(pairs)
+        return [0.5] * len(pairs)
+
+
+def calibrated(**kwargs) -> FakeReranker:
+    reranker = FakeReranker(**kwargs)
+    reranker._predict_batches("校准", [["样" * 128] * reranker.batch_size], deadline=float('inf'))
+    reranker.predicted = 0
+    return reranker
+
+
+def test_budget_checked_before_first_batch():
+    reranker = calibrated(batch_size=4, max_length=512)
+    texts = ["长" * 500] * 8
+    scores, status = reranker.score("问题", texts, deadline=time.perf_counter() + 0.001)
+    assert scores is None and status == "budget_exceeded"
+    assert reranker.predicted == 0
+
+
+def test_long_tail_batches_counted_up_front():
+    # 短文本批次很快，长文本批次排在最后；只按单批耗时估计会先做完短批次再超时
+    reranker = calibrated(batch_size=4, max_length=512)
+    texts = ["短" * 10] * 12 + ["长" * 500] * 12
+    short_only = 3 * 4 * 14 * SECONDS_PER_TOKEN
+    budget = short_only * 3
+    scores, status = reranker.score("问题", texts, deadline=time.perf_counter() + budget)
+    assert status == "budget_exceeded"
+    assert reranker.predicted == 0
+
+
+def test_applied_within_budget():
+    reranker = calibrated(batch_size=4, max_length=512)
+    texts = ["短" * 10] * 8
+    scores, status = reranker.score("问题", texts, deadline=time.perf_counter() + 5)
+    assert status == "applied" and len(scores) == 8
+
+
+class SlowReranker(FakeReranker):
+    """校准后每批额外耗时 delay 秒，分数由文本决定"""
+    def __init__(self, scores, **kwargs):
+        super().__init__(**kwargs)
+        self.scores = scores
+        self.delay = 0.0
+
+    def _predict(self, pairs):
+        time.sleep(self.delay)
+        self.predicted += len(pairs)
+        return [self.scores.get(t, 0.0) for _, t in pairs]
+
+
+def test_partial_scores_merged_with_retrieval_order():
+    # 检索顺序中奇数位置是短文本，按长度分批时先打分
+    texts = ["长" * (100 + i) if i % 2 == 0 else "短" * i for i in range(8)]
+    scores = {texts[1]: 0.1, texts[3]: 0.4, texts[5]: 0.2, texts[7]: 0.9}
+    reranker = SlowReranker(scores, batch_size=4, max_length=512)
+    reranker._predict_batches("校准", [["样" * 128] * reranker.batch_size], deadline=float('inf'))
+    reranker.predicted = 0
+    # 预估耗时很短，但第一批实际用掉了全部预算，第二批不再推理
+    reranker.delay = 0.05
+    docs = [(Document(page_content=t), float(i)) for i, t in enumerate(texts)]
+
+    ranked, info = reranker.rerank("问题", docs, top_k=6, budget_ms=20)
+    assert info["status"] == "partial" and info["scored"] == 4
+    assert reranker.predicted == 4
+    # 已打分的切片在位置 1、3、5、7 之间按分数重排，未打分的切片保持检索顺序和分数
+    assert [(d.page_content, s) for d, s in ranked] == [
+        (texts[0], 0.0), (texts[7], 0.9), (texts[2], 2.0), (texts[3], 0.4), (texts[4], 4.0), (texts[5], 0.2)]
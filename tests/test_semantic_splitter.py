@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from langchain.schema import Document
+
+from server.knowledge_base.text_splitter import SemanticTextSplitter, split_sentences
+
+TOPICS = ["苹果", "汽车", "天气"]
+
+
+class TopicEmbeddings:
+    """按句中出现的主题词生成向量，同一主题的句子向量相同，不同主题正交"""
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        vectors = np.zeros((len(texts), len(TOPICS)), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for j, topic in enumerate(TOPICS):
+                vectors[i, j] = text.count(topic)
+        return vectors.tolist()
+
+
+APPLE = "苹果很甜。苹果是红色的。我喜欢吃苹果。苹果产自山东。"
+CAR = "汽车需要加油。汽车在路上跑。这辆汽车很新。"
+WEATHER = "今天天气晴朗！明天天气转阴？"
+
+
+def make_splitter(embeddings, **kwargs):
+    kwargs.setdefault("min_chunk_size", 1)
+    kwargs.setdefault("max_chunk_size", 500)
+    kwargs.setdefault("buffer_size", 0)
+    return SemanticTextSplitter(embeddings, **kwargs)
+
+
+def test_split_sentences_keeps_offsets():
+    text = " 第一句。\n第二句！“引号”？ 3.14 是小数. end"
+    sentences = split_sentences(text)
+    assert [s.text for s in sentences] == ["第一句。", "第二句！", "“引号”？", "3.14 是小数.", "end"]
+    for s in sentences:
+        assert text[s.start:s.start + len(s.text)] == s.text
+
+
+def test_splits_at_topic_boundaries():
+    splitter = make_splitter(TopicEmbeddings(), breakpoint_percentile=50)
+    assert splitter.split_text(APPLE + CAR + WEATHER) == [APPLE, CAR, WEATHER]
+
+
+def test_min_chunk_size_defers_boundary():
+    # 苹果部分不足 min_chunk_size，语义边界处不切开
+    splitter = make_splitter(TopicEmbeddings(), breakpoint_percentile=50, min_chunk_size=len(APPLE) + 1)
+    assert splitter.split_text(APPLE + CAR + WEATHER) == [APPLE + CAR, WEATHER]
+
+
+def test_max_chunk_size_forces_split():
+    text = APPLE * 4
+    splitter = make_splitter(TopicEmbeddings(), max_chunk_size=30)
+    chunks = splitter.split_text(text)
+    assert "".join(chunks) == text
+    assert all(len(c) <= 30 for c in chunks)
+    assert len(chunks) > 1
+
+
+def test_long_sentence_falls_back_to_character_split():
+    long_sentence = "苹果" * 40 + "。"
+    text = CAR + long_sentence + WEATHER
+    docs = make_splitter(TopicEmbeddings(), max_chunk_size=30).split_documents([Document(page_content=text)])
+    assert all(len(d.page_content) <= 30 for d in docs)
+    assert "".join(d.page_content for d in docs) == text
+    for d in docs:
+        start = d.metadata["start_index"]
+        assert text[start:start + len(d.page_content)] == d.page_content
+
+
+def test_documents_embedded_together():
+    embeddings = TopicEmbeddings()
+    docs = [Document(page_content=APPLE + CAR, metadata={"file_name": "a.txt"}),
+            Document(page_content=WEATHER, metadata={"file_name": "b.txt"})]
+    result = make_splitter(embeddings, breakpoint_percentile=50).split_documents(docs)
+    assert embeddings.calls == 1
+    assert [(d.page_content, d.metadata["file_name"]) for d in result] == [
+        (APPLE, "a.txt"), (CAR, "a.txt"), (WEATHER, "b.txt")]
+
+
+def test_min_chunk_size_larger_than_max():
+    with pytest.raises(ValueError):
+        SemanticTextSplitter(TopicEmbeddings(), min_chunk_size=200, max_chunk_size=100)
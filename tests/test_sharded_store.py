@@ -0,0 +1,63 @@
+import threading
+import time
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import FakeEmbeddings
+
+from server.knowledge_base import sharded_store
+from server.knowledge_base.sharded_store import ShardedFAISS, ShardStaging
+
+DIM = 8
+
+
+def test_concurrent_writes_to_missing_shard_keep_all_vectors(tmp_path, monkeypatch):
+    from_embeddings = FAISS.from_embeddings.__func__
+
+    def slow_from_embeddings(cls, *args, **kwargs):
+        # 放大"检查分片为空 -> 创建分片"之间的窗口
+        time.sleep(0.05)
+        return from_embeddings(cls, *args, **kwargs)
+
+    monkeypatch.setattr(sharded_store.FAISS, "from_embeddings", classmethod(slow_from_embeddings))
+    store = ShardedFAISS.load_or_create(tmp_path / "vector_store_sharded", FakeEmbeddings(size=DIM),
+                                        num_shards=1, max_workers=2)
+    rng = np.random.default_rng(0)
+    barrier = threading.Barrier(2)
+
+    def writer(prefix: str):
+        ids = [f"{prefix}-{i}" for i in range(20)]
+        vectors = rng.normal(size=(len(ids), DIM)).tolist()
+        barrier.wait()
+        store.add_embeddings(zip(ids, vectors), [{} for _ in ids], ids)
+
+    threads = [threading.Thread(target=writer, args=(prefix,)) for prefix in ("a", "b")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert store.ntotal == 40
+
+
+def test_rebuild_shard_publishes_new_version_and_swaps_only_that_shard(tmp_path):
+    store = ShardedFAISS.load_or_create(tmp_path / "vector_store_sharded", FakeEmbeddings(size=DIM), num_shards=4)
+    staged = ShardStaging()
+    ids = [f"doc-{i}" for i in range(40)]
+    vectors = np.random.default_rng(0).normal(size=(len(ids), DIM)).tolist()
+    store.add_embeddings(zip(ids, vectors), [{"i": i} for i in range(len(ids))], ids, staged=staged)
+    store.publish_shards(staged)
+    before_shards, before_versions = list(store.shards), list(store.versions)
+    query = vectors[3]
+    expected = [(d.metadata, round(s, 5)) for d, s in store.search_by_vector(query, k=5)]
+
+    version = store.rebuild_shard(1)
+    assert version and version != before_versions[1]
+    assert store.shards[1] is not before_shards[1]
+    assert store.shards[1].index.ntotal == before_shards[1].index.ntotal
+    # 其他分片不受影响，旧版本目录保留给正在读取的进程
+    assert [s for i, s in enumerate(store.shards) if i != 1] == [s for i, s in enumerate(before_shards) if i != 1]
+    assert (store.shard_path(1) / before_versions[1]).is_dir()
+    assert [(d.metadata, round(s, 5)) for d, s in store.search_by_vector(query, k=5)] == expected
+
+    reloaded = ShardedFAISS.load_or_create(store.folder_path, store.embeddings, num_shards=4)
+    assert reloaded.versions == store.versions and reloaded.ntotal == 40
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+from langchain.schema import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from server.knowledge_base.text_splitter import StreamingTextSplitter
+from server.knowledge_base.utils import TEXT_SEPARATORS
+
+
+def make_text(seed: int = 0, paragraphs: int = 40) -> str:
+    """随机拼出包含各级分隔符的中文文本，个别段落不含标点，强制退到按字符切分"""
+    rng = random.Random(seed)
+    words = ["知识库", "向量检索", "切片", "文档解析", "嵌入模型", "问答", "重排序", "  "]
+    puncts = ["。", "！", "？", "，", "，", "。"]
+    parts = []
+    for p in range(paragraphs):
+        if p % 9 == 8:
+            parts.append("长" * rng.randint(150, 400))
+            continue
+        lines = []
+        for _ in range(rng.randint(1, 4)):
+            sentence = "".join(rng.choice(words) + rng.choice(puncts) for _ in range(rng.randint(1, 12)))
+            lines.append(sentence)
+        parts.append("\n".join(lines))
+    return "\n\n".join(parts)
+
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(20, 0), (50, 10), (100, 20), (250, 50), (500, 100)])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_matches_recursive_character_splitter(chunk_size, chunk_overlap, seed):
+    text = make_text(seed)
+    expected = RecursiveCharacterTextSplitter(chunk_size=chunk_size,
+                                              chunk_overlap=chunk_overlap,
+                                              separators=TEXT_SEPARATORS,
+                                              keep_separator=True).split_text(text)
+    splitter = StreamingTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    assert splitter.split_text(text) == expected
+
+
+def test_start_index_points_into_source():
+    text = make_text(3)
+    doc = Document(page_content=text, metadata={"file_name": "a.txt"})
+    chunks = StreamingTextSplitter(chunk_size=80, chunk_overlap=20).split_documents([doc])
+    assert chunks
+    for chunk in chunks:
+        start = chunk.metadata["start_index"]
+        assert text[start:start + len(chunk.page_content)] == chunk.page_content
+        assert chunk.metadata["file_name"] == "a.txt"
+
+
+def test_short_text_is_single_chunk():
+    assert StreamingTextSplitter(chunk_size=100, chunk_overlap=10).split_text("  你好。\n世界！ ") == ["你好。\n世界！"]
@@ -0,0 +1,73 @@
+import os
+
+from lianxi.doc_tree import doc_tree, tree_cache
+from lianxi.load_text.file_parse.fast_parse import parse_file_fast
+from lianxi.load_text.file_parse.file_parse import PARSER_VERSION
+
+MARKDOWN = "# 第一章\n\n正文\n\n## 1.1 小节\n\n内容\n"
+
+
+def write_markdown(tmp_path, name: str = "doc.md", text: str = MARKDOWN) -> str:
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def fallback_parse(file_path, fast=True):
+    """模拟快速解析未采用、回退到 unstructured 的结果"""
+    doc = parse_file_fast(file_path)
+    doc.update(parser_version=PARSER_VERSION, fallback_from=tree_cache.FAST_PARSER_VERSION)
+    return doc
+
+
+def test_cache_key_records_parser_that_actually_ran(tmp_path, monkeypatch):
+    doc_path = write_markdown(tmp_path)
+    cache_dir = tmp_path / "cache"
+    calls = []
+
+    def counting_parse(file_path, fast=True):
+        calls.append(file_path)
+        return fallback_parse(file_path)
+
+    monkeypatch.setattr(doc_tree, "parse_file", counting_parse)
+    builder = tree_cache.load_doc_tree(doc_path, cache_dir=str(cache_dir))
+    assert builder.doc["parser_version"] == PARSER_VERSION
+    # 回退的结果按 unstructured 的键缓存，不会占用快速解析的键
+    digest = tree_cache.file_hash(doc_path)
+    assert os.listdir(cache_dir) == [f"{tree_cache.cache_key(digest, PARSER_VERSION)}.npz"]
+
+    cached = tree_cache.load_doc_tree(doc_path, cache_dir=str(cache_dir))
+    assert len(calls) == 1
+    assert cached.doc["parser_version"] == PARSER_VERSION
+    assert [n.title for n in cached.store.nodes] == [n.title for n in builder.store.nodes]
+
+    # 快速解析器更新后，回退的结果不再沿用，重新尝试解析
+    monkeypatch.setattr(tree_cache, "FAST_PARSER_VERSION", "fast-next")
+    tree_cache.load_doc_tree(doc_path, cache_dir=str(cache_dir))
+    assert len(calls) == 2
+
+
+def test_fast_parse_result_is_cached_under_fast_key(tmp_path):
+    doc_path = write_markdown(tmp_path)
+    cache_dir = tmp_path / "cache"
+    builder = tree_cache.load_doc_tree(doc_path, cache_dir=str(cache_dir))
+    assert builder.doc["parser_version"] == tree_cache.FAST_PARSER_VERSION
+    digest = tree_cache.file_hash(doc_path)
+    assert os.listdir(cache_dir) == [f"{tree_cache.cache_key(digest, tree_cache.FAST_PARSER_VERSION)}.npz"]
+
+
+def test_cache_evicts_least_recently_used_entries(tmp_path):
+    cache_dir = tmp_path / "cache"
+    paths = [write_markdown(tmp_path, f"doc{i}.md", MARKDOWN + f"\n第 {i} 份\n") for i in range(3)]
+    tree_cache.load_doc_tree(paths[0], cache_dir=str(cache_dir))
+    entry_size = next(os.scandir(cache_dir)).stat().st_size
+    first = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+    os.utime(first, (1, 1))
+    tree_cache.load_doc_tree(paths[1], cache_dir=str(cache_dir))
+    # 命中缓存会刷新使用时间，doc0 变为最近使用
+    tree_cache.load_doc_tree(paths[0], cache_dir=str(cache_dir))
+    tree_cache.load_doc_tree(paths[2], cache_dir=str(cache_dir), max_cache_bytes=entry_size * 2 + entry_size // 2)
+
+    remaining = sorted(os.listdir(cache_dir))
+    assert len(remaining) == 2
+    assert os.path.basename(first) in remaining
@@ -0,0 +1,19 @@
+import pytest
+
+pytest.importorskip("greenlet")
+
+from routers.message_repository import CONVERSATION_NAME_LENGTH, is_auto_named  # noqa: E402
+
+
+@pytest.mark.parametrize("name, query, expected", [
+    ("新对话", "报销流程是什么", True),
+    ("New Chat", "报销流程是什么", True),
+    ("报销流程是什么", "报销流程是什么", True),
+    ("报" * CONVERSATION_NAME_LENGTH, "报" * (CONVERSATION_NAME_LENGTH + 20), True),
+    # 用户自己起的名称恰好是首个问题的前缀，不应被覆盖
+    ("报销", "报销流程是什么", False),
+    ("", "报销流程是什么", False),
+    ("差旅制度", "报销流程是什么", False),
+])
+def test_is_auto_named(name, query, expected):
+    assert is_auto_named(name, query) is expected
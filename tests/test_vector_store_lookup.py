@@ -0,0 +1,24 @@
+import pytest
+
+import server.knowledge_base.utils as kb_utils
+
+
+@pytest.fixture
+def kb_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(kb_utils, "KB_ROOT_PATH", tmp_path)
+    return tmp_path
+
+
+@pytest.mark.parametrize("vs_type", ["faiss", "faiss_sq8", "faiss_sharded"])
+def test_unknown_kb_is_not_created(kb_root, vs_type):
+    with pytest.raises(kb_utils.VectorStoreNotFound):
+        kb_utils.get_vector_store("no_such_kb", vs_type=vs_type)
+    assert not (kb_root / "no_such_kb").exists()
+    assert ("no_such_kb", kb_utils.DEFAULT_EMBED_MODEL, vs_type) not in kb_utils._vs_cache
+
+
+@pytest.mark.parametrize("kb_name", ["../outside", "a/b", ".."])
+def test_invalid_kb_name_is_not_found(kb_root, kb_name):
+    with pytest.raises(kb_utils.VectorStoreNotFound):
+        kb_utils.get_vector_store(kb_name)
+    assert not (kb_root.parent / "outside").exists()
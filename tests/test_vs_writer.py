@@ -0,0 +1,216 @@
+import fcntl
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import FakeEmbeddings
+
+import server.knowledge_base.utils as kb_utils
+from server.knowledge_base.hot_reload import VectorStoreReloader
+from server.knowledge_base.index_versions import StaleVersionError
+from server.knowledge_base.quantization import quantize_vector_store
+from server.knowledge_base.sharded_store import ShardedFAISS, ShardStaging
+from server.knowledge_base.vs_writer import VectorStoreWriter
+
+DIM = 8
+KB_NAME = "writer_kb"
+
+
+@pytest.fixture(autouse=True)
+def kb_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(kb_utils, "KB_ROOT_PATH", tmp_path)
+    monkeypatch.setattr(kb_utils, "_vs_cache", {})
+    monkeypatch.setattr(kb_utils, "_vs_versions", {})
+    monkeypatch.setattr(kb_utils, "_kb_write_locks", {})
+    monkeypatch.setattr(kb_utils, "get_embeddings", lambda embed_model=None: FakeEmbeddings(size=DIM))
+    monkeypatch.setitem(kb_utils.hot_reload_cfg, "enable", False)
+    return tmp_path
+
+
+def add_docs(writer: VectorStoreWriter, prefix: str, n: int) -> None:
+    ids = [f"{prefix}-{i}" for i in range(n)]
+    vectors = np.random.default_rng(len(prefix) + n).normal(size=(n, DIM)).tolist()
+    writer.add(zip(ids, vectors), [{"source": f"{prefix}.docx"} for _ in ids], ids)
+
+
+def test_flat_store_readers_never_see_writes_in_progress():
+    with VectorStoreWriter(KB_NAME, vs_type="faiss") as writer:
+        add_docs(writer, "first", 5)
+    live = kb_utils.get_vector_store(KB_NAME, vs_type="faiss")
+    assert live.index.ntotal == 5
+
+    with VectorStoreWriter(KB_NAME, vs_type="faiss") as writer:
+        add_docs(writer, "second", 3)
+        assert writer.vector_store is not live
+        assert live.index.ntotal == 5
+
+    current = kb_utils.get_vector_store(KB_NAME, vs_type="faiss")
+    assert current is not live and current.index.ntotal == 8
+    # 已取得旧对象的检索继续使用旧版本
+    assert live.index.ntotal == 5
+
+
+def test_sharded_store_readers_never_see_writes_in_progress():
+    with VectorStoreWriter(KB_NAME, vs_type="faiss_sharded") as writer:
+        add_docs(writer, "first", 20)
+    store = kb_utils.get_vector_store(KB_NAME, vs_type="faiss_sharded")
+    live_shards = list(store.shards)
+    assert store.ntotal == 20
+
+    with VectorStoreWriter(KB_NAME, vs_type="faiss_sharded") as writer:
+        add_docs(writer, "second", 20)
+        assert store.shards == live_shards
+        assert store.ntotal == 20
+
+    assert store.ntotal == 40
+    assert sum(s.index.ntotal for s in live_shards if s is not None) == 20
+
+
+@pytest.mark.parametrize("vs_type", ["faiss", "faiss_sharded"])
+def test_failed_ingest_discards_staged_vectors(vs_type):
+    with VectorStoreWriter(KB_NAME, vs_type=vs_type) as writer:
+        add_docs(writer, "first", 10)
+    live = kb_utils.get_vector_store(KB_NAME, vs_type=vs_type)
+    version = kb_utils.read_current_version(kb_utils.get_vs_path(KB_NAME))
+
+    with pytest.raises(RuntimeError):
+        with VectorStoreWriter(KB_NAME, vs_type=vs_type) as writer:
+            add_docs(writer, "second", 10)
+            raise RuntimeError("向量化失败")
+
+    assert kb_utils.get_vector_store(KB_NAME, vs_type=vs_type) is live
+    assert kb_utils.read_current_version(kb_utils.get_vs_path(KB_NAME)) == version
+    ntotal = live.ntotal if vs_type == "faiss_sharded" else live.index.ntotal
+    assert ntotal == 10
+    # 失败后写锁已释放，下一次入库正常发布
+    with VectorStoreWriter(KB_NAME, vs_type=vs_type) as writer:
+        add_docs(writer, "third", 5)
+    current = kb_utils.get_vector_store(KB_NAME, vs_type=vs_type)
+    assert (current.ntotal if vs_type == "faiss_sharded" else current.index.ntotal) == 15
+
+
+def test_quantized_refresh_publishes_new_version_without_touching_mapped_file():
+    with VectorStoreWriter(KB_NAME, vs_type="faiss") as writer:
+        add_docs(writer, "first", 10)
+    quantized = kb_utils.get_vector_store(KB_NAME, vs_type="faiss_sq8")
+    mapped = quantized.rescore_vectors
+    before = np.array(mapped)
+
+    with VectorStoreWriter(KB_NAME, vs_type="faiss") as writer:
+        add_docs(writer, "second", 5)
+
+    # 正在检索的旧对象 mmap 的文件没有被覆盖
+    assert mapped.shape == (10, DIM)
+    assert np.array_equal(np.array(mapped), before)
+    current = kb_utils.get_vector_store(KB_NAME, vs_type="faiss_sq8")
+    assert current is not quantized and current.version != quantized.version
+    assert current.rescore_vectors.shape == (15, DIM)
+
+
+def test_publish_based_on_stale_version_is_rejected():
+    with VectorStoreWriter(KB_NAME, vs_type="faiss") as writer:
+        add_docs(writer, "first", 5)
+    # 两个 worker 基于同一版本写入，后发布的一方不能覆盖先发布的
+    mine, base = kb_utils.load_flat_vector_store(KB_NAME)
+    theirs, _ = kb_utils.load_flat_vector_store(KB_NAME)
+    theirs.add_texts(["theirs"])
+    kb_utils.save_vector_store(KB_NAME, theirs, base_version=base)
+    mine.add_texts(["mine"])
+    with pytest.raises(StaleVersionError):
+        kb_utils.save_vector_store(KB_NAME, mine, base_version=base)
+    assert kb_utils.get_vector_store(KB_NAME, vs_type="faiss").index.ntotal == 6
+
+
+def test_write_lock_excludes_other_processes():
+    with VectorStoreWriter(KB_NAME, vs_type="faiss") as writer:
+        # flock 按打开的文件互斥，另一个进程打开同一个锁文件拿不到锁
+        with open(writer._lock.path, "a") as other:
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(other.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        add_docs(writer, "first", 5)
+    with open(kb_utils.kb_write_lock(KB_NAME).path, "a") as other:
+        fcntl.flock(other.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        fcntl.flock(other.fileno(), fcntl.LOCK_UN)
+
+
+def test_sharded_publish_creates_shard_versions_picked_up_by_other_workers():
+    with VectorStoreWriter(KB_NAME, vs_type="faiss_sharded") as writer:
+        add_docs(writer, "first", 20)
+    store = kb_utils.get_vector_store(KB_NAME, vs_type="faiss_sharded")
+    # 另一个 worker 进程加载的同一个分片向量库
+    other = ShardedFAISS.load_or_create(store.folder_path, store.embeddings, num_shards=store.num_shards)
+    assert other.ntotal == 20 and other.versions == store.versions
+
+    live_dirs = {i: store.shard_path(i) / v for i, v in enumerate(store.versions) if v}
+    with VectorStoreWriter(KB_NAME, vs_type="faiss_sharded") as writer:
+        add_docs(writer, "second", 20)
+    # 新分片写到新的版本目录，正在读取的旧版本目录保持不变
+    for shard_id, shard_dir in live_dirs.items():
+        assert shard_dir.is_dir()
+        assert store.versions[shard_id] != shard_dir.name
+
+    assert other.ntotal == 20
+    assert other.reload_changed_shards()
+    assert other.ntotal == 40 and other.versions == store.versions
+
+    # 基于旧分片版本的副本不能发布
+    stale = ShardedFAISS.load_or_create(store.folder_path, store.embeddings, num_shards=store.num_shards)
+    with VectorStoreWriter(KB_NAME, vs_type="faiss_sharded") as writer:
+        add_docs(writer, "third", 20)
+    staged = ShardStaging()
+    ids = [f"late-{i}" for i in range(20)]
+    vectors = np.random.default_rng(1).normal(size=(20, DIM)).tolist()
+    stale.add_embeddings(zip(ids, vectors), [{} for _ in ids], ids, staged=staged)
+    with pytest.raises(StaleVersionError):
+        stale.publish_shards(staged)
+
+
+def test_reloader_picks_up_quantized_versions_from_other_workers():
+    with VectorStoreWriter(KB_NAME, vs_type="faiss") as writer:
+        add_docs(writer, "first", 10)
+    quantized = kb_utils.get_vector_store(KB_NAME, vs_type="faiss_sq8")
+
+    # 另一个 worker 入库后发布了新的量化版本，本进程缓存的还是旧版本
+    flat, _ = kb_utils.load_flat_vector_store(KB_NAME)
+    flat.add_texts(["from another worker"])
+    published = quantize_vector_store(flat, kb_utils.get_vs_type_path(KB_NAME, "faiss_sq8"), "sq8")
+    assert kb_utils.get_vector_store(KB_NAME, vs_type="faiss_sq8") is quantized
+
+    VectorStoreReloader().check_once()
+    current = kb_utils.get_vector_store(KB_NAME, vs_type="faiss_sq8")
+    assert current is not quantized
+    assert current.version == published.version
+    assert current.rescore_vectors.shape == (11, DIM)
+
+
+@pytest.mark.parametrize("vs_type", ["faiss", "faiss_sharded"])
+def test_reingest_replaces_file_chunks_in_one_publish(vs_type):
+    def add_file(writer, file_name, n):
+        ids = [f"{file_name}-{writer.kb_name}-{i}-{len(writer.ids)}" for i in range(n)]
+        vectors = np.random.default_rng(n).normal(size=(n, DIM)).tolist()
+        writer.add(zip(ids, vectors), [{"file_name": file_name} for _ in ids], ids)
+        return ids
+
+    with VectorStoreWriter(KB_NAME, vs_type=vs_type) as writer:
+        old_ids = add_file(writer, "a.docx", 6)
+        add_file(writer, "b.docx", 4)
+
+    def ntotal():
+        store = kb_utils.get_vector_store(KB_NAME, vs_type=vs_type)
+        return store.ntotal if vs_type == "faiss_sharded" else store.index.ntotal
+
+    # 数据库写入失败时旧切片和新切片都不发布
+    with pytest.raises(RuntimeError):
+        with VectorStoreWriter(KB_NAME, vs_type=vs_type) as writer:
+            assert sorted(writer.file_doc_ids("a.docx")) == sorted(old_ids)
+            writer.delete(old_ids)
+            add_file(writer, "a.docx", 3)
+            raise RuntimeError("数据库写入失败")
+    assert ntotal() == 10
+
+    with VectorStoreWriter(KB_NAME, vs_type=vs_type) as writer:
+        writer.delete(old_ids + writer.file_doc_ids("a.docx"))
+        new_ids = add_file(writer, "a.docx", 3)
+    assert ntotal() == 7
+    with VectorStoreWriter(KB_NAME, vs_type=vs_type) as writer:
+        assert sorted(writer.file_doc_ids("a.docx")) == sorted(new_ids)
+        assert len(writer.file_doc_ids("b.docx")) == 4